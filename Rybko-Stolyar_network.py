@@ -4,9 +4,14 @@ import click
 import logging
 import numpy as np
 import os
-import matplotlib.pyplot as plt
-import matplotlib.patches as patches
-from lib.movingaverage import MovingAverage
+from lib import pyramid, rybkostolyar
+from lib.cache import SimulationCache
+from lib.plotting import pyplot, save_figure
+from lib.profiling import Profile
+from lib.randomstream import RandomStream
+from lib.recorder import Recorder, StreamRecorder
+from lib.rybkostolyar import MODEL, MODEL_VERSION, QUEUE_FIELDS, RECORDING_FIELDS, find_regions, moving_averages
+from lib.telemetry import Telemetry
 
 
 @click.command()
@@ -21,34 +26,58 @@ from lib.movingaverage import MovingAverage
 @click.option('--save-to-file/--no-save-to-file', default=True, help='Enable saving pictures to files.', show_default=True)
 @click.option('--output-dir', default="./output", help='Set the output directory for pictures.')
 @click.option('--seed', default=8086, help='Seed used to generate random quantities.')
-@click.option('--av', default=30, help='Windows parameter to compute moving averages.')
+@click.option('--av', default=30, help='Window of the moving averages of the flows into and out of queues A0 and B0.')
 @click.option('--version', default='', help='Suffix to append to the output files. Example: "v1" ')
 @click.option('--cut/--no-cut', default=True, help='Visualize the cut region.', show_default=True)
 @click.option('--cut-level', default=6000, help='Denote a which level to start the cut.')
-@click.option('--cache/--no-cache', default=True, help='Read the simulation data form a file.', show_default=True)
+@click.option('--cache/--no-cache', default=True, help='Read the simulation data from the cache when available.', show_default=True)
 @click.option('--cache-dir', default="./cache", help='Set the cache directory for simulations.')
+@click.option('--checkpoint-every', default=10 ** 6,
+              help='Store the simulation in the cache every this many steps, so that an interrupted run can be '
+                   'resumed. 0 disables it.')
+@click.option('--cache-max-size', default=None, type=float,
+              help='Evict the least recently used simulations to keep the cache directory below this size in MB.')
 @click.option('--record/--no-record', default=True, help='Record simulation data and pictures to files.', show_default=True)
 @click.option('--debug/--no-debug', default=False, help='Enable debugging behaviour.', show_default=True)
 @click.option('--show-progress/--no-show-progress', default=True, help='Show percentage of simulation completed.', show_default=True)
+@click.option('--stream-record/--no-stream-record', default=False, show_default=True,
+              help='Stream the recording into a memory-mapped file in the cache directory while simulating. '
+                   'Implies --record.')
+@click.option('--replicas', default=1, help='Number of independent replicas simulated together. '
+                                            'The pictures show the first one, the telemetry the largest values.')
+@click.option('--profile/--no-profile', default=False, show_default=True,
+              help='Log the time spent in each phase of the simulation steps, with the steps per second.')
+@click.option('--telemetry', default=None,
+              help='Append JSON lines on the progress of the simulation to this file, "-" for stdout: steps per '
+                   'second, time left, last and largest recorded queue lengths, memory and recording size.')
+@click.option('--telemetry-every', default=10., show_default=True, help='Seconds between two telemetry lines.')
+@click.option('--headless/--no-headless', default=False, show_default=True,
+              help='Batch mode: never open a window and only draw the pictures saved to files, with the Agg backend.')
 def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, output_dir, seed, av,
-         version, cut, cut_level, cache, cache_dir, record, debug, show_progress):
-    queue_A0 = queue_B0 = None
-    queue_Aj = queue_Bj = None
-    max_queue_Aj = max_queue_Bj = None
-    avIn_queue_A0 = avOut_queue_A0 = avIn_queue_B0 = avOut_queue_B0 = None
-    recording = []
+         version, cut, cut_level, cache, cache_dir, record, debug, show_progress, replicas,
+         stream_record, cache_max_size, checkpoint_every, headless, profile,
+         telemetry, telemetry_every):
+    recording = None
+    recording_pyramid = None
+    regions = None
+    rng = None
 
     logging.basicConfig(format='%(levelname)s: %(message)s')
     logger = logging.getLogger(__name__)
     logger.setLevel(level=logging.DEBUG if debug else logging.INFO)
     logger.info(f'a={a}, nu={nu}, J={j}, init-A0={init_a0}')
 
+    params = dict(a=a, nu=nu, j=j, init_a0=init_a0, init_aj=init_aj, init_b0=init_b0, init_bj=init_bj,
+                  seed=seed, replicas=replicas)  # the runtime is not part of the cache key
+    simulation_cache = SimulationCache(cache_dir, MODEL, MODEL_VERSION,
+                                       None if cache_max_size is None else int(cache_max_size * 2 ** 20))
+
     def set_seed(s):
+        nonlocal rng
         if s is None:
-            np.random.seed(None)
-            s = np.random.randint(0, 100000)
+            s = int(np.random.default_rng().integers(0, 100000))
         logger.info(f'SEED: {s}')
-        np.random.seed(s)
+        rng = RandomStream(s)
 
     def get_filename(prefix="simulation", suffix="", type=".pdf"):
         sx = suffix
@@ -60,74 +89,29 @@ def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, ou
                + '_nu' + str(nu) \
                + '_r' + str(runtime) \
                + '_seed' + str(seed) \
+               + ('_n' + str(replicas) if replicas > 1 else '') \
                + sx \
                + type
 
-    def save_recording(dir):
-        basedir = os.path.join(os.getcwd(), "cache") if dir is None else dir
-        filename = get_filename(type=".npy")
-        np.save(os.path.join(basedir, filename), recording)
-
-    def load_recording(dir):
-        basedir = os.path.join(os.getcwd(), "cache") if dir is None else dir
-        filename = get_filename(type=".npy")
-        return np.load(os.path.join(basedir, filename))
-
-    def column(matrix, i, j=None):
-        if j is not None:
-            return [row[i][j] for row in matrix]
-        return [row[i] for row in matrix]
-
-    def rec():
-        min_queue_Aj = min(queue_Aj)
-        min_queue_Bj = min(queue_Bj)
-        recording.append(
-            [[queue_A0, max_queue_Aj, min_queue_Aj, avIn_queue_A0.get(), avOut_queue_A0.get()],
-             [queue_B0, max_queue_Bj, min_queue_Bj, avIn_queue_B0.get(), avOut_queue_B0.get()],
-             ])  # ** recording R3
-
-    def find_regions(level=400, empty_A0=0):
-        margin_left = 0  # for the cut window
-        margin_right = 0.15  # for the cut window
-
-        rec_queue_A0 = column(recording, 0, 0)
-        rec_max_queue_Aj = column(recording, 0, 1)
-        rec_queue_B0 = column(recording, 1, 0)
-        rec_max_queue_Bj = column(recording, 1, 1)
-
-        reach_level = 0
-        for x in rec_queue_B0:
-            if x >= level:
-                break
-            reach_level += 1
-
-        reach_empty_queue_A0 = reach_level
-        for x in rec_queue_A0[reach_level:]:
-            if x <= empty_A0:
-                break
-            reach_empty_queue_A0 += 1
-
-        previous_empty_queue_A0 = reach_level
-        for x in range(reach_level):
-            if rec_queue_A0[reach_level - x] <= empty_A0:
-                break
-            previous_empty_queue_A0 -= 1
-
-        start_equilibrium = previous_empty_queue_A0
-        for x in range(reach_level - previous_empty_queue_A0):
-            if rec_queue_A0[previous_empty_queue_A0 + x] <= nu * rec_max_queue_Aj[previous_empty_queue_A0 + x]:
-                break
-            start_equilibrium += 1
-
-        end_equilibrium = reach_empty_queue_A0
-        for x in range(len(rec_queue_A0[reach_empty_queue_A0:])):
-            if rec_queue_B0[reach_empty_queue_A0 + x] <= nu * rec_max_queue_Bj[reach_empty_queue_A0 + x]:
-                break
-            end_equilibrium += 1
-
-        start = start_equilibrium - int((end_equilibrium - start_equilibrium) * margin_left)
-        end = end_equilibrium + int((end_equilibrium - start_equilibrium) * margin_right)
-        return [start, [start_equilibrium, reach_empty_queue_A0, end_equilibrium], end]
+    def new_recording(capacity, shape=()):
+        if stream_record:
+            return StreamRecorder(simulation_cache.file(params), RECORDING_FIELDS, capacity, shape)
+        return Recorder(RECORDING_FIELDS, capacity, shape)
+
+    def save_recording(steps, state=None, snapshot=False):
+        simulation_cache.store(params, recording, steps, state, snapshot)
+
+    def save_checkpoint(steps, state):
+        save_recording(steps, state, snapshot=True)
+
+    def load_recording():
+        return simulation_cache.load(params, runtime)
+
+    def load_state(steps):
+        return simulation_cache.load_state(params, steps)
+
+    def load_pyramid():
+        return simulation_cache.load_pyramid(params)
 
     def plot(show_cut=True, cut=False):
         start_cut = end_cut = None
@@ -142,37 +126,33 @@ def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, ou
             ax.xaxis.offsetText.set_fontsize(16)
 
         if cut or show_cut:
-            [start_cut, divisions, end_cut] = find_regions(cut_level, nu ** 2)
+            [start_cut, divisions, end_cut] = regions
         if cut:
             [start, end] = [start_cut, end_cut]
             # plt.subplot(2, 1, 1)
         else:
             [start, end] = [0, runtime]
-        t = range(start, end)
 
-        # station A
-        rec_scaled_queue_A0 = [x / nu for x in column(recording, 0, 0)[start:end]]
-        rec_max_queue_Aj = column(recording, 0, 1)[start:end]
-        rec_min_queue_Aj = column(recording, 0, 2)[start:end]
+        def series(name, scale=1):
+            # points to draw of a recorded series over [start, end), from the blocks of the pyramid
+            t, values = recording_pyramid.envelope(recording, name, start, end)
+            return t, values / scale
 
+        # station A
         tmp_label = '$Q_{A_0} / \\nu$'
-        plt.plot(t, rec_scaled_queue_A0, lw=1, label=tmp_label, color='black')
+        plt.plot(*series('A0', nu), lw=1, label=tmp_label, color='black')
         tmp_label = '$\\max_{j>0} Q_{A_j}$'
-        plt.plot(t, rec_max_queue_Aj, lw=1, label=tmp_label, color="black", ls='--')
+        plt.plot(*series('maxAj'), lw=1, label=tmp_label, color="black", ls='--')
         tmp_label = '$\\min_{j>0} Q_{A_j}$'
-        plt.plot(t, rec_min_queue_Aj, lw=1, label=tmp_label, color="black", ls='--')
+        plt.plot(*series('minAj'), lw=1, label=tmp_label, color="black", ls='--')
 
         # station B
-        rec_scaled_queue_B0 = [x / nu for x in column(recording, 1, 0)[start:end]]
-        rec_max_queue_Bj = column(recording, 1, 1)[start:end]
-        rec_min_queue_Bj = column(recording, 1, 2)[start:end]
-
         tmp_label = '$Q_{B_0} / \\nu$'
-        plt.plot(t, rec_scaled_queue_B0, lw=1, label=tmp_label, color='gray')
+        plt.plot(*series('B0', nu), lw=1, label=tmp_label, color='gray')
         tmp_label = '$\\max_{j>0} Q_{B_j}$'
-        plt.plot(t, rec_max_queue_Bj, lw=1, label=tmp_label, color="gray", ls='--')
+        plt.plot(*series('maxBj'), lw=1, label=tmp_label, color="gray", ls='--')
         tmp_label = '$\\min_{j>0} Q_{B_j}$'
-        plt.plot(t, rec_min_queue_Bj, lw=1, label=tmp_label, color="gray", ls='--')
+        plt.plot(*series('minBj'), lw=1, label=tmp_label, color="gray", ls='--')
 
         plt.legend(loc='upper left', fontsize=18, markerscale=0.85, numpoints=1, handlelength=4.5)
 
@@ -198,7 +178,7 @@ def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, ou
 
             ystart, yend = plt.gca().get_ylim()
             yticks = np.arange(0, yend, 500)
-            yticks = np.append(yticks, rec_scaled_queue_A0[0])
+            yticks = np.append(yticks, recording['A0'][start] / nu)
             plt.yticks(yticks)
 
             # Put a legend to the right of the current axis
@@ -206,9 +186,10 @@ def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, ou
 
         elif show_cut:
             margin_vertical = 0.05  # for the cut window
-            h = max([max(rec_scaled_queue_A0[start_cut:end_cut]), max(rec_scaled_queue_B0[start_cut:end_cut])])
+            h = max(recording_pyramid.stats(recording, 'A0', start_cut, end_cut)[1],
+                    recording_pyramid.stats(recording, 'B0', start_cut, end_cut)[1]) / nu
             b = end_cut - start_cut
-            ax.add_patch(patches.Rectangle(
+            ax.add_patch(plt.Rectangle(
                 (start_cut, - h * margin_vertical),
                 b, h * (1 + 2 * margin_vertical),
                 fill=False, linestyle='-.'
@@ -220,132 +201,99 @@ def main(a, nu, j, init_a0, init_aj, init_b0, init_bj, runtime, save_to_file, ou
 
             ystart, yend = plt.gca().get_ylim()
             yticks = np.arange(0, yend, 1500)
-            yticks = np.append(yticks, rec_scaled_queue_A0[start_cut])
+            yticks = np.append(yticks, recording['A0'][start_cut] / nu)
             plt.yticks(yticks)
 
         plt.xlabel('time', fontsize='xx-large')
 
-    def simulate(a, nu, j, runtime, init_a0=0, init_aj=0, init_b0=0, init_bj=0):
-        nonlocal queue_A0, queue_B0
-        nonlocal queue_Aj, queue_Bj, max_queue_Aj, max_queue_Bj
-        nonlocal avIn_queue_A0, avOut_queue_A0, avIn_queue_B0, avOut_queue_B0
+    def simulate(state=None, previous=None):
+        # with a state, the simulation resumes from it and extends the previous recording;
+        # the replicas are simulated at once by the ensemble
         nonlocal recording
 
-        np.random.seed()
-
-        queue_A0 = init_a0
-        queue_Aj = np.full(j, init_aj)
-        sum_queue_Aj = sum(queue_Aj)
-        max_queue_Aj = max(queue_Aj)
-        max_queue_A = max([queue_A0, max_queue_Aj])
-        avIn_queue_A0 = MovingAverage(av)
-        avOut_queue_A0 = MovingAverage(av)
-
-        queue_B0 = init_b0
-        queue_Bj = np.full(j, init_bj)
-        sum_queue_Bj = sum(queue_Bj)
-        max_queue_Bj = max(queue_Bj)
-        max_queue_B = max([queue_B0, max_queue_Bj])
-        avIn_queue_B0 = MovingAverage(av)
-        avOut_queue_B0 = MovingAverage(av)
-
-        logger.debug(f'maxA: {max_queue_A}, maxB: {max_queue_B}')
-
-        for _time in range(runtime):
-
-            if show_progress and (_time * 100 / runtime % 1 == 0):
-                logger.info(f'{_time * 100 / runtime}% DONE')
-            
-            # arrivals at component A
-            arrA = 0
-            if np.random.random() < a:
-                arrA = np.random.randint(0, j)
-                queue_Aj[arrA] += 1
-                sum_queue_Aj += 1
-
-            # arrivals at component B
-            arrB = 0
-            if np.random.random() < a:
-                arrB = np.random.randint(0, j)
-                queue_Bj[arrB] += 1
-                sum_queue_Bj += 1
-
-            in_queue_A0 = 0
-            in_queue_B0 = 0
-            out_queue_A0 = 0
-            out_queue_B0 = 0
-
-            # Component A
-            max_queue_Aj = max(queue_Aj)
-            ix_max_queue_Aj = np.argmax(queue_Aj)
-            if queue_A0 >= nu * max_queue_Aj:
-                if queue_A0 > 0:
-                    out_queue_A0 = 1
-                    queue_A0 -= out_queue_A0
-            else:
-                svr_packets_A = min(nu, queue_Aj[ix_max_queue_Aj])
-                queue_Aj[ix_max_queue_Aj] -= svr_packets_A
-                sum_queue_Aj -= svr_packets_A
-                in_queue_B0 = svr_packets_A
-                queue_B0 += in_queue_B0
-
-            # Comnponent B
-            max_queue_Bj = max(queue_Bj)
-            ix_max_queue_Bj = np.argmax(queue_Bj)
-            if queue_B0 >= nu * max_queue_Bj:
-                if queue_B0 > 0:
-                    out_queue_B0 = 1
-                    queue_B0 -= out_queue_B0
-            else:
-                svr_packets_B = min(nu, queue_Bj[ix_max_queue_Bj])
-                queue_Bj[ix_max_queue_Bj] -= svr_packets_B
-                sum_queue_Bj -= svr_packets_B
-                in_queue_A0 = svr_packets_B
-                queue_A0 += in_queue_A0
-
-            avIn_queue_A0.push(in_queue_A0)
-            avOut_queue_A0.push(out_queue_A0)
-            avIn_queue_B0.push(in_queue_B0)
-            avOut_queue_B0.push(out_queue_B0)
-
-            if debug:
-                max_queue_A = max([queue_A0, max_queue_Aj])
-                max_queue_B = max([queue_B0, max_queue_Bj])
-                logger.debug('arrA: {arrA}, arrB: {arrB}')
-                logger.debug('maxA: {max_queue_A}, maxB: {max_queue_B}')
-
-            rec()  # save data to recording variable
-
-        if record:
-            save_recording(cache_dir)
-
+        recording = new_recording(runtime, (replicas,) if replicas > 1 else ())
+        if state is not None:
+            recording.extend(previous.array())
+
+        keep = record or stream_record
+        simulation_profile = Profile() if profile else None
+        steps = runtime - (0 if state is None else state['time'])
+        simulation_telemetry = None if telemetry is None else \
+            Telemetry(telemetry, telemetry_every, fields=QUEUE_FIELDS, model=MODEL, **params)
+        options = dict(state=state, checkpoint=save_checkpoint if keep else None, checkpoint_every=checkpoint_every,
+                       show_progress=show_progress, logger=logger, profile=simulation_profile,
+                       telemetry=simulation_telemetry)
+        if replicas > 1:
+            blocks = rybkostolyar.simulate_ensemble_blocks(rng, a, nu, j, runtime, replicas,
+                                                           init_a0, init_aj, init_b0, init_bj, **options)
+        else:
+            blocks = rybkostolyar.simulate_blocks(rng, a, nu, j, runtime, init_a0, init_aj, init_b0, init_bj,
+                                                  **options)
+        blocks.record(recording, save_recording if keep else None)
+        state = blocks.state
+        if profile:
+            for line in simulation_profile.report(steps):
+                logger.info(line)
+        if keep:
+            save_recording(runtime, state)
+
+    cached_runtime = 0
     if cache:
+        recording, cached_runtime = load_recording()
+    if cached_runtime == runtime:
         logger.warning('Reading from CACHE')
-        recording = load_recording(cache_dir)
     else:
-        set_seed(seed)
-        simulate(a, nu, j, runtime, init_a0, init_aj, init_b0, init_bj)
+        cached_state = load_state(cached_runtime) if cached_runtime > 0 else None
+        if cached_state is None:
+            set_seed(seed)
+        else:
+            logger.warning(f'Extending the CACHED simulation from time {cached_runtime}')
+        simulate(cached_state, recording)
+
+    if replicas > 1:
+        final_queues = recording['A0'][-1] + recording['B0'][-1]
+        logger.info(f'{replicas} replicas, final A0+B0: mean {final_queues.mean()}, max {final_queues.max()}')
+        recording = recording.replica(0)
+
+    # minima and maxima of the recorded series over blocks of all sizes, to search and draw the recording
+    # with a few blocks instead of all its rows; the pyramid of a recording that is not cached is built here
+    if cache or record or stream_record:
+        recording_pyramid = load_pyramid()
+    if recording_pyramid is not None and replicas > 1:
+        recording_pyramid = recording_pyramid.replica(0)
+    if recording_pyramid is None:
+        recording_pyramid = pyramid.build(recording.array())
+
+    averages = moving_averages({name: recording[name][-av:] for name in recording.fields}, av)  # the final ones
+    logger.info('final moving averages: ' + ', '.join(f'{name} {series[-1]:.3f}' for name, series in averages.items()))
+
+    if cut and recording_pyramid.stats(recording, 'B0')[1] < cut_level:
+        logger.warning(f'Queue B0 never reaches the cut level {cut_level}, the cut region is not shown')
+        cut = False
+    regions = find_regions(recording, nu, cut_level, nu ** 2, pyramid=recording_pyramid) if cut else None
+
+    if headless and not save_to_file:
+        return  # no picture to draw
 
     basedir = os.path.expanduser("~") + '/Desktop/' if output_dir is None else output_dir
 
+    plt = pyplot(headless)
     plt.figure(figsize=(20, 6))
     plot(show_cut=cut)
     if save_to_file:
-        filename = get_filename(suffix=version)
-        plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300)
-        filename = get_filename(suffix=version, type=".jpeg")
-        plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300, format='JPG')
-    plt.show()
+        save_figure(plt.gcf(), [os.path.join(basedir, get_filename(suffix=version)),
+                                os.path.join(basedir, get_filename(suffix=version, type=".jpeg"))])
+    if not headless:
+        plt.show()
 
     if cut:
         plt.figure(figsize=(20, 4))
         plot(cut=True)
         if save_to_file:
-            filename = get_filename('cut-simulation', suffix=version)
-            plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300)
-            filename = get_filename('cut-simulation', suffix=version, type=".jpeg")
-            plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300, format='JPG')
-        plt.show()
+            save_figure(plt.gcf(), [os.path.join(basedir, get_filename('cut-simulation', suffix=version)),
+                                    os.path.join(basedir, get_filename('cut-simulation', suffix=version, type=".jpeg"))])
+        if not headless:
+            plt.show()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+# THIS FILE TIMES THE SIMULATIONS, THE DATA STRUCTURES AND THE PLOTTING AGAINST STORED BASELINES
+
+import click
+import json
+import logging
+import os
+import sys
+from lib.benchmark import BENCHMARKS, compare, environment, run
+
+
+@click.command()
+@click.option('--filter', 'filters', multiple=True,
+              help='Only run the benchmarks whose name contains this text. Repeat it to run several groups.')
+@click.option('--repeat', default=3, help='Runs of each benchmark, of which the fastest is kept.')
+@click.option('--output', default="./output/benchmark.json", help='File of the results.')
+@click.option('--baseline', default="./benchmarks/baseline.json", help='File of the baseline results.')
+@click.option('--threshold', default=0.3, show_default=True,
+              help='Slow down over the baseline beyond which a benchmark is a regression, 0.3 for 30%.')
+@click.option('--update-baseline/--no-update-baseline', default=False, show_default=True,
+              help='Store the results as the new baseline of the benchmarks that were run.')
+def main(filters, repeat, output, baseline, threshold, update_baseline):
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    logger = logging.getLogger(__name__)
+    logger.setLevel(level=logging.INFO)
+
+    names = [name for name in BENCHMARKS if not filters or any(f in name for f in filters)]
+    if not names:
+        raise click.BadParameter(f'no benchmark matches, the benchmarks are: {", ".join(BENCHMARKS)}',
+                                 param_hint='--filter')
+
+    def progress(name, seconds, time):
+        logger.info(f'{name}: {seconds:.4f}s, {time:.2f} times the calibration loop')
+
+    def write(file, report):
+        os.makedirs(os.path.dirname(os.path.abspath(file)), exist_ok=True)
+        with open(file, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    stored = None
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            stored = json.load(f)
+
+    results, relative = run(names, repeat, progress)
+
+    rows = None
+    if stored is not None and not update_baseline:
+        # the times are compared relative to the calibration loop, see lib.benchmark.run; the benchmarks
+        # found slower are run again, as the machine may just have been busy, keeping their best times
+        rows = compare(relative, stored['relative'], threshold)
+        slower = [row[0] for row in rows if row[4]]
+        if slower:
+            logger.info(f'Running again {", ".join(slower)}')
+            results_again, relative_again = run(slower, 2 * repeat, progress)
+            for name in slower:
+                results[name] = min(results[name], results_again[name])
+                relative[name] = min(relative[name], relative_again[name])
+            rows = compare(relative, stored['relative'], threshold)
+
+    report = dict(environment(), repeat=repeat, results=results, relative=relative)
+    write(output, report)
+    logger.info(f'Results written to {output}')
+
+    if update_baseline:
+        # the benchmarks that were not run keep their baseline
+        write(baseline, dict(report, results=dict(stored['results'] if stored else {}, **results),
+                             relative=dict(stored['relative'] if stored else {}, **relative)))
+        logger.info(f'Baseline written to {baseline}')
+        return
+    if stored is None:
+        logger.warning(f'No baseline in {baseline}, run with --update-baseline to store one')
+        return
+    if environment() != {name: stored.get(name) for name in environment()}:
+        logger.warning('The baseline was measured in another environment: '
+                       + ', '.join(f'{name} {value}' for name, value in environment().items()
+                                   if stored.get(name) != value))
+
+    width = max(len(name) for name in names)
+    logger.info(f'{"benchmark":<{width}} {"baseline":>10} {"now":>10} {"ratio":>7}')
+    for name, base, time, ratio, regressed in rows:
+        logger.info(f'{name:<{width}} {base:10.2f} {time:10.2f} {ratio:7.2f}' + ('  REGRESSION' if regressed else ''))
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        logger.error(f'{len(regressions)} benchmarks are more than {threshold:.0%} slower than the baseline: '
+                     + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
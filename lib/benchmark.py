@@ -0,0 +1,200 @@
+import numpy as np
+import os
+import platform
+import tempfile
+from time import perf_counter
+from lib import multiclass, network, pyramid, rybkostolyar, variablespeed
+from lib.indexedmax import IndexedMax
+from lib.movingaverage import MovingAverage
+from lib.multiclassqueue import MulticlassQueue
+from lib.plotting import envelope, pyplot, save_figure
+from lib.randomstream import RandomStream
+from lib.sweep import MODELS
+
+SEED = 8086
+
+
+def _kernel(module, runtime, **params):
+    def make():
+        rng = RandomStream(SEED)
+        return lambda: module.simulate(rng, runtime=runtime, **dict(MODELS[module.MODEL][1], **params))
+    return make
+
+
+def _network(make, runtime, **params):
+    # the network of a figure simulated by the generic engine, to compare with the kernel of its model
+    def setup():
+        rng = RandomStream(SEED)
+        return lambda: network.simulate(make(**params), rng, runtime)
+    return setup
+
+
+def _queue_push():
+    queue = MulticlassQueue(20)
+    return lambda: [queue.push(3) for _ in range(10 ** 5)]
+
+
+def _queue_serve():
+    # a queue of packets of all the classes, served by amounts spanning parts of cycles and whole cycles
+    queue = MulticlassQueue(20)
+    for _ in range(2000):
+        queue.push(5)
+        queue.serve(7)
+    amounts = np.random.default_rng(SEED).integers(1, 60, 10 ** 4).tolist()
+
+    def run():
+        for amount in amounts:
+            queue.push(5)
+            queue.serve(amount)
+    return run
+
+
+def _queue_workload():
+    queue = MulticlassQueue(20)
+    for _ in range(1000):
+        queue.push(5)
+        queue.serve(7)
+    return lambda: [queue.workload() for _ in range(10 ** 6)]
+
+
+def _moving_average_push():
+    average = MovingAverage(1000)
+    values = np.random.default_rng(SEED).integers(0, 2, 10 ** 5).tolist()
+    return lambda: [average.push(value) for value in values]
+
+
+def _moving_average_push_many():
+    values = np.random.default_rng(SEED).integers(0, 2, 10 ** 6)
+    return lambda: MovingAverage(1000).push_many(values)
+
+
+def _indexed_max_add():
+    queues = IndexedMax(np.zeros(100, np.int64))
+    changes = np.random.default_rng(SEED).integers(0, 100, 10 ** 5).tolist()
+    return lambda: [(queues.add(i, 1), queues.max()) for i in changes]
+
+
+def _series():
+    # six series with the length and the spikes of those of Figure 2
+    walks = np.cumsum(np.random.default_rng(SEED).integers(-1, 2, (6, 5 * 10 ** 5)), axis=1)
+    return np.abs(walks)
+
+
+def _envelope():
+    series = _series()
+    t = np.arange(series.shape[1])
+    return lambda: [envelope(t, values) for values in series]
+
+
+def _pyramid_build():
+    recording = np.zeros(10 ** 7, [('A0', np.int64)])
+    recording['A0'] = _series()[0].repeat(20)
+    return lambda: pyramid.build(recording)
+
+
+def _pyramid_envelope():
+    # the points of a series of 10^7 steps to draw, from its pyramid
+    recording = np.zeros(10 ** 7, [('A0', np.int64)])
+    recording['A0'] = _series()[0].repeat(20)
+    recording_pyramid = pyramid.build(recording)
+    return lambda: [recording_pyramid.envelope(recording, 'A0', start) for start in range(0, 10 ** 6, 10 ** 4)]
+
+
+def _export():
+    # the plot and the export of a figure of the size of Figure 2 to PDF and JPEG
+    plt = pyplot(headless=True)
+    series = _series()
+    t = np.arange(series.shape[1])
+    directory = tempfile.mkdtemp()
+
+    def run():
+        figure = plt.figure(figsize=(20, 6))
+        for values in series:
+            plt.plot(*envelope(t, values), lw=1)
+        save_figure(figure, [os.path.join(directory, 'figure.pdf'), os.path.join(directory, 'figure.jpeg')])
+        plt.close(figure)
+    return run
+
+
+# name of each benchmark and the function that sets it up and returns the function to time
+BENCHMARKS = {
+    'kernel/rybko-stolyar/J=10,runtime=100000': _kernel(rybkostolyar, 10 ** 5, j=10),
+    'kernel/rybko-stolyar/J=30,runtime=100000': _kernel(rybkostolyar, 10 ** 5, j=30),
+    'kernel/rybko-stolyar/J=30,runtime=300000': _kernel(rybkostolyar, 3 * 10 ** 5, j=30),
+    'kernel/rybko-stolyar/J=100,runtime=100000': _kernel(rybkostolyar, 10 ** 5, j=100),
+    'kernel/multiclass/K=5,runtime=20000': _kernel(multiclass, 2 * 10 ** 4, k=5),
+    'kernel/multiclass/K=20,runtime=20000': _kernel(multiclass, 2 * 10 ** 4, k=20),
+    'kernel/multiclass/K=20,runtime=50000': _kernel(multiclass, 5 * 10 ** 4, k=20),
+    'kernel/multiclass/K=50,runtime=20000': _kernel(multiclass, 2 * 10 ** 4, k=50),
+    'kernel/variablespeed/m=5,runtime=100000': _kernel(variablespeed, 10 ** 5, m=5),
+    'kernel/variablespeed/m=20,runtime=100000': _kernel(variablespeed, 10 ** 5, m=20),
+    'kernel/variablespeed/m=20,runtime=500000': _kernel(variablespeed, 5 * 10 ** 5, m=20),
+    'kernel/variablespeed/m=80,runtime=100000': _kernel(variablespeed, 10 ** 5, m=80),
+    'network/rybko-stolyar/J=30,runtime=100000': _network(network.rybko_stolyar, 10 ** 5, a=7/12, nu=6, j=30,
+                                                          init_a0=2400),
+    'network/multiclass/K=20,runtime=20000': _network(network.multiclass, 2 * 10 ** 4, a=1, epsilon=0.1791, k=20,
+                                                      init_a0=55),
+    'network/variablespeed/m=20,runtime=100000': _network(network.variable_speed, 10 ** 5, a=1, epsilon=0.1791,
+                                                          m=20, init_a0=55),
+    'MulticlassQueue.push/10^5': _queue_push,
+    'MulticlassQueue.serve/10^4': _queue_serve,
+    'MulticlassQueue.workload/10^6': _queue_workload,
+    'MovingAverage.push/10^5': _moving_average_push,
+    'MovingAverage.push_many/10^6': _moving_average_push_many,
+    'IndexedMax.add/10^5': _indexed_max_add,
+    'plotting/envelope/6x500000': _envelope,
+    'pyramid/build/10^7': _pyramid_build,
+    'pyramid/envelope/100x10^7': _pyramid_envelope,
+    'plotting/export/6x500000': _export,
+}
+
+
+def _calibration():
+    # a fixed pure Python loop, like those of the kernels, timed along with each benchmark
+    total = 0
+    for i in range(10 ** 6):
+        total += i & 7
+    return total
+
+
+def _timed(function) -> float:
+    start = perf_counter()
+    function()
+    return perf_counter() - start
+
+
+def run(names, repeat: int = 3, progress=None):
+    # best time in seconds of `repeat` runs of each benchmark, each one set up anew before its run, and
+    # that time relative to the best time of the calibration loop run just before each of them: the
+    # machines the benchmarks run on change speed over minutes, with the load of the other processes
+    # and their clock, which the relative times leave out.
+    # progress(name, seconds, relative) is called after each benchmark
+    results, relative = {}, {}
+    for name in names:
+        best = best_calibration = float('inf')
+        for _ in range(repeat):
+            function = BENCHMARKS[name]()
+            best_calibration = min(best_calibration, _timed(_calibration))
+            best = min(best, _timed(function))
+        results[name] = best
+        relative[name] = best / best_calibration
+        if progress is not None:
+            progress(name, best, relative[name])
+    return results, relative
+
+
+def environment() -> dict:
+    # what the timings depend on besides the code, stored with them
+    return dict(python=platform.python_version(), numpy=np.__version__, machine=platform.machine(),
+                processor=platform.processor(), system=platform.system(), cpus=os.cpu_count())
+
+
+def compare(relative: dict, baseline: dict, threshold: float):
+    # (name, baseline, relative time, ratio, regressed) of each benchmark of the baseline that was run,
+    # comparing the times relative to the calibration, a regression being a ratio more than 1 + threshold
+    rows = []
+    for name, time in relative.items():
+        if name in baseline:
+            ratio = time / baseline[name]
+            rows.append((name, baseline[name], time, ratio, ratio > 1 + threshold))
+    return rows
@@ -0,0 +1,109 @@
+import logging
+import signal
+import threading
+from contextlib import contextmanager
+from lib.recorder import Recorder
+
+
+@contextmanager
+def _deferred_interrupt(interrupted):
+    # Ctrl-C within the block only calls interrupted(), so that it never leaves a simulation state half
+    # updated: the kernels update the objects of their state in place. Only the main thread receives it.
+    if threading.current_thread() is not threading.main_thread() \
+            or signal.getsignal(signal.SIGINT) is not signal.default_int_handler:
+        yield
+        return
+    signal.signal(signal.SIGINT, lambda signum, frame: interrupted())
+    try:
+        yield
+    finally:
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+
+class SimulationBlocks:
+    # Iterator over the recording of a simulation in blocks of `block` time steps, as numpy structured
+    # arrays, so that the recording can be processed and dropped while the simulation goes on.
+    # simulate(runtime=..., recording=..., state=...) is a simulation kernel with its other arguments
+    # bound, which is run up to the end of each block from the state it reached at the end of the one
+    # before; the blocks end at the multiples of `block`, and those of the kernels that leave out the
+    # first step have one row less in their first block.
+    # time and state are those at the end of the last block, the final ones once the iteration is over,
+    # and rows the number of rows of the blocks taken so far; state is None while a block is simulated,
+    # and stays so when the kernel fails. A KeyboardInterrupt during a block is raised once it is taken.
+    # checkpoint(time, state) is called at the end of the first block that reaches every checkpoint_every
+    # steps, once that block has been taken, so that the rows up to `time` have been processed by then.
+    # A Telemetry is updated with each block. With a shape, every row holds that many records, as in a Recorder.
+
+    def __init__(self, simulate, fields, runtime: int, block: int = 2 ** 12, state=None,
+                 checkpoint=None, checkpoint_every: int = 0, show_progress=False, logger=None, telemetry=None,
+                 shape=()):
+        self.simulate = simulate
+        self.fields = fields
+        self.runtime = runtime
+        self.block = block
+        self.state = state
+        self.time = 0 if state is None else state['time']
+        self.rows = 0
+        self.interrupted = False
+        self.checkpoint = checkpoint if checkpoint_every > 0 else None
+        self.checkpoint_every = checkpoint_every
+        self.next_checkpoint = self.time + checkpoint_every
+        self.show_progress = show_progress
+        self.logger = logging.getLogger(__name__) if logger is None else logger
+        self.due = False  # whether the checkpoint at the end of the last block is still to be made
+        self.telemetry = telemetry
+        self.shape = tuple(shape)
+        if telemetry is not None:
+            telemetry.start(self.time)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.interrupted:
+            self.interrupted = False
+            raise KeyboardInterrupt
+        if self.due:
+            self.checkpoint(self.time, self.state)
+            self.due = False
+        if self.time >= self.runtime:
+            raise StopIteration
+
+        end = min((self.time // self.block + 1) * self.block, self.runtime)
+        with _deferred_interrupt(self.interrupt):
+            state, self.state = self.state, None
+            recording, state = self.simulate(runtime=end, recording=Recorder(self.fields, end - self.time, self.shape),
+                                             state=state)
+            rows = recording.array()
+            self.time, self.state, self.rows = end, state, self.rows + len(rows)
+
+        if self.show_progress:
+            self.logger.info(f'{end * 100 / self.runtime:.1f}% DONE')
+        if self.checkpoint is not None and end >= self.next_checkpoint and end < self.runtime:
+            self.due = True
+            while self.next_checkpoint <= end:
+                self.next_checkpoint += self.checkpoint_every
+        if self.telemetry is not None:
+            self.telemetry.update(end, self.runtime, rows)
+        return rows
+
+    def interrupt(self):
+        self.interrupted = True
+
+    def record(self, recording, save=None):
+        # Extends the recording with all the blocks. When the iteration is interrupted by an exception,
+        # the rows recorded up to `time` are stored first with save(time, state), if they are all there and
+        # the state is whole, and the recording is discarded otherwise, before the exception goes on.
+        first = len(recording)
+        try:
+            for rows in self:
+                recording.extend(rows)
+        except BaseException:
+            try:
+                if save is not None and self.rows > 0 and self.state is not None \
+                        and len(recording) == first + self.rows:
+                    self.logger.warning(f'Interrupted at time {self.time}, storing the simulation up to it')
+                    save(self.time, self.state)
+            finally:
+                recording.discard()  # the partial file of a streamed recording that was not saved
+            raise
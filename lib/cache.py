@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pickle
+import time
+from contextlib import suppress
+from lib import compact, pyramid
+from lib.recorder import Recorder, StreamRecorder, atomic_write
+
+PARTIAL_MAX_AGE = 24 * 3600  # seconds after which an untouched partial file is left from a run that died
+
+
+class SimulationCache:
+    # Directory of simulation recordings addressed by a hash of the model name, the model
+    # version and the complete set of parameters of the run but its runtime.
+    # Recordings are stored as compact files `<model>_<key>.rec` (see lib/compact.py), where the fields
+    # of scaled_fields, queue lengths recorded multiplied by a parameter, are stored as integers and
+    # multiplied by the value of that parameter when they are read; like memory-mapped files, they are
+    # only read and decoded where they are indexed (see compact.CompactRecording). The recordings streamed
+    # into the cache directory by a StreamRecorder stay there as `<model>_<key>.npy`, memory-mapped.
+    # Next to each recording a sidecar `<model>_<key>.json` stores these parameters and the runtime,
+    # `<model>_<key>.ckpt` the final simulator state and `<model>_<key>.pyr` the pyramid of minima,
+    # maxima and means of the recorded series (see lib/pyramid.py), which is built once a run is complete
+    # and kept while a longer run is checkpointed, since it still holds for its beginning.
+    # Checkpoints only write what was recorded since the one before: a compact file is appended to (see
+    # compact.append), and a streamed recording is flushed to its partial file, which the sidecar then
+    # refers to, with format 'stream', until the run completes it; that file belongs to the entry. A run
+    # resumed from it streams into a file of its own, and the one it leaves is removed as the partial file
+    # of a run that died.
+    # Files are replaced atomically, so that concurrent runs can share the directory, and
+    # the least recently used entries are evicted when the directory grows beyond max_size bytes,
+    # the partial files of the recordings being streamed counting with the disk space they use.
+
+    def __init__(self, directory, model: str, version: int, max_size: int = None, scaled_fields: dict = None):
+        self.directory = os.path.join(os.getcwd(), "cache") if directory is None else directory
+        self.model = model
+        self.version = version
+        self.max_size = max_size
+        self.scaled_fields = {} if scaled_fields is None else scaled_fields
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, params: dict) -> str:
+        description = json.dumps({'model': self.model, 'version': self.version, 'params': params},
+                                 sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()[:32]
+
+    def file(self, params: dict, type=".npy") -> str:
+        return os.path.join(self.directory, self.model + '_' + self.key(params) + type)
+
+    def load(self, params: dict, runtime: int, mmap_mode='r'):
+        # Returns the cached recording and the number of time steps it covers, or (None, 0)
+        # when the run is not in the cache. The runtime is not part of the parameters:
+        # a longer cached run is cut to `runtime` steps, while a shorter one is returned
+        # as it is, to be extended from its final state (see load_state).
+        try:
+            metadata = self.metadata(params)
+            if metadata.get('format') == 'compact':
+                recording = compact.CompactFile(self.file(params, ".rec"))
+            elif metadata.get('format') == 'stream':
+                # the partial file is as long as the whole run, only its first rows are written
+                array = np.load(os.path.join(self.directory, metadata['file']), mmap_mode=mmap_mode)
+                recording = Recorder.from_array(array[:metadata['length']])
+            else:
+                recording = Recorder.load(self.file(params), mmap_mode=mmap_mode)
+            os.utime(self.file(params, ".json"))  # mark as recently used
+        except (FileNotFoundError, ValueError):  # ValueError: a file of an older format, or being appended to
+            return None, 0
+        if len(recording) != metadata['length']:
+            return None, 0  # the entry is being replaced by another process
+        steps = min(metadata['runtime'], runtime)
+        length = len(recording) - (metadata['runtime'] - steps)
+        if isinstance(recording, compact.CompactFile):
+            recording = compact.CompactRecording(recording, length)  # decoded where it is read
+        elif length < len(recording):
+            recording = Recorder.from_array(recording.array()[:length])
+        return recording, steps
+
+    def load_pyramid(self, params: dict):
+        # pyramid of the cached recording, or None
+        try:
+            return pyramid.load(self.file(params, ".pyr"))
+        except FileNotFoundError:
+            return None
+
+    def load_state(self, params: dict, runtime: int):
+        # simulator state at the end of the cached run of `runtime` steps, or None
+        try:
+            with open(self.file(params, ".ckpt"), 'rb') as f:
+                state = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        return state if state['time'] == runtime else None
+
+    def metadata(self, params: dict):
+        with open(self.file(params, ".json")) as f:
+            return json.load(f)
+
+    def store(self, params: dict, recording, runtime: int, state=None, snapshot=False, **extra):
+        # Stores a run of `runtime` steps, with its final state when it can be extended.
+        # With snapshot the recording is still being written and the rows recorded so far are stored.
+        try:
+            if self.metadata(params)['runtime'] > runtime:
+                return  # a longer run is already cached
+        except FileNotFoundError:
+            pass
+        scales = {name: params[parameter] for name, parameter in self.scaled_fields.items()}
+        streamed = isinstance(recording, StreamRecorder)
+        if streamed and snapshot:
+            extra['file'] = os.path.basename(recording.checkpoint())
+            file_format, file = 'stream', None
+        elif streamed:
+            file_format, file = 'npy', self.file(params)
+            recording.save(file)
+        else:
+            file_format, file = 'compact', self.file(params, ".rec")
+            (compact.append if snapshot else compact.write)(file, recording.array(), scales)
+        for other in {self.file(params, ".rec"), self.file(params)} - {file}:
+            with suppress(OSError):  # the recording in another format, if any, is out of date
+                os.remove(other)
+        if not snapshot:
+            pyramid.write(self.file(params, ".pyr"), pyramid.build(recording.array()))
+        if state is not None:
+            self._write_pickle(self.file(params, ".ckpt"), state)
+        elif os.path.exists(self.file(params, ".ckpt")):
+            os.remove(self.file(params, ".ckpt"))
+        metadata = {'model': self.model, 'version': self.version, 'params': params, 'runtime': runtime,
+                    'length': len(recording), 'dtype': str(recording.dtype), 'created': time.time(),
+                    'format': file_format, **extra}
+        self._write_json(self.file(params, ".json"), metadata)
+        self.evict()
+
+    def _write_pickle(self, file, data):
+        with atomic_write(file) as f:
+            pickle.dump(data, f)
+
+    def _write_json(self, file, data):
+        with atomic_write(file, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True, default=str)
+
+    def checkpoints(self, names):
+        # partial file of each entry whose streamed recording is checkpointed in it, by entry name
+        checkpoints = {}
+        for name in names:
+            entry = name.split('.')[0]
+            if name.endswith('.part') and entry + '.json' in names and entry not in checkpoints:
+                with suppress(OSError, ValueError):
+                    with open(os.path.join(self.directory, entry + '.json')) as f:
+                        checkpoint = json.load(f).get('file')
+                    if checkpoint in names:
+                        checkpoints[entry] = checkpoint
+        return checkpoints
+
+    def disk_usage(self, name):
+        # the streamed recordings are preallocated but only take the blocks written so far
+        stat = os.stat(os.path.join(self.directory, name))
+        return stat.st_blocks * 512 if hasattr(stat, 'st_blocks') else stat.st_size
+
+    def entries(self, names=None):
+        # (last use, size, files) of every entry of the cache, oldest first
+        names = set(os.listdir(self.directory)) if names is None else names
+        checkpoints = self.checkpoints(names)
+        entries = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            entry = name[:-len('.json')]
+            files = [f for f in names if f.startswith(entry + '.') and not f.endswith('.part')]
+            files += [checkpoints[entry]] if entry in checkpoints else []
+            try:
+                last_use = os.path.getmtime(os.path.join(self.directory, name))
+                size = sum(self.disk_usage(f) for f in files)
+            except FileNotFoundError:
+                continue  # evicted meanwhile by another process
+            entries.append((last_use, size, files))
+        return sorted(entries)
+
+    def partials(self, names=None):
+        # disk space used by the partial files of the runs going on, once those of the runs
+        # that died before completing them have been removed; those of checkpoints belong to their entry
+        names = set(os.listdir(self.directory)) if names is None else names
+        checkpoints = set(self.checkpoints(names).values())
+        used = 0
+        for name in names:
+            if not name.endswith('.part') or name in checkpoints:
+                continue
+            with suppress(OSError):  # completed or removed meanwhile by another process
+                if time.time() - os.path.getmtime(os.path.join(self.directory, name)) > PARTIAL_MAX_AGE:
+                    os.remove(os.path.join(self.directory, name))
+                else:
+                    used += self.disk_usage(name)
+        return used
+
+    def evict(self):
+        names = set(os.listdir(self.directory))
+        partials = self.partials(names)
+        if self.max_size is None:
+            return
+        entries = self.entries(names)
+        total = partials + sum(size for _, size, _ in entries)
+        for _, size, files in entries:
+            if total <= self.max_size:
+                break
+            # the sidecar goes first, so that a half-evicted entry is never read as a hit
+            for f in sorted(files, key=lambda f: not f.endswith('.json')):
+                try:
+                    os.remove(os.path.join(self.directory, f))
+                except FileNotFoundError:
+                    pass
+            total -= size
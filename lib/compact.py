@@ -0,0 +1,237 @@
+import json
+import numpy as np
+import os
+import zlib
+from collections import OrderedDict
+from lib.recorder import atomic_write
+
+MAGIC = b'MWREC2\n'
+CHUNK = 2 ** 16  # rows of a chunk, the unit of compression and of random access
+INTEGER_TYPES = [np.int8, np.int16, np.int32, np.int64]
+DECODED_CHUNKS = 16  # chunks of a series read in part that a CompactFile keeps decoded, for reads close by
+
+
+def _narrowest(values):
+    # narrowest signed integer type that holds the values
+    low, high = (values.min(), values.max()) if values.size else (0, 0)
+    return next(t for t in INTEGER_TYPES if np.iinfo(t).min <= low and high <= np.iinfo(t).max)
+
+
+def _encode(values, scale=None):
+    # Encodes a chunk of a series, along its first axis: series of integers, or of integers multiplied
+    # by `scale` when this gives back exactly the same values, are stored in the narrowest integer type,
+    # as differences between consecutive rows when these are narrower, and the other series as they are.
+    # Returns the compressed bytes and how to decode them.
+    encoding = dict(scale=None, delta=False)
+    if scale is not None:
+        integers = np.rint(values / scale).astype(np.int64)
+        if np.array_equal(integers * scale, values):
+            values = integers
+            encoding['scale'] = scale
+    if values.dtype.kind in 'iub':
+        values = values.astype(np.int64)
+        differences = np.diff(values, axis=0, prepend=np.zeros_like(values[:1]))
+        if np.dtype(_narrowest(differences)).itemsize <= np.dtype(_narrowest(values)).itemsize:
+            values = differences
+            encoding['delta'] = True
+        values = values.astype(_narrowest(values))
+    encoding['dtype'] = values.dtype.str
+    return zlib.compress(np.ascontiguousarray(values).tobytes(), 6), encoding
+
+
+def _decode(data, encoding, out):
+    # decodes a chunk of a series into `out`, which may be a field of a structured array
+    values = np.frombuffer(zlib.decompress(data), encoding['dtype']).reshape(out.shape)
+    if encoding['delta']:
+        # the sums of integers are exact in float64 as well, for the queue lengths of any simulation
+        np.cumsum(values, axis=0, dtype=out.dtype, out=out)
+    else:
+        out[...] = values
+    if encoding['scale'] is not None:
+        out *= encoding['scale']
+
+
+def _encode_chunks(array, scales, chunk, start, offset):
+    # the compressed fields of the chunks of rows from `start` on, placed in the file from `offset` on,
+    # and their entries in the index
+    blobs, chunks = [], []
+    for begin in range(start, len(array), chunk):
+        rows = array[begin:begin + chunk]
+        fields = {}
+        for name in array.dtype.names:
+            data, encoding = _encode(rows[name], scales.get(name))
+            fields[name] = dict(encoding, offset=offset, size=len(data))
+            blobs.append(data)
+            offset += len(data)
+        chunks.append(dict(start=begin, rows=len(rows), fields=fields))
+    return blobs, chunks
+
+
+def _write_tail(f, array, chunk, blobs, chunks):
+    # writes the blobs at the current position of the file, then the index and the trailer that locates it
+    offset = f.tell() + sum(len(data) for data in blobs)
+    index = json.dumps(dict(dtype=[[name, array.dtype[name].str] for name in array.dtype.names],
+                            shape=list(array.shape[1:]), length=len(array), chunk=chunk, chunks=chunks)).encode()
+    for data in blobs:
+        f.write(data)
+    f.write(index)
+    f.write(offset.to_bytes(8, 'little') + len(index).to_bytes(8, 'little') + MAGIC)
+
+
+def write(file, array, scales=None, chunk: int = CHUNK):
+    # Writes a recording, a structured array with one row per time step, to a compact file: each field
+    # of each chunk of rows is encoded on its own (see _encode) and compressed, and an index at the end of
+    # the file locates them, so that a range of rows can be read without decoding the others. `scales` maps
+    # fields to the factor they were recorded multiplied by, such as epsilon for the queues A0 and B0.
+    scales = {} if scales is None else scales
+    blobs, chunks = _encode_chunks(array, scales, chunk, 0, len(MAGIC))
+    with atomic_write(file) as f:
+        f.write(MAGIC)
+        _write_tail(f, array, chunk, blobs, chunks)
+
+
+def append(file, array, scales=None):
+    # Extends a compact file to the recording `array`, of which it holds the beginning: its complete chunks
+    # are kept and the chunks from its last incomplete one on are written after its end, with a new index,
+    # so that a recording checkpointed again and again is only compressed and written once.
+    # The bytes the file held are left in place for the readers that opened it before; the incomplete chunk
+    # and the index that are replaced stay in the file as unused bytes, until it is written anew by write().
+    try:
+        recorded = CompactFile(file)
+    except (FileNotFoundError, ValueError):
+        write(file, array, scales)
+        return
+    scales = {} if scales is None else scales
+    kept = [chunk for chunk in recorded.chunks if chunk['rows'] == recorded.chunk]
+    with open(file, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        blobs, chunks = _encode_chunks(array, scales, recorded.chunk, len(kept) * recorded.chunk, f.tell())
+        _write_tail(f, array, recorded.chunk, blobs, kept + chunks)
+
+
+class CompactFile:
+    # Reader of a file written by write(), that only reads and decodes the chunks of the rows asked for.
+
+    def __init__(self, file):
+        self.file = file
+        trailer = 16 + len(MAGIC)
+        with open(file, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{file} is not a compact recording')
+            f.seek(-trailer, os.SEEK_END)
+            end = f.read(trailer)
+            if end[16:] != MAGIC:
+                raise ValueError(f'{file} is being written')
+            f.seek(int.from_bytes(end[:8], 'little'))
+            index = json.loads(f.read(int.from_bytes(end[8:16], 'little')))
+        self.dtype = np.dtype([(name, dtype) for name, dtype in index['dtype']])
+        self.shape = tuple(index['shape'])
+        self.length = index['length']
+        self.chunk = index['chunk']
+        self.chunks = index['chunks']
+        self.decoded = OrderedDict()
+
+    def read(self, start: int = 0, stop: int = None, fields=None):
+        # rows start to stop of the recording, of the given fields or of all of them
+        stop = self.length if stop is None else min(stop, self.length)
+        start = min(max(start, 0), stop)
+        names = list(self.dtype.names) if fields is None else list(fields)
+        result = np.empty((stop - start,) + self.shape, [(name, self.dtype[name]) for name in names])
+        if start == stop:
+            return result
+        with open(self.file, 'rb') as f:
+            # the chunks all have `chunk` rows but the last one
+            for chunk in self.chunks[start // self.chunk:(stop - 1) // self.chunk + 1]:
+                low, high = max(start, chunk['start']), min(stop, chunk['start'] + chunk['rows'])
+                for name in names:
+                    out = result[name][low - start:high - start]
+                    if high - low == chunk['rows']:
+                        _decode(self._data(f, chunk['fields'][name]), chunk['fields'][name], out)
+                    else:
+                        # the rows before `low` are decoded too, as the differences add up from the chunk start
+                        out[...] = self._decoded(f, chunk, name)[low - chunk['start']:high - chunk['start']]
+        return result
+
+    def _data(self, f, encoding):
+        f.seek(encoding['offset'])
+        return f.read(encoding['size'])
+
+    def _decoded(self, f, chunk, name):
+        # a whole chunk of a series, from the chunks decoded last when it is one of them
+        key = (chunk['start'], name)
+        if key in self.decoded:
+            self.decoded.move_to_end(key)
+        else:
+            values = np.empty((chunk['rows'],) + self.shape, self.dtype[name])
+            _decode(self._data(f, chunk['fields'][name]), chunk['fields'][name], values)
+            self.decoded[key] = values
+            if len(self.decoded) > DECODED_CHUNKS:
+                self.decoded.popitem(last=False)
+        return self.decoded[key]
+
+    def __len__(self):
+        return self.length
+
+
+class CompactRecording:
+    # Recording of a compact file with the interface of a Recorder, whose series are only read and decoded
+    # where they are indexed, so that a recording is loaded at once and drawn or searched from its pyramid
+    # (see lib/pyramid.py) without decoding the rows of the blocks the pyramid covers.
+    # The recording is cut to its first `length` rows, and to the i-th record of each row with `column`.
+
+    def __init__(self, compact_file: CompactFile, length: int = None, column: int = None):
+        self.compact_file = compact_file
+        self.n = len(compact_file) if length is None else min(length, len(compact_file))
+        self.column = column
+        self.shape = compact_file.shape if column is None else compact_file.shape[1:]
+        self.dtype = np.dtype([(name, compact_file.dtype[name]) for name in compact_file.dtype.names])
+        self.fields = list(self.dtype.names)
+
+    def read(self, start: int, stop: int, fields=None):
+        rows = self.compact_file.read(start, min(stop, self.n), fields)
+        return rows if self.column is None else rows[:, self.column]
+
+    def array(self):
+        # all the rows, decoded
+        return self.read(0, self.n)
+
+    def replica(self, i: int):
+        return CompactRecording(self.compact_file, self.n, i)
+
+    def discard(self):
+        pass
+
+    def __getitem__(self, name):
+        return CompactSeries(self, name)
+
+    def __len__(self):
+        return self.n
+
+
+class CompactSeries:
+    # series of a CompactRecording, which decodes the chunks of the rows it is indexed with
+
+    def __init__(self, recording: CompactRecording, name: str):
+        self.recording = recording
+        self.name = name
+        self.shape = (len(recording),) + recording.shape
+        self.dtype = recording.dtype[name]
+
+    def __getitem__(self, key):
+        n = len(self.recording)
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(n)
+            return self.recording.read(start, max(start, stop), [self.name])[self.name]
+        if isinstance(key, (int, np.integer)):
+            if not -n <= key < n:
+                raise IndexError(f'index {key} is out of bounds for a series of {n} rows')
+            key = key % n
+            return self.recording.read(key, key + 1, [self.name])[self.name][0]
+        return np.asarray(self)[key]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self[:]
+        return values if dtype is None else values.astype(dtype)
+
+    def __len__(self):
+        return len(self.recording)
@@ -0,0 +1,63 @@
+class IndexedMax:
+    # Tournament tree over a fixed number of values.
+    # Point updates cost O(log n), max/argmax and min/argmin are O(1).
+    # Ties are resolved in favour of the lowest index, as numpy.argmax does.
+
+    def __init__(self, values):
+        self.n = len(values)
+        self.size = 1
+        while self.size < self.n:
+            self.size *= 2
+        self.values = [int(v) for v in values]
+
+        # the nodes store the index of the winner of their subtree;
+        # the padding leaves replay the last value so they never win a tie
+        leaves = list(range(self.n)) + [self.n - 1] * (self.size - self.n)
+        self.max_tree = [0] * self.size + leaves
+        self.min_tree = [0] * self.size + leaves
+        for pos in range(self.size - 1, 0, -1):
+            self._play(pos)
+
+    def _play(self, pos):
+        values = self.values
+        left, right = self.max_tree[2 * pos], self.max_tree[2 * pos + 1]
+        self.max_tree[pos] = left if values[left] >= values[right] else right
+        left, right = self.min_tree[2 * pos], self.min_tree[2 * pos + 1]
+        self.min_tree[pos] = left if values[left] <= values[right] else right
+
+    def add(self, i: int, delta: int):
+        values = self.values
+        max_tree = self.max_tree
+        min_tree = self.min_tree
+        values[i] += delta
+        pos = (i + self.size) >> 1
+        while pos:
+            left, right = max_tree[2 * pos], max_tree[2 * pos + 1]
+            max_tree[pos] = left if values[left] >= values[right] else right
+            left, right = min_tree[2 * pos], min_tree[2 * pos + 1]
+            min_tree[pos] = left if values[left] <= values[right] else right
+            pos >>= 1
+
+    def argmax(self) -> int:
+        return self.max_tree[1]
+
+    def max(self) -> int:
+        return self.values[self.max_tree[1]]
+
+    def argmin(self) -> int:
+        return self.min_tree[1]
+
+    def min(self) -> int:
+        return self.values[self.min_tree[1]]
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __str__(self):
+        return str(self.values)
@@ -3,11 +3,12 @@ from numpy import *
 
 class MovingAverage:
 
-    def __init__(self, lag):
-        self.data = zeros(lag)
+    def __init__(self, lag, shape=()):
+        # with a non-empty shape, push() takes arrays and averages each entry independently
+        self.data = zeros((lag,) + tuple(shape))
         self.index = 0
         self.lag = lag
-        self.average = 0
+        self.average = 0 if shape == () else zeros(shape)
 
     def push(self, n):
         self.average += (n - self.data[self.index]) / self.lag
@@ -21,3 +22,28 @@ class MovingAverage:
 
     def get(self):
         return self.average
+
+    def push_many(self, values):
+        # pushes the values one after the other along their first axis and returns the average
+        # after each of them; the running sum is a cumulative sum of the same increments as in
+        # push(), so the averages are exactly those of repeated pushes
+        values = asarray(values, dtype=float)
+        m = len(values)
+        if m == 0:
+            return zeros((0,) + self.data.shape[1:])
+        previous = concatenate((roll(self.data, -self.index, axis=0), values))[:m]
+        increments = (values - previous) / self.lag
+        averages = cumsum(concatenate((reshape(self.average, (1,) + self.data.shape[1:]), increments)), axis=0)[1:]
+
+        positions = (self.index + arange(m)) % self.lag
+        self.data[positions[-self.lag:]] = values[-self.lag:]
+        self.index = (self.index + m) % self.lag
+        self.average = averages[-1].copy()
+        return averages
+
+
+def moving_average(values, lag):
+    # average of the last `lag` values at each step of a series, or of each column of it,
+    # computed after the run as a MovingAverage would have during it
+    values = asarray(values)
+    return MovingAverage(lag, values.shape[1:]).push_many(values)
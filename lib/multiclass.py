@@ -0,0 +1,158 @@
+import logging
+import numpy as np
+from functools import partial
+from lib.blocks import SimulationBlocks
+from lib.multiclassqueue import MulticlassQueue
+from lib.recorder import Recorder
+
+MODEL = 'multiclass'
+MODEL_VERSION = 3  # to be increased whenever the simulated dynamics, the recording or the stored state change
+
+# queue lengths at A0 and B0 are recorded multiplied by epsilon
+RECORDING_FIELDS = [('A0', np.float64), ('A1', np.int64), ('B0', np.float64), ('B1', np.int64)]
+SCALED_FIELDS = {'A0': 'epsilon', 'B0': 'epsilon'}  # stored as integers in the cache, see SimulationCache
+
+
+def simulate(rng, a, epsilon, k, init_a0, runtime, recording=None, state=None, logger=None, record_workload=False,
+             profile=None):
+    # Simulates the multiclass network up to time `runtime`, appending one row per time step
+    # but the first to the recording; with record_workload the workloads of A1 and B1 are
+    # recorded instead of their lengths. With debug logging, the running workloads of
+    # the queues are cross-checked at every step.
+    # With a state, the simulation resumes from it and the recording should hold the rows before it.
+    # With a Profile, the time spent in each phase of the steps is added to it.
+    # Returns the recording and the final state.
+    logger = logging.getLogger(__name__) if logger is None else logger
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if recording is None:
+        recording = Recorder(RECORDING_FIELDS, runtime)
+
+    if state is None:
+        start_time = 0
+
+        len_queue_A0 = init_a0
+        len_queue_B0 = 0
+        queue_A1 = MulticlassQueue(k)
+        queue_B1 = MulticlassQueue(k)
+
+        cumulative_input_A = cumulative_output_A = 0
+        cumulative_input_B = cumulative_output_B = 0
+
+        services_A0 = rng.rand_int(1/epsilon)
+        services_A1 = rng.rand_int(1/(epsilon*epsilon))
+        services_B0 = rng.rand_int(1/epsilon)
+        services_B1 = rng.rand_int(1/(epsilon*epsilon))
+        arrivals_A = rng.rand_int(a)
+        arrivals_B = rng.rand_int(a)
+    else:
+        start_time = state['time']
+        len_queue_A0, queue_A1 = state['len_queue_A0'], state['queue_A1']
+        len_queue_B0, queue_B1 = state['len_queue_B0'], state['queue_B1']
+        cumulative_input_A, cumulative_output_A = state['cumulative_input_A'], state['cumulative_output_A']
+        cumulative_input_B, cumulative_output_B = state['cumulative_input_B'], state['cumulative_output_B']
+        services_A0, services_A1 = state['services_A0'], state['services_A1']
+        services_B0, services_B1 = state['services_B0'], state['services_B1']
+        arrivals_A, arrivals_B = state['arrivals_A'], state['arrivals_B']
+
+    def get_state(_time):
+        return dict(time=_time, len_queue_A0=len_queue_A0, queue_A1=queue_A1,
+                    len_queue_B0=len_queue_B0, queue_B1=queue_B1,
+                    cumulative_input_A=cumulative_input_A, cumulative_output_A=cumulative_output_A,
+                    cumulative_input_B=cumulative_input_B, cumulative_output_B=cumulative_output_B,
+                    services_A0=services_A0, services_A1=services_A1,
+                    services_B0=services_B0, services_B1=services_B1,
+                    arrivals_A=arrivals_A, arrivals_B=arrivals_B)
+
+    if profile:
+        profile.start()
+    for _time in range(start_time, runtime):
+
+        out_queue_A0 = out_queue_A1 = 0
+        out_queue_B0 = out_queue_B1 = 0
+
+        serve_A0 = len_queue_A0 >= len(queue_A1) / epsilon  # eq. (60)
+        serve_B0 = len_queue_B0 >= len(queue_B1) / epsilon  # eq. (60)
+        if profile:
+            profile.lap('decision')
+
+        # Component A
+        if serve_A0:
+            # serving queue A0
+            service = next(services_A0)
+            out_queue_A0 = min(service, len_queue_A0)
+            len_queue_A0 -= out_queue_A0
+        else:
+            # serving queue A1
+            service = next(services_A1)
+            out_queue_A1 += queue_A1.serve(service)
+
+        # Component B
+        if serve_B0:
+            # serving queue B0
+            service = next(services_B0)
+            out_queue_B0 = min(service, len_queue_B0)
+            len_queue_B0 -= out_queue_B0
+        else:
+            # serving queue B1
+            service = next(services_B1)
+            out_queue_B1 += queue_B1.serve(service)
+        if profile:
+            profile.lap('service')
+
+        # arrivals at queue A0 from outside
+        arrivals_A0 = next(arrivals_A)
+        cumulative_input_A += arrivals_A0
+        len_queue_A0 += arrivals_A0
+
+        # arrivals at queue B1 from queue A0
+        queue_B1.push(out_queue_A0)  # append packets of class 1 to queue B1
+
+        # departures from queue B1
+        cumulative_output_B += out_queue_B1
+
+        # arrivals at queue B0 from outside
+        arrivals_B0 = next(arrivals_B)
+        cumulative_input_B += arrivals_B0
+        len_queue_B0 += arrivals_B0
+
+        # arrivals at queue A1 from queue B0
+        queue_A1.push(out_queue_B0)  # append packets of class 1 to queue A1
+
+        # departures from queue A1
+        cumulative_output_A += out_queue_A1
+
+        if profile:
+            profile.lap('arrivals')
+
+        # logger.debug('maxA: ', max(len_queue_A0, len(queue_A1)), ' maxB: ', max(len_queue_B0, len(queue_B1)))
+        if debug:
+            logger.debug(f'[A0,B0,B1,A1]: {[len_queue_A0, len_queue_B0, len(queue_B1), len(queue_A1)]}')
+            logger.debug(f'cumInput A0: {cumulative_input_A}, cumOutput A1: {cumulative_output_A}')
+            logger.debug(f'cumInput B0: {cumulative_input_B}, cumOutput B1: {cumulative_output_B}')
+            queue_A1.check_workload()
+            queue_B1.check_workload()
+            if profile:
+                profile.lap('debug')
+
+        # save data to recording variable
+        if _time > 0:
+            if record_workload:
+                recording.append(len_queue_A0 * epsilon, queue_A1.workload(),
+                                 len_queue_B0 * epsilon, queue_B1.workload())
+            else:
+                recording.append(len_queue_A0 * epsilon, len(queue_A1),
+                                 len_queue_B0 * epsilon, len(queue_B1))
+        if profile:
+            profile.lap('recording')
+
+    return recording, get_state(runtime)
+
+
+def simulate_blocks(rng, a, epsilon, k, init_a0, runtime, block=2 ** 12, state=None, checkpoint=None,
+                    checkpoint_every=0, show_progress=False, logger=None, record_workload=False, profile=None,
+                    telemetry=None):
+    # The simulation of simulate() as an iterator over blocks of its recording, see SimulationBlocks.
+    kernel = partial(simulate, rng, a, epsilon, k, init_a0, logger=logger, record_workload=record_workload,
+                     profile=profile)
+    return SimulationBlocks(kernel, RECORDING_FIELDS, runtime, block, state, checkpoint, checkpoint_every,
+                            show_progress, logger, telemetry)
@@ -1,13 +1,24 @@
-import collections
+from bisect import bisect_left
+from itertools import accumulate
 
 
 class MulticlassQueue:
+    # Queue of packets stored as runs of packets of the same class, from the head to the tail.
+    # The classes and the counts of the runs are kept in two lists from index `head` on:
+    # runs leave by moving the head forward, join at the end of the lists, and the lists
+    # are compacted once the head has gone past half of them.
+    # The workload, the number of class changes left before all the packets depart,
+    # is kept up to date as packets join, change class and depart.
+
+    __slots__ = ('n_classes', 'n_packets', 'classes', 'counts', 'head', 'total_workload')
 
     def __init__(self, n_classes: int = 1):
         self.n_classes = n_classes
-        self.q_classes = collections.deque()
-        self.q_packets = collections.deque()
+        self.classes = []
+        self.counts = []
+        self.head = 0
         self.n_packets = 0
+        self.total_workload = 0
 
     def push(self, n: int = 1):
         if n == 0:
@@ -18,65 +29,159 @@ class MulticlassQueue:
         self.n_packets += n
 
     def serve(self, amount: int = 1) -> int:
+        # The service goes through the queue in cycles. A cycle serves the runs one after the other,
+        # moving each of them to the tail with its class increased by the increment of the cycle,
+        # or out of the queue past the last class, at the cost of its packets times the increment.
         exit_packets = 0
-        max_class = 1
         inc_class = 1
-        cycle_it = 0
-        cycle_len = len(self.q_packets)
+        max_class = None
         while amount > 0 and self.n_packets > 0:
-
-            if cycle_it == cycle_len:
-                cycle_it = 0
-                cycle_len = len(self.q_packets)
+            if max_class is not None:
+                # a new cycle: the largest increment that does not take a run past the departure
                 am_ppk = max(int(amount/self.n_packets), 1)
                 inc_class = min(am_ppk, self.n_classes-max_class+1)
-                max_class = 1
-
-            pkt_class, pkt_n = self.get_head()
-            serving = min(pkt_n, amount)
-
-            pkt_class += inc_class
-            if pkt_class <= self.n_classes:
-                self.append(pkt_class, serving)  # change class in the same queue
-                if pkt_class > max_class:
-                    max_class = pkt_class
-            elif pkt_class == self.n_classes + 1:
-                self.n_packets -= serving
-                exit_packets += serving  # departure
+            if amount > self.n_packets * inc_class:
+                amount, exits, max_class = self.skip_cycles(amount, inc_class)
             else:
-                raise Exception('Error')
-
-            if pkt_n > amount:
-                self.update_head(pkt_n - amount)
-            else:
-                self.popleft()
-
-            amount -= serving * inc_class
-            cycle_it += 1
-
+                amount, exits, max_class = self.serve_cycle(amount, inc_class)
+            exit_packets += exits
+        self.compact()
         return exit_packets
 
+    def serve_cycle(self, amount: int, inc_class: int):
+        # Serves the runs of a cycle with class increment inc_class, until the cycle is over or the
+        # amount of service runs out, the last run being then served in part.
+        # Every run takes at least one unit of service, so at most `amount` runs are looked at,
+        # and they are handled as slices of the lists.
+        # Returns the amount left, the number of packets that left the queue and, when some
+        # service is left for another cycle, the largest class of the runs moved to the tail.
+        classes = self.classes
+        counts = self.counts
+        head = self.head
+        window = min(len(counts) - head, amount)
+        run_classes = classes[head:head + window]
+        run_counts = counts[head:head + window]
+
+        # the runs that are reached with some service left, the last of them possibly served in part
+        served = list(accumulate(run_counts))
+        n_runs = min(bisect_left(served, -(-amount // inc_class)) + 1, window)
+        last = n_runs - 1
+        left = amount - (served[last - 1] if last else 0) * inc_class
+        del run_classes[n_runs:]
+        del run_counts[n_runs:]
+        if run_counts[last] > left:
+            counts[head + last] -= left
+            run_counts[last] = left
+            self.head = head + last
+        else:
+            self.head = head + n_runs
+        service = amount - left + run_counts[last] * inc_class
+        amount -= service
+
+        # the runs move to the tail, but for those of the last class that leave the queue
+        exit_class = self.n_classes + 1 - inc_class
+        new_classes = [cl + inc_class for cl in run_classes]
+        exit_packets = 0
+        start = 0
+        while exit_class in run_classes[start:]:
+            end = run_classes.index(exit_class, start)
+            classes.extend(new_classes[start:end])
+            counts.extend(run_counts[start:end])
+            exit_packets += run_counts[end]  # departure
+            start = end + 1
+        classes.extend(new_classes[start:])
+        counts.extend(run_counts[start:])
+        self.n_packets -= exit_packets
+        # every packet served went up inc_class classes, but those that departed one less
+        self.total_workload -= service - exit_packets
+
+        max_class = None
+        if amount > 0:
+            max_class = max((cl for cl in new_classes if cl <= self.n_classes), default=1)
+        return amount, exit_packets, max_class
+
+    def skip_cycles(self, amount: int, inc_class: int):
+        # Serves at once the cycles that go through the whole queue, starting with one of class
+        # increment inc_class, as serve() would one after the other. Such a cycle moves every
+        # run up inc_class classes and keeps their order, so the cycles are worked out from the
+        # number of packets of each class and then applied to the runs with a single shift.
+        # Returns the amount left, the number of packets that left the queue and, when some
+        # service is left, the largest class in the queue.
+        n_classes = self.n_classes
+        classes = self.classes[self.head:]
+        counts = self.counts[self.head:]
+        packets = [0] * (n_classes + 1)
+        for cl, n in zip(classes, counts):
+            packets[cl] += n
+
+        n_packets = self.n_packets
+        top = max(classes)  # largest class in the queue, before the shift
+        shift = 0
+        service = 0
+        max_class = None
+        while True:
+            service += n_packets * inc_class
+            shift += inc_class
+            if top + shift > n_classes:
+                # the increments never take a class past the departure, so only the
+                # packets of the largest class can depart
+                n_packets -= packets[top]
+                top = max((cl for cl in range(1, top) if packets[cl]), default=0)
+            if amount - service <= 0 or n_packets == 0:
+                break
+            max_class = top + shift
+            am_ppk = max(int((amount - service)/n_packets), 1)
+            inc_class = min(am_ppk, n_classes-max_class+1)
+            if amount - service <= n_packets * inc_class:
+                break  # the next cycle ends in the middle of the queue
+
+        stay = n_classes - shift  # largest class that does not depart
+        self.classes = [cl + shift for cl in classes if cl <= stay]
+        self.counts = [n for cl, n in zip(classes, counts) if cl <= stay]
+        self.head = 0
+        exit_packets = self.n_packets - n_packets
+        self.n_packets = n_packets
+        self.total_workload -= service - exit_packets
+        return amount - service, exit_packets, max_class
+
+    def compact(self):
+        # drops the runs before the head once they fill half of the lists
+        if self.head > 1024 and 2 * self.head > len(self.counts):
+            del self.classes[:self.head]
+            del self.counts[:self.head]
+            self.head = 0
+
     def append(self, pkt_class: int = 1, pkt_n: int = 1):
-        self.q_classes.append(pkt_class)
-        self.q_packets.append(pkt_n)
+        self.classes.append(pkt_class)
+        self.counts.append(pkt_n)
+        self.total_workload += (self.n_classes - pkt_class) * pkt_n
 
     def get_head(self):
-        return self.q_classes[0], self.q_packets[0]
+        return self.classes[self.head], self.counts[self.head]
 
     def update_head(self, pkt_n: int):
-        self.q_packets[0] = pkt_n
+        pkt_class, n = self.get_head()
+        self.total_workload += (self.n_classes - pkt_class) * (pkt_n - n)
+        self.counts[self.head] = pkt_n
 
     def popleft(self):
-        return self.q_classes.popleft(), self.q_packets.popleft()
+        head = self.get_head()
+        self.total_workload -= (self.n_classes - head[0]) * head[1]
+        self.head += 1
+        self.compact()
+        return head
 
     def workload(self):
-        if self.n_packets == 0:
-            return 0
-        return sum([(self.n_classes - self.q_classes[_]) *  self.q_packets[_] for _ in range(len(self.q_packets))])
+        return self.total_workload
+
+    def check_workload(self):
+        # cross-checks the running workload against its computation from the runs
+        workload = sum([(self.n_classes - cl) * n for cl, n in zip(self.classes[self.head:], self.counts[self.head:])])
+        if workload != self.total_workload:
+            raise Exception(f'Workload {self.total_workload} differs from the {workload} of the queue')
 
     def __len__(self):
         return self.n_packets
 
     def __str__(self):
-        return str(self.q_classes)
-
+        return str(list(self.classes[self.head:]))
@@ -0,0 +1,548 @@
+import logging
+import numpy as np
+from functools import partial
+from lib import rybkostolyar, variablespeed
+from lib.blocks import SimulationBlocks
+from lib.multiclassqueue import MulticlassQueue
+from lib.recorder import Recorder
+
+BLOCK = 2 ** 12  # steps recorded at once
+
+# steps for which the stations must have chosen the same queues before they are moved at once,
+# and largest number of steps moved at once
+FAST_FORWARD_STEPS = 16
+FAST_FORWARD_WINDOW = 2 ** 12
+
+
+class Network:
+    # Network of single-server stations under the MaxWeight policy, described by arrays over its queues.
+    # The queues of a station are contiguous and, at each step, every station serves the queue with the
+    # largest length times weight, the first one on ties. The packets a queue is able to serve in a step
+    # are given by its service, a number or the name and arguments of a RandomStream draw such as
+    # ('rand_int', 5.6). The packets served move on to the next queue given by the routing, a sparse
+    # map from queue to queue, or leave the network from the queues that it leaves out.
+    # Every arrival stream, the name and arguments of a RandomStream draw with the queues it feeds,
+    # brings the packets of a step to one of these queues, drawn uniformly.
+    # With sequential, the stations serve one after the other and see the packets routed by the
+    # stations before them, otherwise they all serve the queues as they were at the start of the step;
+    # with arrivals_first the arrivals of a step come before the services, otherwise after them.
+    # The queues that hold more than a number of packets, e.g. multiclass queues, are given by a map
+    # to the constructor of an object with push(n) and serve(amount), which returns the number of packets
+    # that leave the queue.
+
+    def __init__(self, station, weight, service, routing=None, arrivals=(), init=None, queues=None,
+                 sequential=False, arrivals_first=False):
+        self.station = np.asarray(station)
+        if np.any(np.diff(self.station) < 0):
+            raise ValueError('The queues of a station must be contiguous and the stations in order')
+        self.n_queues = len(self.station)
+        self.starts = np.flatnonzero(np.diff(self.station, prepend=-1))
+        self.ends = np.append(self.starts[1:], self.n_queues)
+        self.n_stations = len(self.starts)
+        self.weight = np.asarray(weight, dtype=np.float64)
+        self.service = list(service)
+        self.next_queue = np.full(self.n_queues, -1)
+        for queue, next_queue in (routing or {}).items():
+            self.next_queue[queue] = next_queue
+        self.arrivals = [(draw, [int(q) for q in targets]) for draw, targets in arrivals]
+        self.init = np.zeros(self.n_queues, np.int64) if init is None else np.asarray(init, np.int64)
+        self.queues = dict(queues or {})
+        self.sequential = sequential
+        self.arrivals_first = arrivals_first
+
+    def fields(self):
+        # recorded at each step: the lengths of the queues at its end and, for every station,
+        # the queue it served and the number of packets that it served
+        return [('lengths', np.int64, (self.n_queues,)),
+                ('queue', np.int64, (self.n_stations,)), ('served', np.int64, (self.n_stations,))]
+
+
+def _serve(length, services, before, after):
+    # Lengths of a queue of the given length at the end of each of the steps in which it receives `before`
+    # packets, is served `services` packets and then receives `after` packets, and the numbers of packets
+    # served. The length after the service follows w = max(w + before - services, 0), which is solved with
+    # a running minimum.
+    walk = before - services
+    walk[1:] += after[:-1]
+    np.cumsum(walk, out=walk)
+    served_length = walk + np.maximum(length, -np.minimum.accumulate(walk))
+    lengths = served_length + after
+    served = np.concatenate(([length], lengths[:-1])) + before - served_length
+    return lengths, served
+
+
+def _plan(network, objects, choice):
+    # The served queues of a choice of all the stations in the order in which their lengths are solved by the
+    # fast-forward, each one after the served queues routed to it, with the queue chosen by the station of
+    # every queue and whether the queue comes before it, which wins ties; or None when the choice cannot be
+    # moved at once: when a served queue is an object or the served queues are routed in a cycle.
+    station = network.station.tolist()
+    next_queue = network.next_queue.tolist()
+    if any(objects[queue] is not None for queue in choice):
+        return None
+    order, pending = [], list(choice)
+    while pending:
+        ready = [queue for queue in pending if not any(next_queue[other] == queue for other in pending)]
+        if not ready:
+            return None
+        order += ready
+        pending = [queue for queue in pending if queue not in ready]
+    rivals = np.asarray(choice)[network.station]
+    return [(station[queue], queue) for queue in order], rivals, (np.arange(network.n_queues) < rivals)[:, None]
+
+
+def _steps(network, weight, objects, services, arrivals):
+    # Source of a function make(...) returning run(limit, regime, held, hold), which takes up to `limit` steps one
+    # at a time and returns the number taken, the queues chosen by the stations at the last one and the number of
+    # steps for which they have been chosen, stopping once it reaches `hold`. The steps are written out for the
+    # network, with its queues and streams as local names, so that they are as quick as the loops of the kernels.
+    # MaxWeight compares the longest queue of each run of queues of the same integer weight, found by max().
+    next_queue = network.next_queue.tolist()
+    sequential, arrivals_first = network.sequential, network.arrivals_first
+    lines = []
+
+    def emit(depth, line):
+        lines.append('    ' * depth + line)
+
+    def push(depth, target, n, targets):
+        # the packets `n` join the queue `target`, a queue or the name of one of `targets`
+        if isinstance(target, int):
+            if objects[target] is not None:
+                emit(depth, f'queue_{target}.push({n})')
+        elif any(objects[queue] is not None for queue in targets):
+            emit(depth, f'obj = objects[{target}]')
+            emit(depth, 'if obj is not None:')
+            emit(depth + 1, f'obj.push({n})')
+        emit(depth, f'l[{target}] += {n}')
+
+    def arrive(depth):
+        for k, (_, targets, routing) in enumerate(arrivals):
+            emit(depth, f'n = next(arrival_{k})')
+            emit(depth, 'add_arrived(n)')
+            emit(depth, 'if n:')
+            if routing is None:
+                push(depth + 1, targets[0], 'n', targets)
+            else:
+                emit(depth + 1, f'queue = targets_{k}[next(routing_{k})]')
+                emit(depth + 1, 'add_destination(queue)')
+                push(depth + 1, 'queue', 'n', targets)
+
+    def serve(depth, s, queue, queues):
+        # the station s serves `queue`, a queue or the name of one of `queues`
+        drawn = {services[q] is not None for q in queues}
+        plain = {objects[q] is None for q in queues}
+        targets = sorted({next_queue[q] for q in queues})
+        if isinstance(queue, int):
+            amount = f'amount_{queue}' if services[queue] is None else f'next(service_{queue})'
+            obj = f'queue_{queue}'
+        else:
+            amount = 'next(services[queue])' if drawn == {True} else 'amounts[queue]' if drawn == {False} else \
+                '(amounts[queue] if services[queue] is None else next(services[queue]))'
+            obj = 'objects[queue]'
+        emit(depth, f'x = {amount}')
+        if plain == {True}:
+            emit(depth, f'n = l[{queue}]')
+            emit(depth, f'o{s} = x if x < n else n')
+        elif plain == {False}:
+            emit(depth, f'o{s} = {obj}.serve(x)')
+        else:
+            emit(depth, f'o{s} = (x if x < l[queue] else l[queue]) if {obj} is None else {obj}.serve(x)')
+        target = targets[0] if len(targets) == 1 else f'routes[{queue}]'
+        if sequential:
+            emit(depth, f'if o{s}:')
+            emit(depth + 1, f'l[{queue}] -= o{s}')
+            if isinstance(target, str):
+                emit(depth + 1, f'target = {target}')
+                emit(depth + 1, 'if target >= 0:')
+                push(depth + 2, 'target', f'o{s}', [t for t in targets if t >= 0])
+            elif target >= 0:
+                push(depth + 1, target, f'o{s}', targets)
+        else:
+            emit(depth, f'l[{queue}] -= o{s}')
+            emit(depth, f't{s} = {target}')
+
+    emit(0, 'def make(l, weight, amounts, services, objects, routes, arrivals, chosen, served, arrived, destinations):')
+    for queue in range(network.n_queues):
+        emit(1, f'amount_{queue}, service_{queue}, queue_{queue}, weight_{queue} = '
+                f'amounts[{queue}], services[{queue}], objects[{queue}], weight[{queue}]')
+    for k in range(len(arrivals)):
+        emit(1, f'arrival_{k}, targets_{k}, routing_{k} = arrivals[{k}]')
+    emit(1, 'add_chosen, add_served, add_arrived, add_destination = '
+            'chosen.append, served.append, arrived.append, destinations.append')
+    regime = ', '.join(f'r{s}' for s in range(network.n_stations)) + ','
+    chosen = ', '.join(f'c{s}' for s in range(network.n_stations)) + ','
+    emit(1, 'def run(limit, regime, held, hold):')
+    emit(2, f'{regime} = regime')
+    emit(2, 'for step in range(limit):')
+    if arrivals_first:
+        arrive(3)
+    for s, (first, last) in enumerate(zip(network.starts.tolist(), network.ends.tolist())):
+        runs = []  # first and last queue and weight of the runs of queues of the same integer weight
+        for queue in range(first, last):
+            if runs and isinstance(weight[queue], int) and weight[queue] > 0 and weight[queue] == runs[-1][2]:
+                runs[-1][1] = queue + 1
+            else:
+                runs.append([queue, queue + 1, weight[queue]])
+        for i, (a, b, w) in enumerate(runs):
+            emit(3, f'm{i} = l[{a}]' if b - a == 1 else f'm{i} = max(l[{a}:{b}])')
+            if len(runs) > 1:
+                emit(3, f'u{i} = m{i}' if w == 1 else f'u{i} = m{i} * weight_{a}')
+        if len(runs) > 2:
+            emit(3, 'u = max(' + ', '.join(f'u{i}' for i in range(len(runs))) + ')')
+        for i, (a, b, _) in enumerate(runs):
+            depth = 3
+            if len(runs) > 1:
+                depth = 4
+                condition = 'u0 >= u1' if len(runs) == 2 else f'u{i} == u'
+                emit(3, 'else:' if i == len(runs) - 1 else f'if {condition}:' if i == 0 else f'elif {condition}:')
+            if b - a == 1:
+                emit(depth, f'c{s} = {a}')
+                serve(depth, s, a, [a])
+            else:
+                emit(depth, f'c{s} = queue = l.index(m{i}, {a}, {b})')
+                serve(depth, s, 'queue', list(range(a, b)))
+        emit(3, f'add_chosen(c{s})')
+        emit(3, f'add_served(o{s})')
+    if not sequential:
+        # the packets routed by the stations, which all decide from the lengths at the start of the step
+        for s, (first, last) in enumerate(zip(network.starts.tolist(), network.ends.tolist())):
+            targets = sorted({next_queue[queue] for queue in range(first, last)} - {-1})
+            if targets:
+                emit(3, f'if o{s} and t{s} >= 0:')
+                push(4, f't{s}', f'o{s}', targets)
+    if not arrivals_first:
+        arrive(3)
+    emit(3, 'if ' + ' and '.join(f'c{s} == r{s}' for s in range(network.n_stations)) + ':')
+    emit(4, 'held += 1')
+    emit(4, 'if held == hold:')
+    emit(5, f'return step + 1, ({chosen}), held')
+    emit(3, 'else:')
+    emit(4, f'{regime} = {chosen}')
+    emit(4, 'held = 0')
+    emit(2, f'return limit, ({regime}), held')
+    emit(1, 'return run')
+    return '\n'.join(lines)
+
+
+def simulate(network, rng, runtime, recording=None, state=None, logger=None):
+    # Simulates the network up to time `runtime`, appending one row per time step to the recording.
+    # Every queue draws its service from its own random stream, as the scripts do, so that the
+    # networks of the figures give the same simulations as them. With many queues, the rng should
+    # draw smaller blocks to keep the memory of the streams down.
+    # The steps only record the arrivals and the services, from which the lengths of all the queues are
+    # computed once per block of BLOCK steps; the long stretches of steps in which every station keeps
+    # serving the same queue are simulated at once, with the same random values and results as step by step.
+    # With a state, the simulation resumes from it and the recording should hold the rows before it.
+    # Returns the recording and the final state.
+    logger = logging.getLogger(__name__) if logger is None else logger
+    if recording is None:
+        recording = Recorder(network.fields(), runtime)
+
+    if state is None:
+        start_time = 0
+        lengths = network.init.tolist()
+        queues = {queue: make() for queue, make in network.queues.items()}
+        for queue, obj in queues.items():
+            obj.push(lengths[queue])
+        services = [None if np.isscalar(service) else getattr(rng, service[0])(*service[1:])
+                    for service in network.service]
+        # the queue of every arrival is drawn from the last stream
+        arrivals = [(getattr(rng, draw[0])(*draw[1:]), targets,
+                     rng.integers(len(targets)) if len(targets) > 1 else None) for draw, targets in network.arrivals]
+    else:
+        start_time = state['time']
+        lengths, queues = state['lengths'], state['queues']
+        services, arrivals = state['services'], state['arrivals']
+
+    def get_state(_time):
+        return dict(time=_time, lengths=lengths, queues=queues, services=services, arrivals=arrivals)
+
+    fast_forward = not logger.isEnabledFor(logging.DEBUG)
+    n_queues, n_stations = network.n_queues, network.n_stations
+    # integer weights are compared as integers, which is quicker and gives the same choices
+    weight = [int(w) if w.is_integer() else w for w in network.weight.tolist()]
+    weights = network.weight[:, None]
+    next_queue = network.next_queue.tolist()
+    station = network.station.tolist()
+    amounts = network.service
+    objects = [queues.get(queue) for queue in range(n_queues)]
+    sequential, arrivals_first = network.sequential, network.arrivals_first
+
+    # the steps not yet recorded: the queue chosen by each station and the packets it served, the packets
+    # of each arrival stream and the queues drawn for those that have several, from the lengths the queues
+    # had before them; the values of the steps taken one at a time are lists, turned into arrays next to
+    # those of the steps moved at once
+    pending = 0
+    chosen, served, arrived, destinations = [], [], [], []
+    staged = [], [], [], []
+    widths = n_stations, n_stations, len(arrivals), None
+    base = list(lengths)
+    first_targets = np.array([targets[0] for _, targets, _ in arrivals], np.int64)
+    drawn_targets = [k for k, (_, _, routing) in enumerate(arrivals) if routing is not None]
+    # the rows of a block and the changes they are computed from, allocated once: fresh memory costs more to
+    # write to than the computations themselves
+    size = max(min(BLOCK, runtime - start_time), 1)
+    rows = np.empty(size, recording.dtype)
+    changes_rows = np.empty((size, n_queues), np.int64)
+    offsets = np.arange(size) * n_queues
+
+    def stage():
+        for values, arrays, width in zip((chosen, served, arrived, destinations), staged, widths):
+            if values:
+                array = np.array(values, np.int64)
+                arrays.append(array if width is None else array.reshape(-1, width))
+                values.clear()
+
+    def flush():
+        nonlocal pending
+        if not pending:
+            return
+        stage()
+        choice, out, counts = (np.concatenate(arrays) if arrays else np.zeros((pending, 0), np.int64)
+                               for arrays in staged[:3])
+        drawn = np.concatenate(staged[3]) if staged[3] else np.zeros(0, np.int64)
+        steps = offsets[:pending]
+        # the changes of the lengths in each step, added to the flat rows at the offsets of the steps
+        changes = changes_rows[:pending]
+        changes.fill(0)
+        flat = changes.reshape(-1)
+        targets = np.tile(first_targets, (pending, 1))
+        if drawn_targets:
+            routed = targets[:, drawn_targets]
+            routed[counts[:, drawn_targets] > 0] = drawn
+            targets[:, drawn_targets] = routed
+        for k in range(len(arrivals)):
+            np.add.at(flat, steps + targets[:, k], counts[:, k])
+        for s in range(n_stations):
+            np.subtract.at(flat, steps + choice[:, s], out[:, s])
+            routed = network.next_queue[choice[:, s]]
+            to = routed >= 0
+            np.add.at(flat, steps[to] + routed[to], out[to, s])
+        changes[0] += base
+        np.cumsum(changes, axis=0, out=changes)  # in place, much quicker than into the strided field
+        block = rows[:pending]
+        block['lengths'] = changes
+        block['queue'] = choice
+        block['served'] = out
+        recording.extend(block)
+        pending = 0
+        base[:] = lengths
+        for arrays in staged:
+            arrays.clear()
+
+    plans = {}
+    regime = (-1,) * n_stations  # queues chosen at the previous step
+    held = 0  # steps for which they have been chosen
+    window = FAST_FORWARD_STEPS
+
+    def forward(choice, steps):
+        # Moves the queues at once over up to `steps` steps in which every station serves the queue of
+        # `choice`, from the values the random streams hold for these steps, as if the stations kept their
+        # queues, and keeps the steps up to the first one at which a station would have chosen another queue,
+        # which are recorded as the steps taken one at a time.
+        # The steps stop at the end of the current blocks of the streams, so that they draw their blocks as
+        # step by step. Returns the number of steps kept.
+        nonlocal window, pending, held
+        plan, rivals, earlier = plans[choice]
+        drawn = [services[queue] for _, queue in plan if services[queue] is not None]
+        steps = min([steps] + [stream.left() for stream in drawn] + [stream.left() for stream, _, _ in arrivals])
+        if steps < 2:
+            return 0
+        counts = [stream.peek(steps).astype(np.int64, copy=False) for stream, _, _ in arrivals]
+        hits = [None if routing is None else np.flatnonzero(n) for (_, _, routing), n in zip(arrivals, counts)]
+        for (_, _, routing), hit in zip(arrivals, hits):
+            if routing is not None and len(hit) > routing.left():
+                steps = min(steps, int(hit[routing.left()]))
+        if steps < 2:
+            return 0
+        if pending + steps > size:
+            flush()
+
+        # the packets each queue receives in each step before the service of its station, and after it, a row
+        # of steps per queue
+        before = np.zeros((n_queues, steps), np.int64)
+        after = np.zeros((n_queues, steps), np.int64)
+        arriving = before if arrivals_first else after
+        targets = []  # the queue of each arrival stream at each step
+        for k, ((_, queues, routing), n, hit) in enumerate(zip(arrivals, counts, hits)):
+            if routing is None:
+                arriving[queues[0]] += n[:steps]
+                targets.append(first_targets[k:k + 1])  # the same at every step
+            else:
+                hit = hit[hit < steps]
+                target = np.full(steps, queues[0])
+                target[hit] = np.asarray(queues)[routing.peek(len(hit)).astype(np.int64, copy=False)]
+                arriving[target, np.arange(steps)] += n[:steps]
+                targets.append(target)
+        # the served queues, each one once those routed to it are known
+        outs = {}
+        for s, queue in plan:
+            stream = services[queue]
+            amount = np.full(steps, amounts[queue], np.int64) if stream is None else \
+                stream.peek(steps).astype(np.int64, copy=False)
+            path, out = _serve(lengths[queue], amount, before[queue], after[queue])
+            outs[queue] = path, out
+            target = next_queue[queue]
+            if target >= 0:
+                # the stations after s in a sequential step see the packets it serves
+                (before if sequential and station[target] > s else after)[target] += out
+        start = np.array(lengths, np.int64)[:, None]
+        paths = np.cumsum(before + after, axis=1)
+        paths += start
+        for queue, (path, _) in outs.items():
+            paths[queue] = path
+
+        # MaxWeight at every step from the lengths the stations decide from: the steps kept are those before
+        # the first one at which a queue beats the queue chosen by its station
+        decided = np.concatenate((start, paths[:, :-1]), axis=1)
+        decided += before
+        decided = decided * weights
+        rival = decided[rivals]
+        beaten = np.flatnonzero(((decided > rival) | ((decided == rival) & earlier)).any(axis=0))
+        kept = int(beaten[0]) if len(beaten) else steps
+        if kept == 0:
+            return 0
+        if kept == steps:
+            window = min(2 * window, FAST_FORWARD_WINDOW)
+        else:
+            held = 0  # a station chooses another queue at the next step
+
+        for stream in drawn:
+            stream.skip(kept)
+        counts = np.array([n[:kept] for n in counts]).reshape(len(arrivals), kept).T
+        for (stream, _, routing), n in zip(arrivals, counts.T):
+            stream.skip(kept)
+            if routing is not None:
+                routing.skip(int(np.count_nonzero(n)))
+        # the queues that are objects receive their packets one step at a time, in the order of a step
+        for queue, obj in enumerate(objects):
+            if obj is not None:
+                pushes = [np.where(target[:kept] == queue, n, 0) for target, n in zip(targets, counts.T)]
+                served_in = [outs[other][1][:kept] for _, other in sorted(plan) if next_queue[other] == queue]
+                received = pushes + served_in if arrivals_first else served_in + pushes
+                for values in zip(*[n.tolist() for n in received]):
+                    for n in values:
+                        if n:
+                            obj.push(n)
+        lengths[:] = paths[:, kept - 1].tolist()
+
+        stage()
+        staged[0].append(np.array([choice]).repeat(kept, axis=0))
+        staged[1].append(np.array([outs[queue][1][:kept] for queue in choice]).T)
+        staged[2].append(counts)
+        if drawn_targets:
+            routed_targets = np.array([targets[k][:kept] for k in drawn_targets]).T
+            staged[3].append(routed_targets[counts[:, drawn_targets] > 0])
+        pending += kept
+        if pending == size:
+            flush()
+        return kept
+
+    # the steps taken one at a time, see _steps
+    namespace = {}
+    exec(_steps(network, weight, objects, services, arrivals), namespace)
+    run = namespace['make'](lengths, weight, amounts, services, objects, next_queue, arrivals,
+                            chosen, served, arrived, destinations)
+
+    _time = start_time
+    while _time < runtime:
+        hold = FAST_FORWARD_STEPS if fast_forward else -1  # steps after which the queues are moved at once
+        if fast_forward and held >= FAST_FORWARD_STEPS:
+            if regime not in plans:
+                plans[regime] = _plan(network, objects, regime)
+            if plans[regime] is not None:
+                kept = forward(regime, min(window, runtime - _time))
+                if kept:
+                    _time += kept
+                    continue
+                hold = held + 1  # none kept at the end of a block of a stream: one step before the next try
+        steps, choice, choice_held = run(min(runtime - _time, size - pending), regime, held, hold)
+        if choice_held != held + steps:
+            window = FAST_FORWARD_STEPS  # a station chose another queue
+        regime, held = choice, choice_held
+        pending += steps
+        if pending == size:
+            flush()
+        _time += steps
+
+    flush()
+    return recording, get_state(runtime)
+
+
+def simulate_blocks(network, rng, runtime, block=2 ** 12, state=None, checkpoint=None, checkpoint_every=0,
+                    show_progress=False, logger=None, telemetry=None):
+    # The simulation of simulate() as an iterator over blocks of its recording, see SimulationBlocks.
+    kernel = partial(simulate, network, rng, logger=logger)
+    return SimulationBlocks(kernel, network.fields(), runtime, block, state, checkpoint, checkpoint_every,
+                            show_progress, logger, telemetry)
+
+
+# The networks of the figures. Their queues are those of component A then those of component B,
+# queue 0 of a component first so that it wins the ties of MaxWeight.
+
+def rybko_stolyar(a, nu, j, init_a0=0, init_aj=0, init_b0=0, init_bj=0):
+    # Figure 2: at each component, the packets arriving with probability a join one of the j queues,
+    # served nu at a time, from which they move on to queue 0 of the other component, served one at a time
+    queues_a = list(range(1, j + 1))
+    queues_b = list(range(j + 2, 2 * j + 2))
+    routing = dict([(q, j + 1) for q in queues_a] + [(q, 0) for q in queues_b])
+    return Network(station=[0] * (j + 1) + [1] * (j + 1), weight=([1] + [nu] * j) * 2,
+                   service=([1] + [nu] * j) * 2, routing=routing,
+                   arrivals=[(('bernoulli', a), queues_a), (('bernoulli', a), queues_b)],
+                   init=[init_a0] + [init_aj] * j + [init_b0] + [init_bj] * j,
+                   sequential=True, arrivals_first=True)
+
+
+def multiclass(a, epsilon, k, init_a0):
+    # Figure 7: queue 0 of a component feeds queue 1 of the other, a multiclass queue of k classes
+    return Network(station=[0, 0, 1, 1], weight=[1, 1/epsilon] * 2,
+                   service=[('rand_int', 1/epsilon), ('rand_int', 1/(epsilon*epsilon))] * 2,
+                   routing={0: 3, 2: 1}, arrivals=[(('rand_int', a), [0]), (('rand_int', a), [2])],
+                   init=[init_a0, 0, 0, 0], queues={1: partial(MulticlassQueue, k), 3: partial(MulticlassQueue, k)})
+
+
+def variable_speed(a, epsilon, m, init_a0):
+    # Figure 8: queue 0 of a component feeds queue 1 of the other, whose packets are served
+    # with probability 1/m each out of 1/eps^2 attempts
+    return Network(station=[0, 0, 1, 1], weight=[1, 1/epsilon] * 2,
+                   service=[('rand_int', 1/epsilon), ('binomial', 1/(epsilon*epsilon), 1 / m)] * 2,
+                   routing={0: 3, 2: 1}, arrivals=[(('rand_int', a), [0]), (('rand_int', a), [2])],
+                   init=[init_a0, 0, 0, 0])
+
+
+def rybko_stolyar_recording(recording, j):
+    # the recording of a rybko_stolyar network with the fields of the Rybko-Stolyar model
+    lengths, queue, served = recording['lengths'], recording['queue'], recording['served']
+    steps = np.arange(len(lengths))
+    rows = np.empty(len(lengths), np.dtype(rybkostolyar.RECORDING_FIELDS))
+    for c, other in (('A', 'B'), ('B', 'A')):
+        station = ord(c) - ord('A')
+        first = station * (j + 1)
+        served_0 = queue[:, station] == first
+        served_j = np.where(served_0, 0, served[:, station])
+        # the longest queue j is taken before the service, the shortest one after it
+        queues_j = lengths[:, first + 1:first + j + 1]
+        before = queues_j.copy()
+        before[steps, np.where(served_0, 0, queue[:, station] - first - 1)] += served_j
+        rows[c + '0'] = lengths[:, first]
+        rows['max' + c + 'j'] = before.max(axis=1)
+        rows['min' + c + 'j'] = queues_j.min(axis=1)
+        rows['out' + c + '0'] = np.where(served_0, served[:, station], 0)
+        rows['in' + other + '0'] = served_j
+    out = Recorder(rybkostolyar.RECORDING_FIELDS, len(rows))
+    out.extend(rows)
+    return out
+
+
+def two_component_recording(recording, epsilon):
+    # the recording of a multiclass or variable_speed network with the fields of these models,
+    # which leave out the first step
+    lengths = recording['lengths'][1:]
+    rows = np.empty(len(lengths), np.dtype(variablespeed.RECORDING_FIELDS))
+    rows['A0'] = lengths[:, 0] * epsilon
+    rows['A1'] = lengths[:, 1]
+    rows['B0'] = lengths[:, 2] * epsilon
+    rows['B1'] = lengths[:, 3]
+    out = Recorder(variablespeed.RECORDING_FIELDS, len(rows))
+    out.extend(rows)
+    return out
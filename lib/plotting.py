@@ -0,0 +1,101 @@
+import io
+import numpy as np
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+ENVELOPE_BUCKETS = 5000  # more than the pixel columns of the axes of the figures at 300 dpi
+VECTOR_FORMATS = ('.eps', '.pdf', '.ps', '.svg')
+
+
+def pyplot(headless: bool = False):
+    # matplotlib.pyplot, imported only once a figure is drawn since it takes most of the start up of
+    # the scripts; with headless, the figures are drawn with the Agg backend, which opens no window
+    import matplotlib
+    if headless:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def envelope(t, values, buckets=ENVELOPE_BUCKETS):
+    # the points of a series to draw: the series is cut in buckets of consecutive points, each narrower than
+    # a pixel column, and only the smallest and the largest value of each bucket are kept, in time order, so
+    # that the line covers the same pixels while a few thousand points are drawn
+    t = np.asarray(t)
+    values = np.asarray(values)
+    n = len(values)
+    if len(t) != n:
+        raise ValueError(f'the series has {n} values at {len(t)} times')
+    if n <= 2 * buckets:
+        return t, values
+
+    size = -(-n // buckets)
+    padded = np.pad(values, (0, -n % size), mode='edge').reshape(-1, size)
+    offsets = np.arange(0, len(padded) * size, size)
+    keep = np.unique(np.concatenate((offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1), [0, n - 1])))
+    keep = keep[keep < n]
+    return t[keep], values[keep]
+
+
+def save_figure(figure, paths, dpi=300):
+    # saves the figure to each of the files, with the format given by their extension: the figure is rendered
+    # once for all the raster formats, which are then only encoded from that image, and the lines are rasterized
+    # in the vector formats, so that their size does not grow with the length of the lines. The encoding of the
+    # images runs in a thread pool while the vector files are drawn, one after the other since matplotlib cannot
+    # draw a figure from two threads at once
+    raster = [path for path in paths if os.path.splitext(path)[1].lower() not in VECTOR_FORMATS]
+    vector = [path for path in paths if path not in raster]
+    bbox = _tight_bbox(figure, dpi)
+
+    with ThreadPoolExecutor() as pool:
+        encodings = []
+        if raster:
+            image = _render(figure, dpi, bbox)
+            encodings = [pool.submit(image.save, path, dpi=(dpi, dpi)) for path in raster]
+
+        for axes in figure.axes:
+            for line in axes.get_lines():
+                line.set_rasterized(True)
+        for path in vector:
+            figure.savefig(path, bbox_inches=bbox, dpi=dpi)
+
+        for encoding in encodings:
+            encoding.result()
+
+
+def _tight_bbox(figure, dpi):
+    # the bounding box of bbox_inches='tight', measured once for all the files: savefig measures it with a
+    # first pass over the figure, which draws the rasterized lines in full. The text is measured by the renderer
+    # of the canvas, or by Agg for the canvases without one, which matplotlib before 3.6 does not pick by itself
+    import matplotlib
+    from matplotlib.backends.backend_agg import RendererAgg
+
+    figure_dpi = figure.dpi
+    figure.set_dpi(dpi)
+    try:
+        if hasattr(figure.canvas, 'get_renderer'):
+            renderer = figure.canvas.get_renderer()
+        else:
+            renderer = RendererAgg(figure.bbox.width, figure.bbox.height, figure.dpi)
+        return figure.get_tightbbox(renderer).padded(matplotlib.rcParams['savefig.pad_inches'])
+    finally:
+        figure.set_dpi(figure_dpi)
+
+
+def _render(figure, dpi, bbox):
+    # the figure drawn by Agg as it is saved to a raster file, with the size read from the renderer that drew it
+    from PIL import Image
+
+    size = None
+
+    def on_draw(event):
+        nonlocal size
+        size = tuple(int(_) for _ in event.renderer.get_canvas_width_height())
+
+    buffer = io.BytesIO()
+    callback = figure.canvas.mpl_connect('draw_event', on_draw)
+    try:
+        figure.savefig(buffer, format='rgba', bbox_inches=bbox, dpi=dpi)
+    finally:
+        figure.canvas.mpl_disconnect(callback)
+    return Image.frombuffer('RGBA', size, buffer.getbuffer(), 'raw', 'RGBA', 0, 1).convert('RGB')
@@ -0,0 +1,44 @@
+from time import perf_counter
+
+
+class Profile:
+    # Time spent in each phase of a simulation, and the number of steps that went through it.
+    # The simulation kernels call lap(phase) at the end of each phase, which charges to it the time since
+    # the previous lap; start() is called where the laps start again, at the start of each run of a
+    # kernel, so that what happens between the runs is left to the phase 'other' of the report.
+    # The kernels take profile=None, and only call it behind a check of it, so that it costs nothing
+    # when it is not given.
+
+    def __init__(self):
+        self.created = perf_counter()
+        self.last = self.created
+        self.seconds = {}
+        self.steps = {}
+
+    def start(self):
+        self.last = perf_counter()
+
+    def lap(self, phase, steps=1):
+        now = perf_counter()
+        self.seconds[phase] = self.seconds.get(phase, 0.) + now - self.last
+        self.steps[phase] = self.steps.get(phase, 0) + steps
+        self.last = now
+
+    def add(self, phase, seconds, steps=0):
+        # for the phases timed outside the kernels
+        self.seconds[phase] = self.seconds.get(phase, 0.) + seconds
+        self.steps[phase] = self.steps.get(phase, 0) + steps
+
+    def report(self, steps):
+        # lines of a table of the phases, from the longest, with the steps per second of each of them
+        # and of the whole simulation of `steps` steps, since the profile was created
+        total = perf_counter() - self.created
+        seconds = dict(self.seconds, other=max(total - sum(self.seconds.values()), 0.))
+        lines = [f'{"phase":<16}{"seconds":>10}{"share":>8}{"steps":>12}{"steps/s":>14}']
+        for phase in sorted(seconds, key=seconds.get, reverse=True):
+            phase_steps = self.steps.get(phase, 0)
+            rate = f'{phase_steps / seconds[phase]:14.0f}' if phase_steps and seconds[phase] > 0 else f'{"":>14}'
+            lines.append(f'{phase:<16}{seconds[phase]:10.3f}{seconds[phase] * 100 / total:7.1f}%'
+                         f'{phase_steps or "":>12}{rate}')
+        lines.append(f'{"total":<16}{total:10.3f}{100:7.1f}%{steps:>12}{steps / total:14.0f}')
+        return lines
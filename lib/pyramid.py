@@ -0,0 +1,209 @@
+import json
+import numpy as np
+from lib.plotting import ENVELOPE_BUCKETS, envelope
+from lib.recorder import atomic_write
+
+MAGIC = b'MWPYR1\n'
+BLOCK = 2 ** 10  # rows of a block of the finest level
+CHUNK = 2 ** 20  # rows of the recording reduced at once while building, a multiple of BLOCK
+ALIGNMENT = 64  # of the levels in the file, for memory mapping
+
+
+def _dtype(dtype):
+    # one row of a level: the smallest, the largest and the mean value of each field over a block
+    fields = [(name, dtype[name]) for name in dtype.names]
+    return np.dtype([('min', fields), ('max', fields), ('mean', [(name, np.float64) for name in dtype.names])])
+
+
+def _level_rows(length: int, block: int):
+    # blocks of each level, the last block of a level being cut at the end of the recording, up to one
+    # block for the whole recording
+    rows = [-(-length // block)]
+    while rows[-1] > 1:
+        rows.append(-(-rows[-1] // 2))
+    return rows
+
+
+def build(array, block: int = BLOCK):
+    # Pyramid of a recording, a structured array with one row per time step: the level k holds the
+    # minimum, the maximum and the mean of every field over consecutive blocks of block * 2 ** k rows.
+    # The finest level is reduced from the recording a chunk at a time, so that a memory-mapped recording
+    # is read only once, and each level from the one below it.
+    length, shape, names = len(array), array.shape[1:], array.dtype.names
+    rows = _level_rows(length, block)
+    level = np.empty((rows[0],) + shape, _dtype(array.dtype))
+    sums = {name: np.empty((rows[0],) + shape) for name in names}
+    for start in range(0, length, CHUNK):
+        part = array[start:start + CHUNK]
+        blocks = slice(start // block, -(-(start + len(part)) // block))
+        index = np.arange(0, len(part), block)
+        for name in names:
+            level['min'][name][blocks] = np.minimum.reduceat(part[name], index, axis=0)
+            level['max'][name][blocks] = np.maximum.reduceat(part[name], index, axis=0)
+            sums[name][blocks] = np.add.reduceat(part[name], index, axis=0, dtype=np.float64)
+
+    levels, size = [], block
+    while True:
+        counts = np.minimum(size, length - size * np.arange(len(level))).reshape((-1,) + (1,) * len(shape))
+        for name in names:
+            level['mean'][name] = sums[name] / counts
+        levels.append(level)
+        if len(level) == 1:
+            return Pyramid(levels, length, block)
+        index = np.arange(0, len(level), 2)
+        parent = np.empty((len(index),) + shape, level.dtype)
+        for name in names:
+            parent['min'][name] = np.minimum.reduceat(level['min'][name], index, axis=0)
+            parent['max'][name] = np.maximum.reduceat(level['max'][name], index, axis=0)
+            sums[name] = np.add.reduceat(sums[name], index, axis=0)
+        level, size = parent, 2 * size
+
+
+def write(file, pyramid):
+    # Writes a pyramid after a JSON header, with its levels one after the other from the finest one,
+    # so that load() can memory-map them.
+    dtype = pyramid.levels[0].dtype['min']
+    header = json.dumps(dict(dtype=[[name, dtype[name].str] for name in dtype.names], shape=list(pyramid.shape),
+                             length=pyramid.length, block=pyramid.block)).encode()
+    size = len(MAGIC) + 8 + len(header)
+    header += b' ' * (-size % ALIGNMENT)
+
+    with atomic_write(file) as f:
+        f.write(MAGIC)
+        f.write(len(header).to_bytes(8, 'little'))
+        f.write(header)
+        for level in pyramid.levels:
+            f.write(np.ascontiguousarray(level).tobytes())
+
+
+def load(file):
+    # pyramid written by write(), with its levels memory-mapped
+    with open(file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{file} is not a pyramid')
+        size = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(size))
+    dtype = _dtype(np.dtype([(name, dtype) for name, dtype in header['dtype']]))
+    shape = tuple(header['shape'])
+    rows = _level_rows(header['length'], header['block'])
+    data = np.memmap(file, dtype, 'r', offset=len(MAGIC) + 8 + size, shape=(sum(rows),) + shape)
+    offsets = np.cumsum([0] + rows)
+    return Pyramid([data[a:b] for a, b in zip(offsets, offsets[1:])], header['length'], header['block'])
+
+
+class Pyramid:
+    # Minima, maxima and means of the series of a recording over blocks of power of two sizes, see build(),
+    # to draw or search a window of the recording with a few blocks instead of all its rows.
+    # A window is covered by the blocks of the coarsest levels that fit in it, and the rows at its ends that
+    # no block of the finest level covers, fewer than BLOCK on each side, are read from the recording: a
+    # window of any length is drawn from O(pixels + log(length)) blocks and rows.
+    # The pyramid of a recording holds for every recording it is the beginning of, such as a shorter run
+    # cut from a cached one; the rows of the recording after the pyramid's length are read as they are.
+
+    def __init__(self, levels, length: int, block: int = BLOCK):
+        self.levels = levels
+        self.length = length
+        self.block = block
+        self.shape = levels[0].shape[1:]
+
+    def replica(self, i: int):
+        # pyramid of the i-th record of each row, as a pyramid without shape
+        return Pyramid([level[:, i] for level in self.levels], self.length, self.block)
+
+    def pieces(self, start: int, stop: int, top: int = None):
+        # [start, stop) as (level, first block, last block + 1) runs of blocks of the levels up to `top`,
+        # and (None, first row, last row + 1) for the rows no block covers, in time order
+        top = len(self.levels) - 1 if top is None else top
+        end = min(stop, self.length)  # of the blocks, the last one of each level may be cut short
+        pieces, p = [], start
+        while p < stop:
+            if p % self.block or p + self.block > end:
+                q = stop if p % self.block == 0 else min(stop, p + self.block - p % self.block)
+                pieces.append((None, p, q))
+                p = q
+                continue
+            k = max(k for k in range(top + 1) if p % (self.block << k) == 0 and p + (self.block << k) <= end)
+            size = self.block << k
+            last = end // size if k == top else p // size + 1
+            pieces.append((k, p // size, last))
+            p = last * size
+        return pieces
+
+    def stats(self, recording, name: str, start: int = 0, stop: int = None):
+        # smallest, largest and mean value of a series of the recording over [start, stop)
+        stop = len(recording) if stop is None else stop
+        low, high, total = [], [], 0.
+        for level, a, b in self.pieces(start, stop):
+            if level is None:
+                values = recording[name][a:b]
+                low.append(values.min(axis=0))
+                high.append(values.max(axis=0))
+                total = total + values.sum(axis=0, dtype=np.float64)
+            else:
+                blocks = self.levels[level][a:b]
+                low.append(blocks['min'][name].min(axis=0))
+                high.append(blocks['max'][name].max(axis=0))
+                total = total + blocks['mean'][name].sum(axis=0) * (self.block << level)  # complete blocks
+        return np.min(low, axis=0), np.max(high, axis=0), total / (stop - start)
+
+    def envelope(self, recording, name: str, start: int = 0, stop: int = None, buckets=ENVELOPE_BUCKETS):
+        # The points of a series of the recording to draw over [start, stop), as plotting.envelope: the blocks
+        # are the largest ones narrower than (stop - start) / buckets rows, each drawn by its smallest and its
+        # largest value at its first and its last row, and the rows at the ends by their envelope.
+        stop = len(recording) if stop is None else stop
+        top = int(np.floor(np.log2(max((stop - start) / buckets / self.block, 0.5))))
+        if top < 0:
+            return envelope(np.arange(start, stop), recording[name][start:stop], buckets)
+
+        t, values = [], []
+        for level, a, b in self.pieces(start, stop, min(top, len(self.levels) - 1)):
+            if level is None:
+                part = envelope(np.arange(a, b), recording[name][a:b], max(1, (b - a) * buckets // (stop - start)))
+            else:
+                blocks = self.levels[level][a:b]
+                first = (self.block << level) * np.arange(a, b)
+                # the smallest value comes first in the blocks whose mean rises over the previous block's, as
+                # in the series going up, so that the line does not go back and forth across the trend
+                rising = np.diff(blocks['mean'][name], prepend=blocks['mean'][name][:1]) >= 0
+                low, high = blocks['min'][name], blocks['max'][name]
+                part = (np.column_stack((first, first + (self.block << level) - 1)).ravel(),
+                        np.column_stack((np.where(rising, low, high), np.where(rising, high, low))).ravel())
+            t.append(part[0])
+            values.append(part[1])
+        return np.concatenate(t), np.concatenate(values)
+
+    def first(self, condition, bound, low: int, high: int):
+        # First time in [low, high) where condition(rows) holds, a boolean array over a slice of rows, and
+        # high if there is none. bound(blocks) is a necessary condition for condition to hold at some row of
+        # each block, from its minima, maxima and means: only the blocks where it holds are searched.
+        found = self._search(condition, bound, low, high, False)
+        return high if found is None else found
+
+    def last(self, condition, bound, low: int, high: int):
+        # last time in [low, high) where condition(rows) holds, low if there is none, see first()
+        found = self._search(condition, bound, low, high, True)
+        return low if found is None else found
+
+    def _search(self, condition, bound, low, high, reverse):
+        pieces = self.pieces(low, high)
+        for level, a, b in reversed(pieces) if reverse else pieces:
+            found = self._search_piece(condition, bound, level, a, b, reverse)
+            if found is not None:
+                return found
+        return None
+
+    def _search_piece(self, condition, bound, level, a, b, reverse):
+        if level is None:
+            mask = condition(slice(a, b))
+            if not mask.any():
+                return None
+            return b - 1 - int(mask[::-1].argmax()) if reverse else a + int(mask.argmax())
+        candidates = a + np.flatnonzero(bound(self.levels[level][a:b]))
+        for i in candidates[::-1] if reverse else candidates:
+            if level == 0:
+                found = self._search_piece(condition, bound, None, i * self.block, (i + 1) * self.block, reverse)
+            else:
+                found = self._search_piece(condition, bound, level - 1, 2 * i, 2 * i + 2, reverse)
+            if found is not None:
+                return found
+        return None
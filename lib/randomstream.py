@@ -0,0 +1,102 @@
+import numpy as np
+
+
+class BlockStream:
+    # Iterator over random values that are drawn from the generator in blocks.
+    # It is pickled with the state the generator had when the current block was drawn instead of the
+    # values of the block, which are drawn again from that state when it is unpickled.
+
+    __slots__ = ('source', 'kind', 'args', 'block', 'values', 'index', 'origin')
+
+    def __init__(self, source, kind: str, args: tuple, block: int):
+        self.source = source
+        self.kind = kind
+        self.args = args
+        self.block = block
+        self.values = []
+        self.index = 0
+        self.origin = None  # state of the generator before the current block was drawn
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.index == len(self.values):
+            self.refill()
+        value = self.values[self.index]
+        self.index += 1
+        return value
+
+    def left(self) -> int:
+        # values left in the current block
+        return len(self.values) - self.index
+
+    def peek(self, n: int) -> np.ndarray:
+        # the next n values at once, which must be left in the current block so that the
+        # blocks are drawn from the generator in the same order as by next()
+        return np.array(self.values[self.index:self.index + n])
+
+    def skip(self, n: int):
+        self.index += n
+
+    def refill(self):
+        self.origin = self.source.generator.bit_generator.state
+        self.values = self.draw(self.source.generator)
+        self.index = 0
+
+    def draw(self, generator) -> list:
+        return getattr(RandomStream, '_draw_' + self.kind)(generator, self.block, *self.args).tolist()
+
+    def __getstate__(self):
+        return self.source, self.kind, self.args, self.block, self.index, self.origin
+
+    def __setstate__(self, state):
+        self.source, self.kind, self.args, self.block, self.index, self.origin = state
+        self.values = []
+        if self.origin is not None:
+            generator = np.random.Generator(type(self.source.generator.bit_generator)())
+            generator.bit_generator.state = self.origin
+            self.values = self.draw(generator)
+
+
+class RandomStream:
+
+    def __init__(self, seed=None, block: int = 2 ** 14):
+        self.seed = seed
+        self.block = block
+        self.generator = np.random.default_rng(seed)
+
+    def bernoulli(self, p: float) -> BlockStream:
+        # True with probability p
+        return BlockStream(self, 'bernoulli', (p,), self.block)
+
+    def integers(self, high: int) -> BlockStream:
+        # uniform integers in [0, high)
+        return BlockStream(self, 'integers', (high,), self.block)
+
+    def rand_int(self, x: float) -> BlockStream:
+        # int(x) + 1 with probability x - int(x), int(x) otherwise, so that the mean is x
+        return BlockStream(self, 'rand_int', (x,), self.block)
+
+    def binomial(self, n: float, p: float) -> BlockStream:
+        # binomial(rand_int(n), p): a fractional number of trials is rounded as in rand_int
+        return BlockStream(self, 'binomial', (n, p), self.block)
+
+    # the values of a block of each kind of stream, drawn from a generator
+
+    @staticmethod
+    def _draw_bernoulli(generator, size, p):
+        return generator.random(size) < p
+
+    @staticmethod
+    def _draw_integers(generator, size, high):
+        return generator.integers(0, high, size)
+
+    @staticmethod
+    def _draw_rand_int(generator, size, x):
+        int_x = int(x)
+        return int_x + (generator.random(size) < x - int_x)
+
+    @staticmethod
+    def _draw_binomial(generator, size, n, p):
+        return generator.binomial(RandomStream._draw_rand_int(generator, size, n), p)
@@ -0,0 +1,180 @@
+import numpy as np
+import os
+import tempfile
+from contextlib import contextmanager, suppress
+from numpy.lib import format
+
+
+def partial_file(file):
+    # temporary file next to `file`, named after it, to be renamed onto it once it is complete
+    fd, partial = tempfile.mkstemp(prefix=os.path.basename(file) + '.', suffix='.part',
+                                   dir=os.path.dirname(os.path.abspath(file)))
+    os.close(fd)
+    os.chmod(partial, 0o644)  # readable by the other users of a shared directory
+    return partial
+
+
+@contextmanager
+def atomic_write(file, mode='wb'):
+    # File opened for writing under a temporary name, renamed onto `file` once the block completes,
+    # so that readers never see a partial file; the temporary file is removed if the block raises.
+    partial = partial_file(file)
+    try:
+        with open(partial, mode) as f:
+            yield f
+        os.replace(partial, file)
+    except BaseException:
+        with suppress(OSError):
+            os.remove(partial)
+        raise
+
+
+class Recorder:
+    # Recording of a simulation as a structured numpy array with one typed field per
+    # recorded series. Rows are preallocated and the storage doubles when it is full.
+    # With a non-empty shape every row holds that many records, e.g. one per replica.
+
+    def __init__(self, fields, capacity: int = 1024, shape=()):
+        self.dtype = np.dtype(fields)
+        self.fields = list(self.dtype.names)
+        self.shape = tuple(shape)
+        self.data = np.empty((max(capacity, 1),) + self.shape, self.dtype)
+        self.n = 0
+
+    @classmethod
+    def from_array(cls, array):
+        # wraps a recorded array without copying it
+        recorder = cls.__new__(cls)
+        recorder.dtype = array.dtype
+        recorder.fields = list(array.dtype.names)
+        recorder.shape = array.shape[1:]
+        recorder.data = array
+        recorder.n = len(array)
+        return recorder
+
+    @classmethod
+    def load(cls, file, mmap_mode=None):
+        return cls.from_array(np.load(file, mmap_mode=mmap_mode))
+
+    def append(self, *values):
+        if self.n == len(self.data):
+            self.grow()
+        if self.shape:
+            row = self.data[self.n]
+            for name, value in zip(self.fields, values):
+                row[name] = value
+        else:
+            self.data[self.n] = values
+        self.n += 1
+
+    def extend(self, rows):
+        if self.n + len(rows) > len(self.data):
+            self.grow(max(2 * len(self.data), self.n + len(rows)))
+        self.data[self.n:self.n + len(rows)] = rows
+        self.n += len(rows)
+
+    def grow(self, capacity: int = None):
+        capacity = 2 * len(self.data) if capacity is None else capacity
+        data = np.empty((capacity,) + self.shape, self.dtype)
+        data[:self.n] = self.data[:self.n]
+        self.data = data
+
+    def array(self):
+        return self.data[:self.n]
+
+    def replica(self, i: int):
+        # recording of the i-th record of each row, as a recorder without shape
+        return Recorder.from_array(self.array()[:, i])
+
+    def save(self, file):
+        with atomic_write(file) as f:
+            np.save(f, self.array())
+
+    def discard(self):
+        # drops what a recording that is not to be saved left on disk, nothing for a recording in memory
+        pass
+
+    def __getitem__(self, name):
+        # zero-copy view of a recorded series
+        return self.data[name][:self.n]
+
+    def __len__(self):
+        return self.n
+
+
+class StreamRecorder(Recorder):
+    # Recorder that streams its rows, one chunk at a time, into a memory-mapped .npy file,
+    # so that long recordings never have to fit in memory.
+    # The file is written under a temporary name and only appears under its own name
+    # once save() has completed it; discard() removes it when the run fails. checkpoint() makes the rows
+    # recorded so far readable from the temporary file while recording goes on.
+
+    def __init__(self, file, fields, capacity: int, shape=(), chunk: int = 2 ** 12):
+        super().__init__(fields, chunk, shape)
+        self.file = file
+        self.partial = partial_file(file)
+        self.store = format.open_memmap(self.partial, mode='w+', dtype=self.dtype, shape=(capacity,) + self.shape)
+        self.offset = 0  # rows already written to the store
+
+    def append(self, *values):
+        if self.n == len(self.data):
+            self.flush()
+        super().append(*values)
+
+    def extend(self, rows):
+        self.flush()
+        self.write(rows)
+
+    def flush(self):
+        if self.n == 0:
+            return
+        self.write(self.data[:self.n])
+        self.n = 0
+
+    def write(self, rows):
+        end = self.offset + len(rows)
+        if end > len(self.store):
+            raise ValueError(f'the recording is longer than the {len(self.store)} rows of {self.file}')
+        self.store[self.offset:end] = rows
+        self.offset = end
+
+    def array(self):
+        self.flush()
+        return self.store[:self.offset]
+
+    def save(self, file=None):
+        file = self.file if file is None else file
+        self.flush()
+        self.store.flush()
+        shape = (self.offset,) + self.shape
+        del self.store
+
+        # rows that were not used are cut off by rewriting the shape in the header
+        with open(self.partial, 'r+b') as f:
+            major, _ = format.read_magic(f)
+            size_bytes = 2 if major == 1 else 4
+            header_size = int.from_bytes(f.read(size_bytes), 'little')
+            header = repr({'descr': format.dtype_to_descr(self.dtype), 'fortran_order': False, 'shape': shape})
+            f.write((header.ljust(header_size - 1) + '\n').encode('latin1'))
+            f.truncate(f.tell() + int(np.prod(shape)) * self.dtype.itemsize)
+
+        os.replace(self.partial, file)
+        self.file = file
+        self.store = np.load(file, mmap_mode='r')
+
+    def discard(self):
+        if os.path.exists(self.partial):  # not saved
+            self.store = np.empty((0,) + self.shape, self.dtype)  # closes the memory map
+            os.remove(self.partial)
+
+    def checkpoint(self):
+        # writes the rows recorded so far through to the temporary file and returns its name
+        self.flush()
+        self.store.flush()
+        return self.partial
+
+    def __getitem__(self, name):
+        return self.array()[name]
+
+    def __len__(self):
+        return self.offset + self.n
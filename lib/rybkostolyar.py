@@ -0,0 +1,327 @@
+import logging
+import numpy as np
+from functools import partial
+from lib.blocks import SimulationBlocks
+from lib.indexedmax import IndexedMax
+from lib.movingaverage import moving_average
+from lib.recorder import Recorder
+
+MODEL = 'rybko-stolyar'
+MODEL_VERSION = 2  # to be increased whenever the simulated dynamics or the recording change
+
+# recorded series for each component: queue 0, max and min of the queues j > 0,
+# and the flows into and out of queue 0, whose moving averages are computed afterwards
+RECORDING_FIELDS = [
+    ('A0', np.int64), ('maxAj', np.int64), ('minAj', np.int64), ('inA0', np.int64), ('outA0', np.int64),
+    ('B0', np.int64), ('maxBj', np.int64), ('minBj', np.int64), ('inB0', np.int64), ('outB0', np.int64),
+]
+FLOW_FIELDS = ['inA0', 'outA0', 'inB0', 'outB0']
+QUEUE_FIELDS = [name for name, _ in RECORDING_FIELDS if name not in FLOW_FIELDS]
+
+
+def simulate(rng, a, nu, j, runtime, init_a0=0, init_aj=0, init_b0=0, init_bj=0,
+             recording=None, state=None, logger=None, profile=None):
+    # Simulates the network up to time `runtime`, appending one row per time step to the recording.
+    # With a state, the simulation resumes from it and the recording should hold the rows before it.
+    # With a Profile, the time spent in each phase of the steps is added to it.
+    # Returns the recording and the final state.
+    logger = logging.getLogger(__name__) if logger is None else logger
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if recording is None:
+        recording = Recorder(RECORDING_FIELDS, runtime)
+
+    if state is None:
+        start_time = 0
+
+        arrivals_A = rng.bernoulli(a)
+        arrivals_B = rng.bernoulli(a)
+        routing_A = rng.integers(j)
+        routing_B = rng.integers(j)
+
+        queue_A0 = init_a0
+        queue_Aj = IndexedMax(np.full(j, init_aj))
+        sum_queue_Aj = sum(queue_Aj)
+        max_queue_Aj = queue_Aj.max()
+        max_queue_A = max([queue_A0, max_queue_Aj])
+
+        queue_B0 = init_b0
+        queue_Bj = IndexedMax(np.full(j, init_bj))
+        sum_queue_Bj = sum(queue_Bj)
+        max_queue_Bj = queue_Bj.max()
+        max_queue_B = max([queue_B0, max_queue_Bj])
+
+        logger.debug(f'maxA: {max_queue_A}, maxB: {max_queue_B}')
+    else:
+        start_time = state['time']
+        arrivals_A, arrivals_B = state['arrivals_A'], state['arrivals_B']
+        routing_A, routing_B = state['routing_A'], state['routing_B']
+        queue_A0, queue_Aj, sum_queue_Aj = state['queue_A0'], state['queue_Aj'], state['sum_queue_Aj']
+        queue_B0, queue_Bj, sum_queue_Bj = state['queue_B0'], state['queue_Bj'], state['sum_queue_Bj']
+
+    def get_state(_time):
+        return dict(time=_time, arrivals_A=arrivals_A, arrivals_B=arrivals_B,
+                    routing_A=routing_A, routing_B=routing_B,
+                    queue_A0=queue_A0, queue_Aj=queue_Aj, sum_queue_Aj=sum_queue_Aj,
+                    queue_B0=queue_B0, queue_Bj=queue_Bj, sum_queue_Bj=sum_queue_Bj)
+
+    if profile:
+        profile.start()
+    for _time in range(start_time, runtime):
+
+        # arrivals at component A
+        arrA = 0
+        if next(arrivals_A):
+            arrA = next(routing_A)
+            queue_Aj.add(arrA, 1)
+            sum_queue_Aj += 1
+
+        # arrivals at component B
+        arrB = 0
+        if next(arrivals_B):
+            arrB = next(routing_B)
+            queue_Bj.add(arrB, 1)
+            sum_queue_Bj += 1
+        if profile:
+            profile.lap('arrivals')
+
+        in_queue_A0 = 0
+        in_queue_B0 = 0
+        out_queue_A0 = 0
+        out_queue_B0 = 0
+
+        # Component A
+        max_queue_Aj = queue_Aj.max()
+        ix_max_queue_Aj = queue_Aj.argmax()
+        if profile:
+            profile.lap('decision')
+        if queue_A0 >= nu * max_queue_Aj:
+            if queue_A0 > 0:
+                out_queue_A0 = 1
+                queue_A0 -= out_queue_A0
+        else:
+            svr_packets_A = min(nu, max_queue_Aj)
+            queue_Aj.add(ix_max_queue_Aj, -svr_packets_A)
+            sum_queue_Aj -= svr_packets_A
+            in_queue_B0 = svr_packets_A
+            queue_B0 += in_queue_B0
+        if profile:
+            profile.lap('service')
+
+        # Comnponent B
+        max_queue_Bj = queue_Bj.max()
+        ix_max_queue_Bj = queue_Bj.argmax()
+        if profile:
+            profile.lap('decision', 0)
+        if queue_B0 >= nu * max_queue_Bj:
+            if queue_B0 > 0:
+                out_queue_B0 = 1
+                queue_B0 -= out_queue_B0
+        else:
+            svr_packets_B = min(nu, max_queue_Bj)
+            queue_Bj.add(ix_max_queue_Bj, -svr_packets_B)
+            sum_queue_Bj -= svr_packets_B
+            in_queue_A0 = svr_packets_B
+            queue_A0 += in_queue_A0
+        if profile:
+            profile.lap('service', 0)
+
+        if debug:
+            max_queue_A = max([queue_A0, max_queue_Aj])
+            max_queue_B = max([queue_B0, max_queue_Bj])
+            logger.debug(f'arrA: {arrA}, arrB: {arrB}')
+            logger.debug(f'maxA: {max_queue_A}, maxB: {max_queue_B}')
+            if profile:
+                profile.lap('debug')
+
+        recording.append(queue_A0, max_queue_Aj, queue_Aj.min(), in_queue_A0, out_queue_A0,
+                         queue_B0, max_queue_Bj, queue_Bj.min(), in_queue_B0, out_queue_B0)
+        if profile:
+            profile.lap('recording')
+
+    return recording, get_state(runtime)
+
+
+def simulate_blocks(rng, a, nu, j, runtime, init_a0=0, init_aj=0, init_b0=0, init_bj=0, block=2 ** 12, state=None,
+                    checkpoint=None, checkpoint_every=0, show_progress=False, logger=None, profile=None,
+                    telemetry=None):
+    # The simulation of simulate() as an iterator over blocks of its recording, see SimulationBlocks.
+    kernel = partial(simulate, rng, a, nu, j, init_a0=init_a0, init_aj=init_aj, init_b0=init_b0, init_bj=init_bj,
+                     logger=logger, profile=profile)
+    return SimulationBlocks(kernel, RECORDING_FIELDS, runtime, block, state, checkpoint, checkpoint_every,
+                            show_progress, logger, telemetry)
+
+
+def simulate_ensemble(rng, a, nu, j, runtime, replicas, init_a0=0, init_aj=0, init_b0=0, init_bj=0,
+                      block=2 ** 10, recording=None, state=None, profile=None):
+    # Runs `replicas` independent copies of the Rybko-Stolyar network at once.
+    # Every queue is an array over the replicas, so each time step costs a fixed
+    # number of numpy operations whatever the number of replicas.
+    # With a state, the simulation resumes from it and the recording should hold the rows before it.
+    # With a Profile, the time spent in each phase of the steps is added to it.
+    # Returns the recording, a Recorder with one record per replica in each row, and the final state.
+    rows = np.arange(replicas)
+    if recording is None:
+        recording = Recorder(RECORDING_FIELDS, runtime, (replicas,))
+
+    if state is None:
+        start_time = 0
+
+        queue_A0 = np.full(replicas, init_a0)
+        queue_Aj = np.full((replicas, j), init_aj)
+
+        queue_B0 = np.full(replicas, init_b0)
+        queue_Bj = np.full((replicas, j), init_bj)
+
+        arrivals = routing = None
+    else:
+        # the arrivals of the current block are part of the state, the blocks after it are drawn from its rng
+        start_time, rng = state['time'], state['rng']
+        queue_A0, queue_Aj = state['queue_A0'], state['queue_Aj']
+        queue_B0, queue_Bj = state['queue_B0'], state['queue_Bj']
+        arrivals, routing = state['arrivals'], state['routing']
+
+    def get_state(_time):
+        return dict(time=_time, rng=rng, queue_A0=queue_A0, queue_Aj=queue_Aj, queue_B0=queue_B0, queue_Bj=queue_Bj,
+                    arrivals=arrivals, routing=routing)
+
+    if profile:
+        profile.start()
+    for _time in range(start_time, runtime):
+        b = _time % block
+        if b == 0:
+            arrivals = rng.generator.random((block, 2, replicas)) < a
+            routing = rng.generator.integers(0, j, (block, 2, replicas))
+
+        # arrivals at both components
+        arr = arrivals[b, 0]
+        queue_Aj[rows[arr], routing[b, 0, arr]] += 1
+        arr = arrivals[b, 1]
+        queue_Bj[rows[arr], routing[b, 1, arr]] += 1
+        if profile:
+            profile.lap('arrivals')
+
+        # Component A
+        ix_max_queue_Aj = queue_Aj.argmax(axis=1)
+        max_queue_Aj = queue_Aj[rows, ix_max_queue_Aj]
+        serve_A0 = queue_A0 >= nu * max_queue_Aj
+        if profile:
+            profile.lap('decision')
+        out_queue_A0 = (serve_A0 & (queue_A0 > 0)).astype(int)
+        queue_A0 -= out_queue_A0
+        in_queue_B0 = np.where(serve_A0, 0, np.minimum(nu, max_queue_Aj))
+        queue_Aj[rows, ix_max_queue_Aj] -= in_queue_B0
+        queue_B0 += in_queue_B0
+        if profile:
+            profile.lap('service')
+
+        # Component B
+        ix_max_queue_Bj = queue_Bj.argmax(axis=1)
+        max_queue_Bj = queue_Bj[rows, ix_max_queue_Bj]
+        serve_B0 = queue_B0 >= nu * max_queue_Bj
+        if profile:
+            profile.lap('decision', 0)
+        out_queue_B0 = (serve_B0 & (queue_B0 > 0)).astype(int)
+        queue_B0 -= out_queue_B0
+        in_queue_A0 = np.where(serve_B0, 0, np.minimum(nu, max_queue_Bj))
+        queue_Bj[rows, ix_max_queue_Bj] -= in_queue_A0
+        queue_A0 += in_queue_A0
+        if profile:
+            profile.lap('service', 0)
+
+        recording.append(queue_A0, max_queue_Aj, queue_Aj.min(axis=1), in_queue_A0, out_queue_A0,
+                         queue_B0, max_queue_Bj, queue_Bj.min(axis=1), in_queue_B0, out_queue_B0)
+        if profile:
+            profile.lap('recording')
+
+    return recording, get_state(runtime)
+
+
+def simulate_ensemble_blocks(rng, a, nu, j, runtime, replicas, init_a0=0, init_aj=0, init_b0=0, init_bj=0,
+                             block=2 ** 12, state=None, checkpoint=None, checkpoint_every=0, show_progress=False,
+                             logger=None, profile=None, telemetry=None):
+    # The simulation of simulate_ensemble() as an iterator over blocks of its recording, see SimulationBlocks.
+    kernel = partial(simulate_ensemble, rng, a, nu, j, replicas=replicas, init_a0=init_a0, init_aj=init_aj,
+                     init_b0=init_b0, init_bj=init_bj, profile=profile)
+    return SimulationBlocks(kernel, RECORDING_FIELDS, runtime, block, state, checkpoint, checkpoint_every,
+                            show_progress, logger, telemetry, (replicas,))
+
+
+def moving_averages(recording, av):
+    # moving averages over av steps of the flows into and out of queues A0 and B0,
+    # e.g. 'avInA0' for the recorded 'inA0'
+    return {'av' + name[0].upper() + name[1:]: moving_average(recording[name], av) for name in FLOW_FIELDS}
+
+
+def find_regions(recording, nu, level=400, empty_A0=0, margin_left=0, margin_right=0.15, pyramid=None):
+    # Cut window around the first time queue B0 reaches `level`: from the start of the
+    # equilibrium before it, while queue A0 is longer than nu times the longest queue Aj,
+    # to the end of the equilibrium at component B that follows the emptying of queue A0.
+    # Returns [start, [start of the equilibrium, queue A0 empty, end of the equilibrium], end].
+    # With one column per replica in the recording, every entry is an array over the replicas.
+    # With the pyramid of a recording without replicas (see lib/pyramid.py), the searches only read
+    # the rows of the blocks where the minima and maxima of the series allow a hit.
+    queue_A0 = recording['A0']
+    max_queue_Aj = recording['maxAj']
+    queue_B0 = recording['B0']
+    max_queue_Bj = recording['maxBj']
+    n = len(queue_A0)
+    shape = np.shape(queue_A0)[1:]  # one search per replica
+    t = np.arange(n).reshape((n,) + (1,) * len(shape))
+
+    # The series are searched in chunks of growing size, so that a search stops soon after
+    # its hit and only that part of a memory-mapped recording is read.
+    def first(condition, low, high, bound):
+        # first time in [low, high) where condition(chunk) holds, high if there is none;
+        # bound(blocks) is a necessary condition for a hit in each block of the pyramid
+        if pyramid is not None and shape == ():
+            return pyramid.first(condition, bound, int(low), int(high))
+        found = np.broadcast_to(high, shape).copy()
+        pending = np.ones(shape, bool)
+        begin, stop, size = np.min(low), np.max(high), 2 ** 12
+        while begin < stop and pending.any():
+            chunk = slice(begin, min(begin + size, stop))
+            mask = condition(chunk) & (t[chunk] >= low) & (t[chunk] < high)
+            hit = pending & mask.any(axis=0)
+            found = np.where(hit, begin + mask.argmax(axis=0), found)
+            pending &= ~hit
+            begin, size = chunk.stop, 2 * size
+        return found
+
+    def last(condition, low, high, bound):
+        # last time in [low, high) where condition(chunk) holds, low if there is none
+        if pyramid is not None and shape == ():
+            return pyramid.last(condition, bound, int(low), int(high))
+        found = np.broadcast_to(low, shape).copy()
+        pending = np.ones(shape, bool)
+        start, end, size = np.min(low), np.max(high), 2 ** 12
+        while end > start and pending.any():
+            chunk = slice(max(end - size, start), end)
+            mask = (condition(chunk) & (t[chunk] >= low) & (t[chunk] < high))[::-1]
+            hit = pending & mask.any(axis=0)
+            found = np.where(hit, end - 1 - mask.argmax(axis=0), found)
+            pending &= ~hit
+            end, size = chunk.start, 2 * size
+        return found
+
+    reach_level = first(lambda chunk: queue_B0[chunk] >= level, 0, n,
+                        lambda blocks: blocks['max']['B0'] >= level)
+    reach_empty_queue_A0 = first(lambda chunk: queue_A0[chunk] <= empty_A0, reach_level, n,
+                                 lambda blocks: blocks['min']['A0'] <= empty_A0)
+    # last time up to reach_level when queue A0 was empty, 0 if there is none
+    previous_empty_queue_A0 = last(lambda chunk: queue_A0[chunk] <= empty_A0, 0, np.minimum(reach_level + 1, n),
+                                   lambda blocks: blocks['min']['A0'] <= empty_A0)
+
+    start_equilibrium = first(lambda chunk: queue_A0[chunk] <= nu * max_queue_Aj[chunk],
+                              previous_empty_queue_A0, reach_level,
+                              lambda blocks: blocks['min']['A0'] <= nu * blocks['max']['maxAj'])
+    end_equilibrium = first(lambda chunk: queue_B0[chunk] <= nu * max_queue_Bj[chunk], reach_empty_queue_A0, n,
+                            lambda blocks: blocks['min']['B0'] <= nu * blocks['max']['maxBj'])
+
+    length = end_equilibrium - start_equilibrium
+    # the margins stop at the ends of the recording, which the equilibrium may never leave
+    start = np.maximum(start_equilibrium - np.asarray(length * margin_left).astype(int), 0)
+    end = np.minimum(end_equilibrium + np.asarray(length * margin_right).astype(int), n)
+    divisions = [start_equilibrium, reach_empty_queue_A0, end_equilibrium]
+    if shape == ():
+        return [int(start), [int(x) for x in divisions], int(end)]
+    return [start, divisions, end]
@@ -0,0 +1,86 @@
+import hashlib
+import itertools
+import json
+import numpy as np
+import time
+from lib import multiclass, rybkostolyar, variablespeed
+from lib.cache import SimulationCache
+from lib.randomstream import RandomStream
+from lib.recorder import Recorder
+from lib.telemetry import Telemetry
+
+# simulation kernel of each model, with the default parameters of its script
+MODELS = {
+    rybkostolyar.MODEL: (rybkostolyar, dict(a=7/12, nu=6, j=30, init_a0=2400, init_aj=0, init_b0=0, init_bj=0)),
+    multiclass.MODEL: (multiclass, dict(a=1, k=20, epsilon=0.1791, init_a0=55)),
+    variablespeed.MODEL: (variablespeed, dict(a=1, m=20, epsilon=0.1791, init_a0=55)),
+}
+
+
+def grid(model: str, values: dict):
+    # parameters of every point of the grid spanned by the lists of values,
+    # the parameters that are not swept keep their default value
+    names = list(values)
+    return [dict(MODELS[model][1], **dict(zip(names, point)))
+            for point in itertools.product(*(values[name] for name in names))]
+
+
+def spawn_key(params: dict) -> int:
+    # The random stream of a point is spawned from the root seed with a key derived from the
+    # parameters of the point, rather than from its position in the grid, so that a point
+    # keeps its stream, and its cache entry, when the grid changes.
+    description = json.dumps(params, sort_keys=True, default=str)
+    return int(hashlib.sha256(description.encode()).hexdigest()[:16], 16)
+
+
+def cost(model: str, params: dict, runtime: int) -> float:
+    # rough running time of a simulation, used to start the longest ones first
+    if model == rybkostolyar.MODEL:
+        return runtime * (np.log2(params['j']) + 4)  # tree updates and per-step overhead
+    if model == multiclass.MODEL:
+        return runtime * params['k']  # classes cycled through by the service of A1 and B1
+    return runtime
+
+
+def run(model: str, params: dict, seed: int, runtime: int, cache_dir=None,
+        checkpoint_every: int = 0, max_size: int = None, telemetry=None, telemetry_every: float = 10.) -> dict:
+    # Simulates a point of a sweep, or reads it from the cache, and returns its summary:
+    # the parameters, the final value and the maximum of each recorded series.
+    # With a telemetry file, the progress of the simulation is appended to it, see Telemetry.
+    # It runs in a worker process, so it only takes and returns plain data.
+    module = MODELS[model][0]
+    key = spawn_key(params)
+    cache_params = dict(params, seed=seed, spawn_key=key)
+    simulation_cache = SimulationCache(cache_dir, module.MODEL, module.MODEL_VERSION, max_size,
+                                       getattr(module, 'SCALED_FIELDS', None))
+
+    def store(steps, state, snapshot=False):
+        simulation_cache.store(cache_params, recording, steps, state, snapshot)
+
+    def checkpoint(steps, state):
+        store(steps, state, snapshot=True)
+
+    start = time.time()
+    recording, steps = simulation_cache.load(cache_params, runtime)
+    if steps < runtime:
+        state = simulation_cache.load_state(cache_params, steps) if steps > 0 else None
+        previous = recording
+        recording = Recorder(module.RECORDING_FIELDS, runtime)
+        if state is None:
+            rng = RandomStream(np.random.SeedSequence(seed, spawn_key=(key,)))
+        else:
+            rng = None  # the random streams are part of the state
+            recording.extend(previous.array())
+        simulation_telemetry = None if telemetry is None else \
+            Telemetry(telemetry, telemetry_every, getattr(module, 'QUEUE_FIELDS', None), model=model, **cache_params)
+        blocks = module.simulate_blocks(rng, runtime=runtime, state=state, checkpoint=checkpoint,
+                                        checkpoint_every=checkpoint_every, telemetry=simulation_telemetry, **params)
+        blocks.record(recording, store)
+        store(runtime, blocks.state)
+
+    summary = dict(params, seed=seed, runtime=runtime, cached=steps == runtime, time=time.time() - start)
+    for name in recording.fields:
+        series = np.asarray(recording[name])
+        summary['final_' + name] = series[-1].item() if len(series) else None
+        summary['max_' + name] = series.max().item() if len(series) else None
+    return summary
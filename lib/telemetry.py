@@ -0,0 +1,73 @@
+import json
+import math
+import os
+import sys
+import time
+
+
+def rss():
+    # resident memory of the process in bytes: the current one where /proc is available, else the peak
+    # one, and None where neither can be read
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Telemetry:
+    # Progress of a simulation as JSON lines appended to `file`, or written to stdout without a file or
+    # with '-', at most every `interval` seconds and at the end of the simulation, to be tailed while it runs.
+    # start() is called with the step the simulation starts from and update() with the rows of each block
+    # of the recording, see SimulationBlocks, so that the clock is only read once per block.
+    # Each line holds the labels, the step reached out of the runtime, the steps per second since the
+    # previous line and the time left at that rate, the last and the largest recorded value of the `fields`
+    # (all of them by default) since the telemetry was created, the largest over the replicas of a recording
+    # with one record per replica, the resident memory and the size of the recording up to the step reached.
+    # A line is written with a single call on a file opened for appending, so that the worker processes
+    # of a sweep can share a file.
+
+    def __init__(self, file=None, interval: float = 10., fields=None, **labels):
+        self.file = None if file == '-' else file
+        self.interval = interval
+        self.fields = fields
+        self.labels = labels
+        self.maxima = {}
+        self.last_time = self.last_step = None
+        self.next_report = 0.
+
+    def start(self, step: int):
+        self.last_time, self.last_step = time.time(), step
+
+    def update(self, step: int, runtime: int, rows):
+        fields = rows.dtype.names if self.fields is None else self.fields
+        if len(rows):
+            for name in fields:
+                largest = rows[name].max().item()
+                self.maxima[name] = max(self.maxima.get(name, largest), largest)
+
+        now = time.time()
+        if now < self.next_report and step < runtime:
+            return
+        rate = (step - self.last_step) / (now - self.last_time) if now > self.last_time else None
+        line = dict(self.labels, time=now, step=step, runtime=runtime, done=step >= runtime,
+                    steps_per_second=rate, eta_seconds=(runtime - step) / rate if rate else None,
+                    current={name: rows[name][-1].max().item() for name in fields} if len(rows) else None,
+                    max=dict(self.maxima), rss_bytes=rss(),
+                    recording_bytes=step * rows.dtype.itemsize * math.prod(rows.shape[1:]))
+        self.write(json.dumps(line, default=str) + '\n')
+        self.last_time, self.last_step = now, step
+        self.next_report = now + self.interval
+
+    def write(self, text):
+        if self.file is None:
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        else:
+            with open(self.file, 'a') as f:
+                f.write(text)
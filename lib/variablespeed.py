@@ -0,0 +1,256 @@
+import logging
+import numpy as np
+from functools import partial
+from lib.blocks import SimulationBlocks
+from lib.recorder import Recorder
+
+MODEL = 'variablespeed-singleclass'
+MODEL_VERSION = 1  # to be increased whenever the simulated dynamics or the recording change
+
+# queue lengths at A0 and B0 are recorded multiplied by epsilon
+RECORDING_FIELDS = [('A0', np.float64), ('A1', np.int64), ('B0', np.float64), ('B1', np.int64)]
+SCALED_FIELDS = {'A0': 'epsilon', 'B0': 'epsilon'}  # stored as integers in the cache, see SimulationCache
+
+# steps for which the served queues must have stayed the same before they are moved at once,
+# and largest number of steps moved at once
+FAST_FORWARD_STEPS = 16
+FAST_FORWARD_WINDOW = 2 ** 12
+
+
+def _serve(length, services, arrivals):
+    # Lengths of a queue of the given length after each of the steps in which it is served
+    # `services` packets and then receives `arrivals` packets, and the numbers of packets served.
+    # The length after the service follows w = max(w + arrivals - services, 0), which is
+    # solved with a running minimum.
+    walk = -services
+    walk[1:] += arrivals[:-1]
+    np.cumsum(walk, out=walk)
+    served_length = walk + np.maximum(length, -np.minimum.accumulate(walk))
+    lengths = served_length + arrivals
+    served = np.concatenate(([length], lengths[:-1])) - served_length
+    return lengths, served
+
+
+def simulate(rng, a, epsilon, m, init_a0, runtime, recording=None, state=None, logger=None, record_workload=False,
+             profile=None):
+    # Simulates the variable-speed single-class network up to time `runtime`, appending one row
+    # per time step but the first to the recording; with record_workload the workloads of A1
+    # and B1 are recorded instead of their lengths.
+    # Geometric service times of mean m at A1 and B1 give the same binomial numbers of services
+    # completed in a step (see below), so this simulation covers them too.
+    # The long stretches of steps in which each component keeps serving the same
+    # queue are simulated at once, with the same random values and results as step by step.
+    # With a state, the simulation resumes from it and the recording should hold the rows before it.
+    # With a Profile, the time spent in each phase of the steps is added to it, the steps moved at once
+    # in the phase 'fast-forward'.
+    # Returns the recording and the final state.
+    logger = logging.getLogger(__name__) if logger is None else logger
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if recording is None:
+        recording = Recorder(RECORDING_FIELDS, runtime)
+
+    if state is None:
+        start_time = 0
+
+        len_queue_A0 = init_a0
+        len_queue_A1 = 0
+        len_queue_B0 = len_queue_B1 = 0
+
+        cumulative_input_A = cumulative_output_A = 0
+        cumulative_input_B = cumulative_output_B = 0
+
+        services_A0 = rng.rand_int(1/epsilon)
+        services_B0 = rng.rand_int(1/epsilon)
+        arrivals_A = rng.rand_int(a)
+        arrivals_B = rng.rand_int(a)
+        # Completed services out of a fractional number 1/eps^2 of attempts. With geometric service
+        # times, served one after the other within the 1/eps^2 units of service of a step, the
+        # packets completed are those whose times add up to at most that, a count that is
+        # binomial as well: the service times are the gaps between the successes of the attempts.
+        services_A1 = rng.binomial(1/(epsilon*epsilon), 1 / m)
+        services_B1 = rng.binomial(1/(epsilon*epsilon), 1 / m)
+    else:
+        start_time = state['time']
+        len_queue_A0, len_queue_A1 = state['len_queue_A0'], state['len_queue_A1']
+        len_queue_B0, len_queue_B1 = state['len_queue_B0'], state['len_queue_B1']
+        cumulative_input_A, cumulative_output_A = state['cumulative_input_A'], state['cumulative_output_A']
+        cumulative_input_B, cumulative_output_B = state['cumulative_input_B'], state['cumulative_output_B']
+        services_A0, services_A1 = state['services_A0'], state['services_A1']
+        services_B0, services_B1 = state['services_B0'], state['services_B1']
+        arrivals_A, arrivals_B = state['arrivals_A'], state['arrivals_B']
+
+    def get_state(_time):
+        return dict(time=_time, len_queue_A0=len_queue_A0, len_queue_A1=len_queue_A1,
+                    len_queue_B0=len_queue_B0, len_queue_B1=len_queue_B1,
+                    cumulative_input_A=cumulative_input_A, cumulative_output_A=cumulative_output_A,
+                    cumulative_input_B=cumulative_input_B, cumulative_output_B=cumulative_output_B,
+                    services_A0=services_A0, services_A1=services_A1,
+                    services_B0=services_B0, services_B1=services_B1,
+                    arrivals_A=arrivals_A, arrivals_B=arrivals_B)
+
+    fast_forward = not debug
+    row_dtype = np.dtype(RECORDING_FIELDS)
+    regime_A0 = regime_B0 = None  # queues served at the previous step
+    regime_steps = 0  # steps for which they have been served
+    window = FAST_FORWARD_STEPS
+
+    if profile:
+        profile.start()
+    _time = start_time
+    while _time < runtime:
+
+        serve_A0 = len_queue_A0 >= len_queue_A1 / epsilon  # eq. (60)
+        serve_B0 = len_queue_B0 >= len_queue_B1 / epsilon  # eq. (60)
+        if serve_A0 == regime_A0 and serve_B0 == regime_B0:
+            regime_steps += 1
+        else:
+            regime_A0, regime_B0 = serve_A0, serve_B0
+            regime_steps = 0
+            window = FAST_FORWARD_STEPS
+
+        steps = 1
+        if fast_forward and regime_steps >= FAST_FORWARD_STEPS:
+            # The queues are moved at once over a window of steps, from the values the random streams
+            # hold for these steps, as if the queues served did not change. The steps up to the first
+            # one at which they would have changed are kept, the values they used taken from the streams.
+            streams = (services_A0 if serve_A0 else services_A1, services_B0 if serve_B0 else services_B1,
+                       arrivals_A, arrivals_B)
+            steps = min(window, runtime - _time, *(s.left() for s in streams))
+            steps = max(steps, 1)  # one step at a time when a stream has to draw its next block
+        if profile:
+            profile.lap('decision', 0 if steps > 1 else 1)
+
+        if steps > 1:
+            services_A, services_B, arrivals_A0, arrivals_B0 = (s.peek(steps) for s in streams)
+            no_output = np.zeros(steps, np.int64)
+            if serve_A0:
+                path_A0, out_queue_A0 = _serve(len_queue_A0, services_A, arrivals_A0)
+            else:
+                path_A0, out_queue_A0 = len_queue_A0 + np.cumsum(arrivals_A0), no_output
+            if serve_B0:
+                path_B0, out_queue_B0 = _serve(len_queue_B0, services_B, arrivals_B0)
+            else:
+                path_B0, out_queue_B0 = len_queue_B0 + np.cumsum(arrivals_B0), no_output
+            # queue A1 is fed by queue B0 and queue B1 by queue A0
+            if serve_A0:
+                path_A1, out_queue_A1 = len_queue_A1 + np.cumsum(out_queue_B0), no_output
+            else:
+                path_A1, out_queue_A1 = _serve(len_queue_A1, services_A, out_queue_B0)
+            if serve_B0:
+                path_B1, out_queue_B1 = len_queue_B1 + np.cumsum(out_queue_A0), no_output
+            else:
+                path_B1, out_queue_B1 = _serve(len_queue_B1, services_B, out_queue_A0)
+
+            changes = ((path_A0[:-1] >= path_A1[:-1] / epsilon) != serve_A0) \
+                | ((path_B0[:-1] >= path_B1[:-1] / epsilon) != serve_B0)
+            if changes.any():
+                steps = int(changes.argmax()) + 1
+            else:
+                window = min(2 * window, FAST_FORWARD_WINDOW)
+            for s in streams:
+                s.skip(steps)
+
+            len_queue_A0, len_queue_A1 = int(path_A0[steps - 1]), int(path_A1[steps - 1])
+            len_queue_B0, len_queue_B1 = int(path_B0[steps - 1]), int(path_B1[steps - 1])
+            cumulative_input_A += int(arrivals_A0[:steps].sum())
+            cumulative_output_A += int(out_queue_A1[:steps].sum())
+            cumulative_input_B += int(arrivals_B0[:steps].sum())
+            cumulative_output_B += int(out_queue_B1[:steps].sum())
+
+            rows = np.empty(steps, row_dtype)
+            rows['A0'] = path_A0[:steps] * epsilon
+            rows['A1'] = path_A1[:steps] * m if record_workload else path_A1[:steps]
+            rows['B0'] = path_B0[:steps] * epsilon
+            rows['B1'] = path_B1[:steps] * m if record_workload else path_B1[:steps]
+            # the fast-forward never covers step 0, whose row is left out: the queues served stay the same first
+            recording.extend(rows)
+            if profile:
+                profile.lap('fast-forward', steps)
+        else:
+            out_queue_A0 = out_queue_A1 = 0
+            out_queue_B0 = out_queue_B1 = 0
+
+            # Component A
+            if serve_A0:
+                # serving queue A0
+                service = next(services_A0)
+                out_queue_A0 = min(service, len_queue_A0)
+                len_queue_A0 -= out_queue_A0
+            else:
+                # serving queue A1
+                service = next(services_A1)
+                served = min(service, len_queue_A1)
+                len_queue_A1 -= served
+                out_queue_A1 += served
+
+            # Component B
+            if serve_B0:
+                # serving queue B0
+                service = next(services_B0)
+                out_queue_B0 = min(service, len_queue_B0)
+                len_queue_B0 -= out_queue_B0
+            else:
+                # serving queue B1
+                service = next(services_B1)
+                served = min(service, len_queue_B1)
+                len_queue_B1 -= served
+                out_queue_B1 += served
+            if profile:
+                profile.lap('service')
+
+            # arrivals at queue A0 from outside
+            arrivals_A0 = next(arrivals_A)
+            cumulative_input_A += arrivals_A0
+            len_queue_A0 += arrivals_A0
+
+            # arrivals at queue B1 from queue A0
+            len_queue_B1 += out_queue_A0
+
+            # departures from queue B1
+            cumulative_output_B += out_queue_B1
+
+            # arrivals at queue B0 from outside
+            arrivals_B0 = next(arrivals_B)
+            cumulative_input_B += arrivals_B0
+            len_queue_B0 += arrivals_B0
+
+            # arrivals at queue A1 from queue B0
+            len_queue_A1 += out_queue_B0
+
+            # departures from queue A1
+            cumulative_output_A += out_queue_A1
+
+            if profile:
+                profile.lap('arrivals')
+
+            if debug:
+                logger.debug(f'[A0,B1,B0,A1]: {len_queue_A0, len_queue_B1, len_queue_B0, len_queue_A1}')
+                logger.debug(f'cumInput A0: {cumulative_input_A}, cumOutput A1: {cumulative_output_A}')
+                logger.debug(f'cumInput B0: {cumulative_input_B}, cumOutput B1: {cumulative_output_B}')
+                if profile:
+                    profile.lap('debug')
+
+            # save data to recording variable
+            if _time > 0:
+                if record_workload:
+                    recording.append(len_queue_A0 * epsilon, len_queue_A1 * m,
+                                     len_queue_B0 * epsilon, len_queue_B1 * m)
+                else:
+                    recording.append(len_queue_A0 * epsilon, len_queue_A1,
+                                     len_queue_B0 * epsilon, len_queue_B1)
+            if profile:
+                profile.lap('recording')
+
+        _time += steps
+
+    return recording, get_state(runtime)
+
+
+def simulate_blocks(rng, a, epsilon, m, init_a0, runtime, block=2 ** 12, state=None, checkpoint=None,
+                    checkpoint_every=0, show_progress=False, logger=None, record_workload=False, profile=None,
+                    telemetry=None):
+    # The simulation of simulate() as an iterator over blocks of its recording, see SimulationBlocks.
+    kernel = partial(simulate, rng, a, epsilon, m, init_a0, logger=logger, record_workload=record_workload,
+                     profile=profile)
+    return SimulationBlocks(kernel, RECORDING_FIELDS, runtime, block, state, checkpoint, checkpoint_every,
+                            show_progress, logger, telemetry)
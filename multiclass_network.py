@@ -4,9 +4,15 @@ import click
 import logging
 import numpy as np
 import os
-import matplotlib.pyplot as plt
 import time
-from lib.multiclassqueue import MulticlassQueue
+from lib import multiclass
+from lib.cache import SimulationCache
+from lib.multiclass import MODEL, MODEL_VERSION, RECORDING_FIELDS, SCALED_FIELDS
+from lib.plotting import envelope, pyplot, save_figure
+from lib.profiling import Profile
+from lib.randomstream import RandomStream
+from lib.recorder import Recorder, StreamRecorder
+from lib.telemetry import Telemetry
 
 
 @click.command()
@@ -19,36 +25,54 @@ from lib.multiclassqueue import MulticlassQueue
 @click.option('--output-dir', default="./output", help='Set the output directory for pictures.')
 @click.option('--seed', default=8086, help='Seed used to generate random quantities.')
 @click.option('--version', default='', help='Suffix to append to the output files. Example: "v1" ')
-@click.option('--cache/--no-cache', default=False, help='Read the simulation data form a file.', show_default=True)
+@click.option('--cache/--no-cache', default=False, help='Read the simulation data from the cache when available.', show_default=True)
 @click.option('--cache-dir', default="./cache", help='Set the cache directory for simulations.')
+@click.option('--checkpoint-every', default=10 ** 6,
+              help='Store the simulation in the cache every this many steps, so that an interrupted run can be '
+                   'resumed. 0 disables it.')
+@click.option('--cache-max-size', default=None, type=float,
+              help='Evict the least recently used simulations to keep the cache directory below this size in MB.')
 @click.option('--record/--no-record', default=True, help='Record simulation data and pictures to files.', show_default=True)
 @click.option('--debug/--no-debug', default=False, help='Enable debugging behaviour.', show_default=True)
 @click.option('--show-progress/--no-show-progress', default=False, help='Show percentage of simulation completed.', show_default=True)
+@click.option('--stream-record/--no-stream-record', default=False, show_default=True,
+              help='Stream the recording into a memory-mapped file in the cache directory while simulating. '
+                   'Implies --record.')
 @click.option('--color/--no-color', default=False, help='Enable color in the pictures.', show_default=True)
+@click.option('--record-workload/--no-record-workload', default=False, show_default=True,
+              help='Record and plot the workloads of queues A1 and B1 instead of their lengths.')
+@click.option('--profile/--no-profile', default=False, show_default=True,
+              help='Log the time spent in each phase of the simulation steps, with the steps per second.')
+@click.option('--telemetry', default=None,
+              help='Append JSON lines on the progress of the simulation to this file, "-" for stdout: steps per '
+                   'second, time left, last and largest recorded queue lengths, memory and recording size.')
+@click.option('--telemetry-every', default=10., show_default=True, help='Seconds between two telemetry lines.')
+@click.option('--headless/--no-headless', default=False, show_default=True,
+              help='Batch mode: never open a window and only draw the pictures saved to files, with the Agg backend.')
 def main(a, k, epsilon, init_a0, runtime, save_to_file, output_dir, seed,
-         version, cache, cache_dir, record, debug, show_progress, color):
-    len_queue_A0 = len_queue_B0 = None
-    queue_A1 = queue_B1 = None
-    recording = []
+         version, cache, cache_dir, record, debug, show_progress, color,
+         stream_record, cache_max_size, checkpoint_every, record_workload, headless, profile,
+         telemetry, telemetry_every):
+    recording = None
+    rng = None
 
     logging.basicConfig(format='%(levelname)s: %(message)s')
     logger = logging.getLogger(__name__)
     logger.setLevel(level=logging.DEBUG if debug else logging.INFO)
     logger.info(f'a={a}, epsilon={epsilon}, K={k}, init-A0={init_a0}')
 
+    params = dict(a=a, k=k, epsilon=epsilon, init_a0=init_a0, seed=seed,
+                  record_workload=record_workload)  # the runtime is not part of the cache key
+    simulation_cache = SimulationCache(cache_dir, MODEL, MODEL_VERSION,
+                                       None if cache_max_size is None else int(cache_max_size * 2 ** 20),
+                                       SCALED_FIELDS)
+
     def set_seed(s):
+        nonlocal rng
         if s is None:
-            np.random.seed(None)
-            s = np.random.randint(0, 100000)
+            s = int(np.random.default_rng().integers(0, 100000))
         logger.info(f'SEED: {s}')
-        np.random.seed(s)
-
-    def rand_int(n):
-        int_n = int(n)
-        if np.random.random() <= n - int_n:
-            return int_n + 1
-        else:
-            return int_n
+        rng = RandomStream(s)
 
     def get_filename(prefix="simulation", suffix="", type=".pdf"):
         sx = suffix
@@ -60,34 +84,26 @@ def main(a, k, epsilon, init_a0, runtime, save_to_file, output_dir, seed,
                + '_eps' + str(epsilon).replace('.', 'p') \
                + '_r' + str(runtime) \
                + '_seed' + str(seed) \
+               + ('_workload' if record_workload else '') \
                + sx \
                + type
 
-    def save_recording(_dir):
-        _basedir = os.path.join(os.getcwd(), "cache") if _dir is None else _dir
-        _filename = get_filename(type=".npy")
-        np.save(os.path.join(_basedir, _filename), recording)
+    def new_recording(capacity):
+        if stream_record:
+            return StreamRecorder(simulation_cache.file(params), RECORDING_FIELDS, capacity)
+        return Recorder(RECORDING_FIELDS, capacity)
 
-    def load_recording(_dir):
-        _basedir = os.path.join(os.getcwd(), "cache") if _dir is None else _dir
-        _filename = get_filename(type=".npy")
-        return np.load(os.path.join(_basedir, _filename))
+    def save_recording(steps, state=None, snapshot=False):
+        simulation_cache.store(params, recording, steps, state, snapshot)
 
-    def column(matrix, i, j=None):
-        if j is not None:
-            return [row[i][j] for row in matrix]
-        return [row[i] for row in matrix]
+    def save_checkpoint(steps, state):
+        save_recording(steps, state, snapshot=True)
 
-    def rec_r1(time, interval=1, start_at=0):
-        if time > start_at and time % interval == 0:
-            recording.append([len_queue_A0 * epsilon, len(queue_A1),
-                              len_queue_B0 * epsilon, len(queue_B1)])
+    def load_recording():
+        return simulation_cache.load(params, runtime)
 
-    # this is to record workloads
-    def rec_r2(time, interval=1, start_at=0):
-        if time > start_at and time % interval == 0:
-            recording.append([len_queue_A0 * epsilon, queue_A1.workload(),
-                              len_queue_B0 * epsilon, queue_B1.workload()])
+    def load_state(steps):
+        return simulation_cache.load_state(params, steps)
 
     def plot_r1(screen=True, color=False):
         # plot results:
@@ -122,118 +138,74 @@ def main(a, k, epsilon, init_a0, runtime, save_to_file, output_dir, seed,
             if n_fig == 2 and i % 2 == 0:
                 plt.subplot(211+int(i/2)).set_prop_cycle(color=colors, ls=lines)
 
-            label = '$Q_{' + chr(ord('A') + int(i / 2)) + '_' + str(i % 2) + '}' \
+            label = ('$W_{' if record_workload and i % 2 == 1 else '$Q_{') + chr(ord('A') + int(i / 2)) + '_' + str(i % 2) + '}' \
                     + ('' if i % 2 == 1 else '\\times \\epsilon') + '$'
-            plot_data = [l[i] for l in recording]
-            plt.plot(plot_data[0:runtime], lw=1, label=label)
+            plot_data = recording[recording.fields[i]][0:runtime]
+            plt.plot(*envelope(np.arange(len(plot_data)), plot_data), lw=1, label=label)
 
             if (i+1) % int(4/n_fig) == 0:
                 plt.legend(loc=2, fontsize=32, markerscale=0.85, numpoints=1, handlelength=4.5)
 
-    def simulate(a, eps, K, init_A0, runtime):
-        nonlocal len_queue_A0, queue_A1
-        nonlocal len_queue_B0, queue_B1
-        nonlocal init_a0
-
-        len_queue_A0 = init_A0
-        len_queue_B0 = 0
-        queue_A1 = MulticlassQueue(K)
-        queue_B1 = MulticlassQueue(K)
-
-        cumulative_input_A = cumulative_output_A = 0
-        cumulative_input_B = cumulative_output_B = 0
-
-        for _time in range(runtime):
-
-            if show_progress and (_time * 100 / runtime % 1 == 0):
-                logger.info(f'{_time * 100 / runtime}% DONE')
-
-            out_queue_A0 = out_queue_A1 = 0
-            out_queue_B0 = out_queue_B1 = 0
-
-            # Component A
-            if len_queue_A0 >= len(queue_A1) / eps:  # eq. (60)
-                # serving queue A0
-                sigma_A0 = 1/eps
-                service = rand_int(sigma_A0)
-                out_queue_A0 = min(service, len_queue_A0)
-                len_queue_A0 -= out_queue_A0
-            else:
-                # serving queue A1
-                sigma_A1 = 1/(eps*eps)
-                service = rand_int(sigma_A1)
-                out_queue_A1 += queue_A1.serve(service)
-
-            # Component B
-            if len_queue_B0 >= len(queue_B1) / eps:  # eq. (60)
-                # serving queue B0
-                sigma_B0 = 1/eps
-                service = rand_int(sigma_B0)
-                out_queue_B0 = min(service, len_queue_B0)
-                len_queue_B0 -= out_queue_B0
-            else:
-                # serving queue B1
-                sigma_B1 = 1/(eps*eps)
-                service = rand_int(sigma_B1)
-                out_queue_B1 += queue_B1.serve(service)
-
-            # arrivals at queue A0 from outside
-            arrivals_A0 = rand_int(a)
-            cumulative_input_A += arrivals_A0
-            len_queue_A0 += arrivals_A0
-
-            # arrivals at queue B1 from queue A0
-            queue_B1.push(out_queue_A0)  # append packets of class 1 to queue B1
-
-            # departures from queue B1
-            cumulative_output_B += out_queue_B1
-
-            # arrivals at queue B0 from outside
-            arrivals_B0 = rand_int(a)
-            cumulative_input_B += arrivals_B0
-            len_queue_B0 += arrivals_B0
-
-            # arrivals at queue A1 from queue B0
-            queue_A1.push(out_queue_B0)  # append packets of class 1 to queue A1
-
-            # departures from queue A1
-            cumulative_output_A += out_queue_A1
-
-            # logger.debug('maxA: ', max(len_queue_A0, len(queue_A1)), ' maxB: ', max(len_queue_B0, len(queue_B1)))
-            logger.debug(f'[A0,B0,B1,A1]: {[len_queue_A0, len_queue_B0, len(queue_B1), len(queue_A1)]}')
-            logger.debug(f'cumInput A0: {cumulative_input_A}, cumOutput A1: {cumulative_output_A}')
-            logger.debug(f'cumInput B0: {cumulative_input_B}, cumOutput B1: {cumulative_output_B}')
-
-            rec(_time)  # save data to recording variable
+    def simulate(state=None, previous=None):
+        # with a state, the simulation resumes from it and extends the previous recording
+        nonlocal recording
+
+        recording = new_recording(runtime)
+        if state is not None:
+            recording.extend(previous.array())
+
+        keep = record or stream_record
+        simulation_profile = Profile() if profile else None
+        steps = runtime - (0 if state is None else state['time'])
+        simulation_telemetry = None if telemetry is None else \
+            Telemetry(telemetry, telemetry_every, model=MODEL, **params)
+        blocks = multiclass.simulate_blocks(
+            rng, a, epsilon, k, init_a0, runtime, state=state,
+            checkpoint=save_checkpoint if keep else None, checkpoint_every=checkpoint_every,
+            show_progress=show_progress, logger=logger, record_workload=record_workload,
+            profile=simulation_profile, telemetry=simulation_telemetry)
+        blocks.record(recording, save_recording if keep else None)
+        state = blocks.state
+        if profile:
+            for line in simulation_profile.report(steps):
+                logger.info(line)
 
         # Save recording to file
-        if record:
-            save_recording(cache_dir)
+        if keep:
+            save_recording(runtime, state)
 
     # define the recording and the plotting functions
-    rec = rec_r1
     plot = plot_r1
 
+    cached_runtime = 0
     if cache:
+        recording, cached_runtime = load_recording()
+    if cached_runtime == runtime:
         logger.warning('Reading from CACHE')
-        recording = load_recording(cache_dir)
     else:
-        set_seed(seed)
+        cached_state = load_state(cached_runtime) if cached_runtime > 0 else None
+        if cached_state is None:
+            set_seed(seed)
+        else:
+            logger.warning(f'Extending the CACHED simulation from time {cached_runtime}')
         start = time.time()
-        simulate(a, epsilon, k, init_a0, runtime)
+        simulate(cached_state, recording)
         end = time.time()
         logger.info(f'Simulation time: {end - start}')
 
-    plot(color=color)
-    plt.show()
+    if headless and not save_to_file:
+        return  # no picture to draw
+
+    plt = pyplot(headless)
+    if not headless:
+        plot(color=color)
+        plt.show()
 
     if save_to_file:
         plot(screen=False, color=color)
         basedir = os.path.expanduser("~") + '/Desktop/' if output_dir is None else output_dir
-        filename = get_filename(suffix=version)
-        plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300)
-        filename = get_filename(suffix=version, type=".jpeg")
-        plt.savefig(os.path.join(basedir, filename), bbox_inches='tight', dpi=300, format='JPG')
+        save_figure(plt.gcf(), [os.path.join(basedir, get_filename(suffix=version)),
+                                os.path.join(basedir, get_filename(suffix=version, type=".jpeg"))])
 
 
 if __name__ == "__main__":
@@ -0,0 +1,80 @@
+# THIS FILE RUNS GRIDS OF SIMULATIONS OF THE NETWORKS ABOVE
+
+import click
+import csv
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from lib.sweep import MODELS, cost, grid, run
+
+
+@click.command()
+@click.argument('model', type=click.Choice(list(MODELS)))
+@click.option('--grid', 'grid_values', multiple=True,
+              help='Values taken by a parameter, e.g. "a=0.55,0.6". Repeat it to sweep several parameters.')
+@click.option('--runtime', default=5 * 10 ** 4, help='Discrete time simulation length.')
+@click.option('--seed', default=8086, help='Root seed from which the random streams of all the simulations are spawned.')
+@click.option('--workers', default=None, type=int, help='Number of worker processes. Defaults to the number of cores.')
+@click.option('--output-dir', default="./output", help='Set the output directory for the summary table.')
+@click.option('--summary', default=None, help='File of the summary table. Defaults to a CSV file in the output directory.')
+@click.option('--cache-dir', default="./cache", help='Set the cache directory for simulations.')
+@click.option('--checkpoint-every', default=10 ** 6,
+              help='Store each simulation in the cache every this many steps, so that an interrupted sweep can be '
+                   'resumed. 0 disables it.')
+@click.option('--cache-max-size', default=None, type=float,
+              help='Evict the least recently used simulations to keep the cache directory below this size in MB.')
+@click.option('--telemetry', default=None,
+              help='Append JSON lines on the progress of each simulation to this file, "-" for stdout: steps per '
+                   'second, time left, last and largest recorded queue lengths, memory and recording size.')
+@click.option('--telemetry-every', default=10., show_default=True,
+              help='Seconds between two telemetry lines of a simulation.')
+def main(model, grid_values, runtime, seed, workers, output_dir, summary, cache_dir, checkpoint_every, cache_max_size,
+         telemetry, telemetry_every):
+    logging.basicConfig(format='%(levelname)s: %(message)s')
+    logger = logging.getLogger(__name__)
+    logger.setLevel(level=logging.INFO)
+
+    def parse(value):
+        try:
+            return int(value)
+        except ValueError:
+            return float(value)
+
+    values = {}
+    for spec in grid_values:
+        name, _, spec_values = spec.partition('=')
+        name = name.strip().lower().replace('-', '_')
+        if name not in MODELS[model][1] or not spec_values:
+            raise click.BadParameter(f'"{spec}", the parameters of {model} are {", ".join(MODELS[model][1])}',
+                                     param_hint='--grid')
+        values[name] = [parse(v) for v in spec_values.split(',')]
+
+    # the longest simulations go first, so that no core is left with a long one at the end
+    points = sorted(grid(model, values), key=lambda params: cost(model, params, runtime), reverse=True)
+    logger.info(f'{len(points)} simulations of {model}, SEED: {seed}')
+
+    max_size = None if cache_max_size is None else int(cache_max_size * 2 ** 20)
+    rows = []
+    with ProcessPoolExecutor(workers) as executor:
+        jobs = {executor.submit(run, model, params, seed, runtime, cache_dir, checkpoint_every, max_size,
+                                telemetry, telemetry_every): params
+                for params in points}
+        for job in as_completed(jobs):
+            row = job.result()
+            rows.append(row)
+            logger.info(f'[{len(rows)}/{len(points)}] {jobs[job]} '
+                        + ('read from CACHE' if row['cached'] else f'simulated in {row["time"]:.1f}s'))
+
+    rows.sort(key=lambda row: [row[name] for name in MODELS[model][1]])
+    if summary is None:
+        summary = os.path.join(output_dir, f'sweep_{model}_r{runtime}_seed{seed}.csv')
+    os.makedirs(os.path.dirname(os.path.abspath(summary)), exist_ok=True)
+    with open(summary, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+    logger.info(f'Summary written to {summary}')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from lib import compact
+
+EPSILON = 0.1791
+
+
+def recording(length: int, shape=(), seed: int = 0):
+    # queue lengths as random walks, one multiplied by epsilon, flows of a few packets and a series of floats
+    rng = np.random.default_rng(seed)
+    walk = np.abs(np.cumsum(rng.integers(-3, 4, (length,) + shape), axis=0))
+    array = np.empty((length,) + shape, [('A0', np.float64), ('A1', np.int64), ('in', np.int64), ('x', np.float64)])
+    array['A0'] = walk * EPSILON
+    array['A1'] = walk[::-1] * 1000
+    array['in'] = rng.integers(0, 7, (length,) + shape)
+    array['x'] = rng.random((length,) + shape)
+    return array
+
+
+@pytest.mark.parametrize('shape', [(), (3,)])
+def test_read_gives_back_what_was_written(tmp_path, shape):
+    array = recording(1000, shape)
+    file = tmp_path / 'recording.rec'
+    compact.write(file, array, {'A0': EPSILON}, chunk=128)
+    recorded = compact.CompactFile(file)
+    assert len(recorded) == 1000 and recorded.dtype == array.dtype and recorded.shape == shape
+    assert np.array_equal(recorded.read(), array)
+    for start, stop in [(0, 1), (127, 129), (128, 256), (300, 999), (999, 1000), (500, 5000), (10, 10)]:
+        assert np.array_equal(recorded.read(start, stop), array[start:stop])
+    assert np.array_equal(recorded.read(200, 700, ['x', 'A0']), array[['x', 'A0']][200:700])
+
+
+def test_scaled_fields_are_stored_as_integers(tmp_path):
+    array = recording(5000)
+    compact.write(tmp_path / 'scaled.rec', array, {'A0': EPSILON, 'x': EPSILON})
+    compact.write(tmp_path / 'unscaled.rec', array)
+    chunk = compact.CompactFile(tmp_path / 'scaled.rec').chunks[0]['fields']
+    assert chunk['A0']['scale'] == EPSILON and np.dtype(chunk['A0']['dtype']).kind == 'i'
+    assert chunk['x']['scale'] is None  # the floats that are not multiples of the scale are kept as they are
+    assert np.array_equal(compact.CompactFile(tmp_path / 'scaled.rec').read(), array)
+    assert (tmp_path / 'scaled.rec').stat().st_size < (tmp_path / 'unscaled.rec').stat().st_size
+
+
+def test_append_extends_the_file(tmp_path):
+    array = recording(2000)
+    file = tmp_path / 'recording.rec'
+    compact.write(file, array[:10], {'A0': EPSILON}, chunk=256)
+    for stop in [10, 255, 256, 700, 1024, 1030, 2000]:
+        compact.append(file, array[:stop], {'A0': EPSILON})
+        recorded = compact.CompactFile(file)
+        assert len(recorded) == stop
+        assert np.array_equal(recorded.read(), array[:stop])
+    assert all(chunk['rows'] == 256 for chunk in recorded.chunks[:-1])
+
+
+def test_a_file_of_another_format_is_rejected(tmp_path):
+    file = tmp_path / 'recording.rec'
+    compact.write(file, recording(100))
+    data = file.read_bytes()
+    file.write_bytes(data[:-1])  # interrupted while the index was written
+    with pytest.raises(ValueError):
+        compact.CompactFile(file)
+    file.write_bytes(b'MWREC1\n' + data[7:])
+    with pytest.raises(ValueError):
+        compact.CompactFile(file)
+
+
+def test_recording_decodes_where_it_is_indexed(tmp_path):
+    array = recording(1000, (2,))
+    file = tmp_path / 'recording.rec'
+    compact.write(file, array, {'A0': EPSILON}, chunk=100)
+    lazy = compact.CompactRecording(compact.CompactFile(file), 900)
+    cut = array[:900]
+    assert len(lazy) == 900 and lazy.fields == list(array.dtype.names)
+    assert np.array_equal(lazy.array(), cut)
+    series = lazy['A1']
+    assert series.shape == (900, 2)
+    for key in [0, 899, -1, -900, slice(None), slice(150, 420), slice(-50, None), slice(800, 2000),
+                slice(10, 5), slice(3, 500, 7), np.array([5, 1, 850])]:
+        assert np.array_equal(series[key], cut['A1'][key])
+    for key in [900, -901]:
+        with pytest.raises(IndexError):
+            series[key]
+    assert np.array_equal(np.asarray(lazy['A0']), cut['A0'])
+    assert np.array_equal(lazy.replica(1)['in'][250:260], cut['in'][250:260, 1])
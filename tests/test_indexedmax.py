@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from lib.indexedmax import IndexedMax
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 5, 8, 13])
+def test_indexed_max_matches_numpy(n):
+    # few distinct values, so that there are ties to break
+    rng = np.random.default_rng(n)
+    values = rng.integers(0, 3, n)
+    tree = IndexedMax(values)
+    for _ in range(500):
+        assert tree.argmax() == np.argmax(values) and tree.max() == values.max()
+        assert tree.argmin() == np.argmin(values) and tree.min() == values.min()
+        i, delta = int(rng.integers(n)), int(rng.integers(-2, 3))
+        tree.add(i, delta)
+        values[i] += delta
+    assert list(tree) == values.tolist() and len(tree) == n
+
+
+def test_ties_go_to_the_lowest_index():
+    tree = IndexedMax([4, 1, 4, 1, 4])
+    assert tree.argmax() == 0 and tree.argmin() == 1
+    tree.add(0, -3)
+    assert tree.argmax() == 2 and tree.argmin() == 0
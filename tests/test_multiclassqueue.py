@@ -0,0 +1,132 @@
+import collections
+import random
+import pytest
+from lib.multiclassqueue import MulticlassQueue
+
+
+class DequeMulticlassQueue:
+    # The queue as it was first written, with a deque of runs served one at a time and the workload summed
+    # over the runs: the reference that MulticlassQueue must match, run for run.
+
+    def __init__(self, n_classes: int = 1):
+        self.n_classes = n_classes
+        self.q_classes = collections.deque()
+        self.q_packets = collections.deque()
+        self.n_packets = 0
+
+    def push(self, n: int = 1):
+        if n == 0:
+            return
+        self.q_classes.append(1)
+        self.q_packets.append(n)
+        self.n_packets += n
+
+    def serve(self, amount: int = 1) -> int:
+        exit_packets = 0
+        max_class = 1
+        inc_class = 1
+        cycle_it = 0
+        cycle_len = len(self.q_packets)
+        while amount > 0 and self.n_packets > 0:
+            if cycle_it == cycle_len:
+                cycle_it = 0
+                cycle_len = len(self.q_packets)
+                am_ppk = max(int(amount / self.n_packets), 1)
+                inc_class = min(am_ppk, self.n_classes - max_class + 1)
+                max_class = 1
+
+            pkt_class, pkt_n = self.q_classes[0], self.q_packets[0]
+            serving = min(pkt_n, amount)
+            pkt_class += inc_class
+            if pkt_class <= self.n_classes:
+                self.q_classes.append(pkt_class)
+                self.q_packets.append(serving)
+                max_class = max(max_class, pkt_class)
+            elif pkt_class == self.n_classes + 1:
+                self.n_packets -= serving
+                exit_packets += serving
+            else:
+                raise Exception('Error')
+
+            if pkt_n > amount:
+                self.q_packets[0] = pkt_n - amount
+            else:
+                self.q_classes.popleft()
+                self.q_packets.popleft()
+            amount -= serving * inc_class
+            cycle_it += 1
+        return exit_packets
+
+    def workload(self):
+        return sum((self.n_classes - cl) * n for cl, n in zip(self.q_classes, self.q_packets))
+
+    def runs(self):
+        return list(zip(self.q_classes, self.q_packets))
+
+    def __len__(self):
+        return self.n_packets
+
+
+def runs(queue: MulticlassQueue):
+    return list(zip(queue.classes[queue.head:], queue.counts[queue.head:]))
+
+
+def test_serve_matches_the_deque_queue(monkeypatch):
+    # random pushes and services, from a unit to many cycles of the queue, on queues of few to many classes
+    calls = collections.Counter()
+    for method in ('serve_cycle', 'skip_cycles'):
+        original = getattr(MulticlassQueue, method)
+        monkeypatch.setattr(MulticlassQueue, method,
+                            lambda self, *args, method=method, original=original:
+                            calls.update([method]) or original(self, *args))
+
+    for seed in range(40):
+        rng = random.Random(seed)
+        n_classes = rng.choice([1, 2, rng.randint(3, 20), rng.randint(20, 60)])
+        queue, reference = MulticlassQueue(n_classes), DequeMulticlassQueue(n_classes)
+        for _ in range(300):
+            n = rng.choice([0, 1, rng.randint(1, 10), rng.randint(1, 300)])
+            queue.push(n)
+            reference.push(n)
+            amount = rng.choice([1, rng.randint(1, 40), rng.randint(1, 3000), rng.randint(1, 10 ** 5)])
+            assert queue.serve(amount) == reference.serve(amount)
+            assert len(queue) == len(reference)
+            assert runs(queue) == reference.runs()
+            assert queue.workload() == reference.workload()
+            queue.check_workload()
+
+    assert calls['serve_cycle'] > 0 and calls['skip_cycles'] > 0
+
+
+def test_skip_cycles_up_to_the_departures():
+    # services of many cycles that take every class out of the queue, or stop one class short of it
+    for amount in range(1, 400):
+        queue, reference = MulticlassQueue(7), DequeMulticlassQueue(7)
+        for n in (3, 1, 4, 1, 5):
+            queue.push(n)
+            reference.push(n)
+            queue.serve(2)
+            reference.serve(2)
+        assert queue.serve(amount) == reference.serve(amount)
+        assert runs(queue) == reference.runs()
+        assert queue.workload() == reference.workload()
+        queue.check_workload()
+
+
+def test_workload_follows_pushes_and_departures():
+    queue = MulticlassQueue(5)
+    queue.push(3)
+    assert queue.workload() == 12
+    assert queue.serve(6) == 0  # the three packets up two classes
+    assert queue.workload() == 6
+    assert queue.serve(100) == 3
+    assert queue.workload() == 0 and len(queue) == 0
+    queue.check_workload()
+
+
+def test_check_workload_detects_a_wrong_workload():
+    queue = MulticlassQueue(5)
+    queue.push(3)
+    queue.total_workload += 1
+    with pytest.raises(Exception, match='differs'):
+        queue.check_workload()
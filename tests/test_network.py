@@ -0,0 +1,102 @@
+import functools
+import logging
+import pickle
+import numpy as np
+import pytest
+from lib import multiclass, network, rybkostolyar, variablespeed
+from lib.randomstream import RandomStream
+
+# the networks of the figures, with the kernel each one reproduces and the conversion of its recording
+MODELS = {
+    'rybko-stolyar': (network.rybko_stolyar, rybkostolyar.simulate,
+                      lambda recording, params: network.rybko_stolyar_recording(recording, params['j'])),
+    'multiclass': (network.multiclass, multiclass.simulate,
+                   lambda recording, params: network.two_component_recording(recording, params['epsilon'])),
+    'variable-speed': (network.variable_speed, variablespeed.simulate,
+                       lambda recording, params: network.two_component_recording(recording, params['epsilon'])),
+}
+PARAMETERS = [
+    ('rybko-stolyar', dict(a=7/12, nu=6, j=30, init_a0=2400)),
+    ('rybko-stolyar', dict(a=0.4, nu=3, j=4, init_a0=50, init_aj=3, init_b0=7, init_bj=1)),
+    ('multiclass', dict(a=1, epsilon=0.1791, k=20, init_a0=55)),
+    ('multiclass', dict(a=0.8, epsilon=0.25, k=3, init_a0=0)),
+    ('variable-speed', dict(a=1, epsilon=0.1791, m=20, init_a0=55)),
+    ('variable-speed', dict(a=1.5, epsilon=0.1, m=60, init_a0=300)),
+]
+RUNTIME = 12000
+
+
+def step_by_step():
+    # the engine only moves the queues one step at a time with debug logging, which is dropped here
+    logger = logging.getLogger('tests.network.step_by_step')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    return logger
+
+
+def run(model, params, seed, runtime, logger=None, state=None, recording=None):
+    # small blocks of random values, so that the fast-forward is often cut at the end of one
+    rng = None if state is not None else RandomStream(seed, 2 ** 9)
+    return network.simulate(MODELS[model][0](**params), rng, runtime, recording=recording, state=state,
+                            logger=logger)
+
+
+@functools.lru_cache(maxsize=None)
+def reference(model, items, seed):
+    # the recording and the final state step by step, once for all the tests
+    return run(model, dict(items), seed, RUNTIME, step_by_step())
+
+
+@pytest.mark.parametrize('model, params', PARAMETERS)
+@pytest.mark.parametrize('seed', range(2))
+def test_network_matches_the_kernel(model, params, seed):
+    _, kernel, convert = MODELS[model]
+    recording, _ = run(model, params, seed, RUNTIME)
+    expected, _ = kernel(RandomStream(seed, 2 ** 9), runtime=RUNTIME, **params)
+    assert np.array_equal(convert(recording, params).array(), expected.array())
+
+
+@pytest.mark.parametrize('model, params', PARAMETERS)
+@pytest.mark.parametrize('seed', range(2))
+def test_fast_forward_matches_step_by_step(model, params, seed):
+    recording, state = run(model, params, seed, RUNTIME)
+    expected, expected_state = reference(model, tuple(params.items()), seed)
+    assert np.array_equal(recording.array(), expected.array())
+    assert state['lengths'] == expected_state['lengths']
+
+
+@pytest.mark.parametrize('model, params', PARAMETERS)
+@pytest.mark.parametrize('stop', [1, 777, 9999])
+def test_network_resumes_from_a_state(model, params, stop):
+    # the first part is pickled as in the cache
+    recording, state = run(model, params, 1, stop)
+    recording, state = run(model, params, 1, RUNTIME, state=pickle.loads(pickle.dumps(state)), recording=recording)
+    expected, expected_state = reference(model, tuple(params.items()), 1)
+    assert np.array_equal(recording.array(), expected.array())
+    assert state['lengths'] == expected_state['lengths']
+
+
+# networks with several weights, routed arrivals and a queue served by another station than the one it is routed
+# to, with a multiclass queue; and a station fed by arrival streams that draw their queues
+NETWORKS = [
+    dict(station=[0, 0, 0, 1, 1, 2], weight=[1, 2, 2, 1, 0.5, 3],
+         service=[2, ('rand_int', 3.3), ('binomial', 10, 0.3), 1, ('rand_int', 1.5), 4], routing={1: 4, 3: 5, 4: 0},
+         arrivals=[(('bernoulli', 0.6), [0, 1, 2]), (('rand_int', 0.7), [3, 5])], init=[5, 0, 9, 0, 3, 1],
+         queues={4: functools.partial(network.MulticlassQueue, 3)}),
+    dict(station=[0, 0, 0], weight=[1, 3, 2.5], service=[('rand_int', 3.3), 2, ('bernoulli', 0.7)],
+         arrivals=[(('rand_int', 1.2), [2]), (('rand_int', 0.4), [1, 0]), (('rand_int', 0.4), [0, 2, 1])],
+         init=[28, 26, 25]),
+]
+
+
+@pytest.mark.parametrize('params', NETWORKS)
+@pytest.mark.parametrize('sequential', [False, True])
+@pytest.mark.parametrize('arrivals_first', [False, True])
+def test_fast_forward_matches_step_by_step_on_other_networks(params, sequential, arrivals_first):
+    net = network.Network(**params, sequential=sequential, arrivals_first=arrivals_first)
+    recording, state = network.simulate(net, RandomStream(3, 2 ** 9), RUNTIME)
+    expected, expected_state = network.simulate(net, RandomStream(3, 2 ** 9), RUNTIME, logger=step_by_step())
+    assert np.array_equal(recording.array(), expected.array())
+    assert state['lengths'] == expected_state['lengths']
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from lib import pyramid
+
+BLOCK = 16  # small blocks, for pyramids of several levels over short recordings
+
+
+def recording(length: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    array = np.empty(length, [('A0', np.int64), ('x', np.float64)])
+    array['A0'] = np.abs(np.cumsum(rng.integers(-2, 3, length)))
+    array['x'] = rng.normal(size=length).cumsum()
+    return array
+
+
+def windows(length: int, rng, n: int = 200):
+    # windows of every size, aligned on the blocks or not, up to the end of the recording
+    starts = rng.integers(0, length, n)
+    stops = np.minimum(starts + rng.integers(0, length, n) // rng.integers(1, 50, n) + 1, length)
+    fixed = [(0, length), (0, BLOCK), (BLOCK, 5 * BLOCK), (3, 4 * BLOCK - 1), (length - 1, length)]
+    return list(zip(starts.tolist(), stops.tolist())) + [(a, b) for a, b in fixed if b <= length]
+
+
+@pytest.mark.parametrize('length', [1, 15, 16, 17, 1000, 4096, 5001])
+def test_stats_match_numpy(tmp_path, length):
+    array = recording(length)
+    built = pyramid.build(array, BLOCK)
+    pyramid.write(tmp_path / 'recording.pyr', built)
+    loaded = pyramid.load(tmp_path / 'recording.pyr')
+    for start, stop in windows(length, np.random.default_rng(length)):
+        for name in array.dtype.names:
+            values = array[name][start:stop]
+            for tree in (built, loaded):
+                low, high, mean = tree.stats(array, name, start, stop)
+                assert low == values.min() and high == values.max()
+                assert mean == pytest.approx(values.mean(), rel=1e-9, abs=1e-9)
+
+
+def test_stats_of_a_longer_recording():
+    # the rows after the length of the pyramid are read from the recording
+    array = recording(3000)
+    built = pyramid.build(array[:2000], BLOCK)
+    low, high, mean = built.stats(array, 'A0', 1500, 3000)
+    assert (low, high) == (array['A0'][1500:].min(), array['A0'][1500:].max())
+    assert mean == pytest.approx(array['A0'][1500:].mean())
+
+
+def test_first_and_last_match_numpy():
+    array = recording(5000)
+    built = pyramid.build(array, BLOCK)
+    rng = np.random.default_rng(1)
+    for level in np.quantile(array['A0'], [0, 0.3, 0.9, 0.999, 1]).astype(int).tolist() + [array['A0'].max() + 1]:
+        def condition(rows):
+            return array['A0'][rows] >= level
+
+        def bound(blocks):
+            return blocks['max']['A0'] >= level
+
+        for low, high in windows(len(array), rng):
+            hits = low + np.flatnonzero(array['A0'][low:high] >= level)
+            assert built.first(condition, bound, low, high) == (hits[0] if len(hits) else high)
+            assert built.last(condition, bound, low, high) == (hits[-1] if len(hits) else low)
@@ -0,0 +1,94 @@
+import pickle
+import numpy as np
+import pytest
+from lib.randomstream import RandomStream
+
+BLOCK = 7  # small blocks, so that the sequences cross many of them
+
+
+def streams(source: RandomStream):
+    return [source.bernoulli(0.3), source.integers(5), source.rand_int(2.6), source.binomial(11.4, 0.2)]
+
+
+def reference(seed: int, n: int):
+    # the values of each stream drawn one at a time with next(), the streams taking turns
+    values = [[] for _ in streams(RandomStream(seed, BLOCK))]
+    draws = streams(RandomStream(seed, BLOCK))
+    for _ in range(n):
+        for stream, drawn in zip(draws, values):
+            drawn.append(next(stream))
+    return values
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_peek_and_skip_give_the_values_of_next(seed):
+    n = 200
+    expected = reference(seed, n)
+    draws = streams(RandomStream(seed, BLOCK))
+    rng = np.random.default_rng(seed)
+    got = [[] for _ in draws]
+    position = 0
+    while position < n:
+        # the streams are moved on together, as the kernels do, by next() or by peeking and skipping
+        # up to the end of their current blocks
+        left = min(stream.left() for stream in draws)
+        if left > 0 and rng.random() < 0.7:
+            steps = min(int(rng.integers(1, left + 1)), n - position)
+            for stream, drawn in zip(draws, got):
+                assert stream.left() >= steps
+                drawn.extend(stream.peek(steps).tolist())
+                stream.skip(steps)
+        else:
+            steps = 1
+            for stream, drawn in zip(draws, got):
+                drawn.append(next(stream))
+        position += steps
+    assert got == expected
+
+
+def test_left_counts_the_values_of_the_current_block():
+    stream = RandomStream(0, BLOCK).rand_int(1.5)
+    assert stream.left() == 0
+    next(stream)
+    assert stream.left() == BLOCK - 1
+    values = stream.peek(BLOCK - 1)
+    assert len(values) == BLOCK - 1 and stream.left() == BLOCK - 1
+    stream.skip(BLOCK - 1)
+    assert stream.left() == 0
+    next(stream)  # draws the next block
+    assert stream.left() == BLOCK - 1
+
+
+@pytest.mark.parametrize('consumed', [0, 1, BLOCK - 1, BLOCK, 3 * BLOCK + 2])
+def test_unpickled_streams_resume_the_same_sequence(consumed):
+    source = RandomStream(42, BLOCK)
+    draws = streams(source)
+    for _ in range(consumed):
+        for stream in draws:
+            next(stream)
+    # pickled together, the streams keep sharing the generator of their source
+    copy = pickle.loads(pickle.dumps(draws))
+    assert copy[0].source is copy[1].source
+    for _ in range(5 * BLOCK):
+        for stream, copied in zip(draws, copy):
+            assert next(copied) == next(stream)
+
+
+def test_unpickled_streams_resume_after_a_skip():
+    draws = streams(RandomStream(3, BLOCK))
+    for stream in draws:
+        next(stream)
+        stream.skip(stream.left() - 2)
+    copy = pickle.loads(pickle.dumps(draws))
+    for stream, copied in zip(draws, copy):
+        assert copied.left() == 2
+        assert copied.peek(2).tolist() == stream.peek(2).tolist()
+    for _ in range(3 * BLOCK):
+        for stream, copied in zip(draws, copy):
+            assert next(copied) == next(stream)
+
+
+def test_rand_int_has_the_mean_asked_for():
+    values = RandomStream(0).rand_int(2.3).draw(np.random.default_rng(0))
+    assert set(values) == {2, 3}
+    assert abs(np.mean(values) - 2.3) < 0.02
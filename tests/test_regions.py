@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+from lib import compact, pyramid, rybkostolyar
+from lib.randomstream import RandomStream
+
+NU = 6
+EMPTY_A0 = NU ** 2
+LEVELS = [1000, 2000, 3000]
+RUNTIME = 100000  # with J=30 and A0=1200, long enough for queue B0 to go past 3000 and come back
+
+
+def loop_regions(recording, nu, level, empty_A0):
+    # the loops of the script that find_regions replaced, but for the end of the window, which is now kept
+    # within the recording
+    margin_left = 0
+    margin_right = 0.15
+    rec_queue_A0 = recording['A0']
+    rec_max_queue_Aj = recording['maxAj']
+    rec_queue_B0 = recording['B0']
+    rec_max_queue_Bj = recording['maxBj']
+
+    reach_level = 0
+    for x in rec_queue_B0:
+        if x >= level:
+            break
+        reach_level += 1
+
+    reach_empty_queue_A0 = reach_level
+    for x in rec_queue_A0[reach_level:]:
+        if x <= empty_A0:
+            break
+        reach_empty_queue_A0 += 1
+
+    previous_empty_queue_A0 = reach_level
+    for x in range(reach_level):
+        if rec_queue_A0[reach_level - x] <= empty_A0:
+            break
+        previous_empty_queue_A0 -= 1
+
+    start_equilibrium = previous_empty_queue_A0
+    for x in range(reach_level - previous_empty_queue_A0):
+        if rec_queue_A0[previous_empty_queue_A0 + x] <= nu * rec_max_queue_Aj[previous_empty_queue_A0 + x]:
+            break
+        start_equilibrium += 1
+
+    end_equilibrium = reach_empty_queue_A0
+    for x in range(len(rec_queue_A0[reach_empty_queue_A0:])):
+        if rec_queue_B0[reach_empty_queue_A0 + x] <= nu * rec_max_queue_Bj[reach_empty_queue_A0 + x]:
+            break
+        end_equilibrium += 1
+
+    start = start_equilibrium - int((end_equilibrium - start_equilibrium) * margin_left)
+    end = end_equilibrium + int((end_equilibrium - start_equilibrium) * margin_right)
+    return [start, [start_equilibrium, reach_empty_queue_A0, end_equilibrium], min(end, len(rec_queue_A0))]
+
+
+@pytest.fixture(scope='module', params=range(3))
+def recording(request):
+    recording, _ = rybkostolyar.simulate(RandomStream(request.param), 7/12, NU, 30, RUNTIME, init_a0=1200)
+    return recording.array()
+
+
+@pytest.mark.parametrize('level', LEVELS)
+def test_regions_match_the_loops(recording, level):
+    expected = loop_regions(recording, NU, level, EMPTY_A0)
+    assert expected[1][0] <= expected[1][1] < expected[1][2] < RUNTIME  # a cut region within the run
+    assert rybkostolyar.find_regions(recording, NU, level, EMPTY_A0) == expected
+
+
+@pytest.mark.parametrize('block', [64, pyramid.BLOCK])
+def test_regions_from_the_pyramid_match_the_loops(recording, block):
+    built = pyramid.build(recording, block)
+    for level in LEVELS:
+        expected = loop_regions(recording, NU, level, EMPTY_A0)
+        assert rybkostolyar.find_regions(recording, NU, level, EMPTY_A0, pyramid=built) == expected
+
+
+def test_regions_from_the_cached_files_match_the_loops(tmp_path, recording):
+    # the recording and its pyramid as the script reads them from the cache
+    compact.write(tmp_path / 'recording.rec', recording)
+    pyramid.write(tmp_path / 'recording.pyr', pyramid.build(recording))
+    cached = compact.CompactRecording(compact.CompactFile(tmp_path / 'recording.rec'))
+    loaded = pyramid.load(tmp_path / 'recording.pyr')
+    for level in LEVELS:
+        expected = loop_regions(recording, NU, level, EMPTY_A0)
+        assert rybkostolyar.find_regions(cached, NU, level, EMPTY_A0, pyramid=loaded) == expected
+
+
+def test_regions_of_each_replica_match_the_loops(recording):
+    # windows of the run starting at different times, as the columns of the recording of replicas
+    offsets = [0, 5000, 20000, 40000]
+    length = RUNTIME - offsets[-1]
+    replicas = np.stack([recording[offset:offset + length] for offset in offsets], axis=1)
+    start, divisions, end = rybkostolyar.find_regions(replicas, NU, 2000, EMPTY_A0)
+    for i, offset in enumerate(offsets):
+        column = recording[offset:offset + length]
+        if column['B0'].max() < 2000:
+            continue  # the loops fail when the level is never reached
+        expected = loop_regions(column, NU, 2000, EMPTY_A0)
+        assert [int(start[i]), [int(d[i]) for d in divisions], int(end[i])] == expected
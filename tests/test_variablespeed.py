@@ -0,0 +1,78 @@
+import functools
+import logging
+import pickle
+import numpy as np
+import pytest
+from lib import variablespeed
+from lib.profiling import Profile
+from lib.randomstream import RandomStream
+
+PARAMETERS = [dict(a=1, epsilon=0.1791, m=20, init_a0=55), dict(a=0.8, epsilon=0.25, m=4, init_a0=0),
+              dict(a=1.5, epsilon=0.1, m=60, init_a0=300)]
+RUNTIME = 12000
+
+
+def step_by_step():
+    # the kernels only move the queues one step at a time with debug logging, which is dropped here
+    logger = logging.getLogger('tests.variablespeed.step_by_step')
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    return logger
+
+
+def run(seed, params, runtime, logger=None, state=None, recording=None, record_workload=False, block=2 ** 9):
+    # small blocks of random values, so that the fast-forward is often cut at the end of one
+    rng = None if state is not None else RandomStream(seed, block)
+    return variablespeed.simulate(rng, runtime=runtime, logger=logger, state=state, recording=recording,
+                                  record_workload=record_workload, **params)
+
+
+@functools.lru_cache(maxsize=None)
+def reference(seed, items, record_workload=False):
+    # the recording and the final state step by step, which are slow, once for all the tests
+    return run(seed, dict(items), RUNTIME, step_by_step(), record_workload=record_workload)
+
+
+def assert_same_state(state, expected):
+    for name, value in expected.items():
+        if name.startswith(('services', 'arrivals')):
+            assert (value.index, value.origin) == (state[name].index, state[name].origin), name
+        else:
+            assert state[name] == value, name
+
+
+@pytest.mark.parametrize('params', PARAMETERS)
+@pytest.mark.parametrize('seed', range(2))
+def test_fast_forward_matches_step_by_step(seed, params):
+    recording, state = run(seed, params, RUNTIME)
+    expected, expected_state = reference(seed, tuple(params.items()))
+    assert len(recording) == RUNTIME - 1
+    assert np.array_equal(recording.array(), expected.array())
+    assert_same_state(state, expected_state)
+
+
+@pytest.mark.parametrize('params', PARAMETERS)
+def test_fast_forward_records_the_same_workloads(params):
+    recording, _ = run(0, params, RUNTIME, record_workload=True)
+    expected, _ = reference(0, tuple(params.items()), True)
+    assert np.array_equal(recording.array(), expected.array())
+
+
+@pytest.mark.parametrize('params', PARAMETERS)
+@pytest.mark.parametrize('stop', [1, 2, 777, 4096, 9999])
+def test_fast_forward_resumes_from_a_state(params, stop):
+    # the first part is run with fast-forward, and the state pickled as in the cache
+    recording, state = run(1, params, stop)
+    recording, state = run(1, params, RUNTIME, state=pickle.loads(pickle.dumps(state)), recording=recording)
+    expected, expected_state = reference(1, tuple(params.items()))
+    assert np.array_equal(recording.array(), expected.array())
+    assert_same_state(state, expected_state)
+
+
+def test_fast_forward_moves_most_steps_at_once():
+    # without this, the tests above would pass with the fast-forward never taken
+    profile = Profile()
+    variablespeed.simulate(RandomStream(0, 2 ** 9), runtime=RUNTIME, profile=profile, **PARAMETERS[0])
+    assert profile.steps['fast-forward'] > RUNTIME / 2